@@ -1,15 +1,23 @@
 # agent_orchestrator.py
-from langchain_gigachat import GigaChat
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-import os
+import asyncio
 import json
+import os
+import re
+import time
+from typing import Awaitable, Callable, List, Optional
+from utils.llm_pool import register_chain, arun_chain, prompt_version, summarize_usage, track_usage, run_sync
+from utils.router import get_local_router, normalize_query
+from utils.answer_cache import get_answer_cache
+from utils.single_flight import SingleFlight
+from utils.metrics import AGENT_REQUESTS, span, track_spans
 
 # Импорт агентов
-from agents.document_analyst import analyze_document
-from agents.marketing_expert import generate_ab_tests
-from agents.technical_reviewer import answer_technical_question
-from agents.summarizer import summarize_document
+from agents.document_analyst import aanalyze_document
+from agents.marketing_expert import (INDUSTRY_LOCAL_THRESHOLD, adetect_document_industry, agenerate_ab_tests,
+                                     detect_industry_locally, get_industry_prompts)
+from agents.technical_reviewer import aanswer_technical_question, build_context
+from agents.summarizer import asummarize_document, document_hash, fits_context
 
 # Описание агентов для LLM-диспетчера
 AGENT_DESCRIPTIONS = """
@@ -20,34 +28,68 @@ AGENT_DESCRIPTIONS = """
 4. **document_analyst** — проводит глубокий анализ структуры и компонентов документа.
 """
 
-def route_with_llm(user_query: str) -> dict:
+ROUTER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Ты — диспетчер многоагентной системы. "
+               "Выбери ОДИН наиболее подходящий агент для запроса пользователя и кратко обоснуй выбор (1 предложение).\n\n"
+               f"{AGENT_DESCRIPTIONS}\n"
+               "Ответь строго в формате JSON:\n{{\"agent\": \"название_агента\", \"reasoning\": \"обоснование\"}}"),
+    ("human", "Запрос пользователя: {query}")
+])
+
+register_chain("router", ROUTER_PROMPT)
+
+# Режим оркестратора: "pipeline" — LLM-диспетчер, затем агент (два вызова подряд);
+# "single_call" — для неоднозначных запросов роль выбирается и ответ даётся одним вызовом
+ORCHESTRATOR_MODE = os.getenv("ORCHESTRATOR_MODE", "pipeline")
+
+ROUTE_AND_ANSWER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Ты — диспетчер и исполнитель многоагентной системы. "
+               "Выбери ОДНУ роль, подходящую для запроса пользователя, и сразу ответь на запрос в этой роли.\n\n"
+               f"{AGENT_DESCRIPTIONS}\n"
+               "Как отвечает каждая роль:\n"
+               "- summarizer: краткое содержание документа (3-5 предложений) с учётом запроса.\n"
+               "- marketing_expert: A/B-тесты — вариант A про технические преимущества, вариант B про бизнес-выгоды, "
+               "с цифрами, оценкой каждого варианта от 1 до 10 и рекомендацией. Учитывай отрасль из запроса.\n"
+               "{industry_rules}"
+               "- technical_reviewer: ответ на основе документа; если информации нет — скажи об этом.\n"
+               "- document_analyst: ключевые разделы, цели и компоненты продукта, затем краткое содержание.\n\n"
+               "Ответь строго в формате JSON:\n"
+               "{{\"agent\": \"название_агента\", \"reasoning\": \"обоснование\", \"answer\": \"ответ\"}}\n\n"
+               "Документ ({context_label}):\n{document}"),
+    ("human", "Запрос пользователя: {query}")
+])
+
+register_chain("route_and_answer", ROUTE_AND_ANSWER_PROMPT)
+
+# Цепочки, от промптов которых зависит ответ агента (входят в ключ кэша ответов)
+AGENT_CHAINS = {
+    "summarizer": ("summarizer", "summarizer_map", "summarizer_reduce"),
+    "marketing_expert": ("marketing_expert", "industry_classifier", "document_industry_classifier"),
+    "technical_reviewer": ("technical_reviewer",),
+    "document_analyst": ("document_analyst", "summarizer", "summarizer_map", "summarizer_reduce"),
+}
+VALID_AGENTS = set(AGENT_CHAINS)
+
+# Каким ролям достаточно контекста комбинированного вызова: целого документа или
+# найденных по запросу фрагментов (документ не поместился). Остальные получают
+# запрос заново — со своим контекстом (map-reduce, отраслевые правила и т.п.)
+COMBINED_CONTEXT_ROLES = {
+    "document": VALID_AGENTS,
+    "retrieval": {"technical_reviewer"},
+}
+
+async def aroute_with_llm(user_query: str) -> dict:
     """
     Выбирает агента с помощью GigaChat и возвращает его имя + обоснование.
     """
-    llm = GigaChat(
-        credentials=os.getenv("API_KEY"),
-        model="GigaChat",
-        verify_ssl_certs=False
-    )
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Ты — диспетчер многоагентной системы. "
-                   "Выбери ОДИН наиболее подходящий агент для запроса пользователя и кратко обоснуй выбор (1 предложение).\n\n"
-                   f"{AGENT_DESCRIPTIONS}\n"
-                   "Ответь строго в формате JSON:\n{{\"agent\": \"название_агента\", \"reasoning\": \"обоснование\"}}"),
-        ("human", "Запрос пользователя: {query}")
-    ])
-    
-    chain = prompt | llm | StrOutputParser()
     try:
-        raw_response = chain.invoke({"query": user_query})
+        raw_response = await arun_chain("router", {"query": user_query})
         data = json.loads(raw_response)
         agent_name = data.get("agent", "document_analyst")
         reasoning = data.get("reasoning", "Агент выбран по умолчанию.")
         
         # Валидация имени агента
-        valid_agents = {"summarizer", "marketing_expert", "technical_reviewer", "document_analyst"}
-        if agent_name not in valid_agents:
+        if agent_name not in VALID_AGENTS:
             agent_name = "document_analyst"
             reasoning = "Некорректный выбор агента — используется анализ по умолчанию."
             
@@ -59,59 +101,543 @@ def route_with_llm(user_query: str) -> dict:
             "reasoning": f"Ошибка роутинга — используется анализ по умолчанию. ({str(e)})"
         }
 
-def route_query(document_text: str, user_query: str) -> dict:
+# Получатель событий потоковой обработки: {"type": "step" | "token", ...}
+EventCallback = Callable[[dict], Awaitable[None]]
+
+async def _add_step(steps: list, step: dict, on_event: Optional[EventCallback] = None) -> None:
+    """Добавляет шаг и, если идёт потоковая выдача, сразу отправляет его клиенту."""
+    steps.append(step)
+    if on_event is not None:
+        await on_event({"type": "step", **step})
+
+# Таймауты (сек) параллельных вызовов ветки document_analyst
+ANALYSIS_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "120"))
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", "120"))
+
+def _describe_failure(error: BaseException, timeout: float) -> str:
+    if isinstance(error, asyncio.TimeoutError):
+        return f"превышено время ожидания ({timeout:.0f} сек)"
+    return str(error)
+
+async def run_document_analyst(document_text: str, user_query: str, steps: list,
+                               on_event: Optional[EventCallback] = None) -> str:
+    """
+    Запускает анализ и краткое содержание параллельно, каждый со своим таймаутом.
+    Если один из вызовов упал, возвращается результат второго; если оба — ошибка.
+    """
+    analysis, summary = await asyncio.gather(
+        asyncio.wait_for(aanalyze_document(document_text, user_query), ANALYSIS_TIMEOUT),
+        asyncio.wait_for(asummarize_document(document_text, user_query), SUMMARY_TIMEOUT),
+        return_exceptions=True
+    )
+    if isinstance(analysis, BaseException) and isinstance(summary, BaseException):
+        raise RuntimeError(
+            f"анализ — {_describe_failure(analysis, ANALYSIS_TIMEOUT)}; "
+            f"краткое содержание — {_describe_failure(summary, SUMMARY_TIMEOUT)}"
+        )
+
+    if isinstance(analysis, BaseException):
+        await _add_step(steps, {
+            "agent": "⚠️ Система",
+            "message": f"Глубокий анализ не получен: {_describe_failure(analysis, ANALYSIS_TIMEOUT)}"
+        }, on_event)
+        analysis = "⚠️ Анализ недоступен — показано только краткое содержание."
+    if isinstance(summary, BaseException):
+        await _add_step(steps, {
+            "agent": "⚠️ Система",
+            "message": f"Краткое содержание не получено: {_describe_failure(summary, SUMMARY_TIMEOUT)}"
+        }, on_event)
+        summary = "⚠️ Краткое содержание недоступно — показан только анализ."
+
+    return format_analysis(analysis, summary)
+
+def format_analysis(analysis: str, summary: str) -> str:
+    return f"🔍 **Глубокий анализ документа**:\n{analysis}\n\n📝 **Краткое содержание**:\n{summary}"
+
+def route_with_llm(user_query: str) -> dict:
+    """Синхронная обёртка над aroute_with_llm."""
+    return run_sync(aroute_with_llm(user_query))
+
+# Одинаковые одновременные запросы (тот же документ, агент и вопрос) разделяют один вызов LLM
+_single_flight = SingleFlight()
+
+def get_single_flight_stats() -> dict:
+    """leaders — выполненные вызовы, collapsed — запросы, получившие результат чужого вызова."""
+    return _single_flight.stats()
+
+# Запросы, с которыми артефакты считаются при загрузке: ответ не зависит от вопроса пользователя
+PRECOMPUTE_SUMMARY_QUERY = "общее краткое содержание документа"
+PRECOMPUTE_OUTLINE_QUERY = "ключевые разделы, цели и основные компоненты"
+# Цепочки, от промптов которых зависит каждая заготовка: их версия хранится рядом
+# с заготовкой ("precompute_versions"), и после правки промпта заготовка считается заново
+PRECOMPUTE_CHAINS = {
+    "summary": ("summarizer", "summarizer_map", "summarizer_reduce"),
+    "outline": ("document_analyst", "summarizer_map", "summarizer_reduce"),
+    "industry": ("document_industry_classifier",),
+}
+PRECOMPUTED_ARTIFACTS = tuple(PRECOMPUTE_CHAINS)
+
+# Общий вопрос — из этих слов и слов роли (основы, по началу слова); на него отвечает заготовка
+GENERIC_FILLER_WORDS = {
+    "сделай", "сделайте", "дай", "дайте", "напиши", "покажи", "составь", "проведи", "выдели", "пожалуйста",
+    "мне", "нам", "о", "об", "про", "по", "чем", "что", "в", "и", "этот", "этого", "этому", "весь", "всего",
+    "его", "документ", "документа", "документу", "текст", "текста", "файл", "файла",
+}
+GENERIC_QUERY_STEMS = {
+    "summarizer": ("кратк", "содержан", "резюм", "сут", "обзор", "общ"),
+    "document_analyst": ("анализ", "проанализ", "разбор", "разбер", "структур", "компонент", "раздел",
+                         "ключев", "основн", "цел"),
+}
+
+_precompute_stats = {"runs": 0, "failed_parts": 0, "served": 0}
+
+def is_generic_query(agent_name: str, user_query: str) -> bool:
+    """Вопрос без своей специфики («Сделай краткое содержание документа») — подходит заготовка."""
+    stems = GENERIC_QUERY_STEMS.get(agent_name)
+    words = re.findall(r"\w+", normalize_query(user_query))
+    if not stems or not words:
+        return False
+    return all(word in GENERIC_FILLER_WORDS or word.startswith(stems) for word in words)
+
+def precomputed_artifact(artifacts: dict, name: str):
+    """Заготовка name, посчитанная текущей версией промптов, или None (нет или устарела)."""
+    versions = artifacts.get("precompute_versions") or {}
+    if name in artifacts and versions.get(name) == prompt_version(*PRECOMPUTE_CHAINS[name]):
+        return artifacts[name]
+    return None
+
+async def _aprecompute(document_text: str, artifacts: dict) -> dict:
+    _precompute_stats["runs"] += 1
+    jobs = {}
+    if precomputed_artifact(artifacts, "summary") is None:
+        jobs["summary"] = asummarize_document(document_text, PRECOMPUTE_SUMMARY_QUERY)
+    if precomputed_artifact(artifacts, "outline") is None:
+        jobs["outline"] = aanalyze_document(document_text, PRECOMPUTE_OUTLINE_QUERY)
+    if precomputed_artifact(artifacts, "industry") is None:
+        jobs["industry"] = adetect_document_industry(document_text)
+    results = await asyncio.gather(*jobs.values(), return_exceptions=True)
+    computed = {}
+    versions = dict(artifacts.get("precompute_versions") or {})
+    for name, value in zip(jobs, results):
+        if isinstance(value, BaseException):
+            # Не получилось — агент посчитает это сам, когда спросят
+            _precompute_stats["failed_parts"] += 1
+        else:
+            computed[name] = value
+            versions[name] = prompt_version(*PRECOMPUTE_CHAINS[name])
+    if computed:
+        computed["precompute_versions"] = versions
+    return computed
+
+async def aprecompute_artifacts(document_text: str, artifacts: Optional[dict] = None) -> dict:
+    """
+    Считает артефакты документа, не зависящие от вопроса: "summary" (краткое
+    содержание), "outline" (структура от document_analyst) и "industry" (отрасль).
+    Уже имеющиеся в artifacts пропускаются, если посчитаны текущей версией промптов
+    (иначе считаются заново); возвращает только новые вместе с обновлёнными
+    "precompute_versions". Поисковый
+    индекс строится ещё при загрузке (backend.build_document). Один документ
+    считается одним вызовом, даже если его запросили несколько раз одновременно.
+    """
+    artifacts = artifacts or {}
+    if all(precomputed_artifact(artifacts, name) is not None for name in PRECOMPUTED_ARTIFACTS):
+        return {}
+    doc_hash = artifacts.get("document_hash") or document_hash(document_text)
+    computed, _ = await _single_flight.do(
+        ("precompute", doc_hash), lambda publish: _aprecompute(document_text, artifacts)
+    )
+    return computed
+
+def precomputed_answer(agent_name: str, artifacts: dict) -> Optional[str]:
+    summary = precomputed_artifact(artifacts, "summary")
+    if agent_name == "summarizer":
+        return summary
+    outline = precomputed_artifact(artifacts, "outline")
+    if agent_name == "document_analyst" and outline and summary:
+        return format_analysis(outline, summary)
+    return None
+
+async def _aprecomputed_answer(agent_name: str, document_text: str, user_query: str, artifacts: dict,
+                               doc_hash: str) -> Optional[str]:
+    """Ответ на общий вопрос из заготовок; если они ещё считаются — дожидается их, а не считает заново."""
+    answer = precomputed_answer(agent_name, artifacts)
+    if answer is None and _single_flight.in_flight(("precompute", doc_hash)):
+        computed = await aprecompute_artifacts(document_text, artifacts)
+        answer = precomputed_answer(agent_name, {**artifacts, **computed})
+    return answer
+
+async def aselect_agent(user_query: str) -> dict:
+    """
+    Быстрый путь: локальный роутер без обращения к GigaChat.
+    Если его уверенность ниже порога — решает LLM-диспетчер
+    (одинаковые одновременные вопросы — одним вызовом).
+    В результат добавляется routing_path: "local" или "llm".
+    """
+    routing_result = get_local_router().route(user_query)
+    if routing_result is not None:
+        return {**routing_result, "routing_path": "local"}
+    routing_result, _ = await _single_flight.do(
+        ("router", normalize_query(user_query)), lambda publish: aroute_with_llm(user_query)
+    )
+    return {**routing_result, "routing_path": "llm"}
+
+def parse_route_and_answer(raw_response: str) -> Optional[dict]:
+    """
+    Разбирает ответ route_and_answer: {"agent_name", "reasoning", "answer"}, где
+    answer — None, если модель не дала ответа. None — если это не JSON-объект
+    с известным агентом.
+    """
+    text = raw_response.strip()
+    # Модель иногда оборачивает JSON в блок ```json ... ```
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or data.get("agent") not in VALID_AGENTS:
+        return None
+    answer = data.get("answer")
+    return {
+        "agent_name": data["agent"],
+        "reasoning": str(data.get("reasoning") or "Обоснование не указано."),
+        "answer": answer.strip() if isinstance(answer, str) and answer.strip() else None,
+    }
+
+_combined_stats = {"calls": 0, "answered": 0, "redispatched": 0, "invalid": 0, "errors": 0}
+
+def get_orchestrator_stats() -> dict:
+    """
+    Режим оркестратора и счётчики комбинированных вызовов: answered — ответ принят,
+    redispatched — роли нужен другой контекст, invalid — ответ не разобран;
+    precompute — подготовка артефактов при загрузке (served — ответов из заготовок).
+    """
+    return {"mode": ORCHESTRATOR_MODE, **_combined_stats, "precompute": dict(_precompute_stats)}
+
+async def _aroute_and_answer(document_text: str, user_query: str, artifacts: dict, doc_hash: str) -> dict:
+    """
+    Один вызов LLM вместо диспетчера и агента. Возвращает {"agent_name", "reasoning",
+    "answer", "cache", "redispatch"}: answer — None, если ответ нужно получить у
+    выбранного агента (redispatch — почему), cache — уровень кэша ответов или None.
+    """
+    answer_cache = get_answer_cache()
+    cache_key = answer_cache.make_key(doc_hash, "route_and_answer", prompt_version("route_and_answer"), user_query)
+    cached = await answer_cache.aget(cache_key)
+    parsed = parse_route_and_answer(cached["answer"]) if cached is not None else None
+    if parsed is not None:
+        return {**parsed, "cache": cached["tier"], "redispatch": None}
+
+    if fits_context(document_text):
+        context_kind, context, context_label = "document", document_text, "полный текст"
+    else:
+        context_kind = "retrieval"
+        context = build_context(document_text, user_query, artifacts.get("retrieval_index"))
+        context_label = "фрагменты, найденные по запросу"
+    # Отраслевые правила — только от локального классификатора, без отдельного вызова LLM
+    industry, confidence = detect_industry_locally(user_query)
+    industry_rules = get_industry_prompts(industry) if confidence >= INDUSTRY_LOCAL_THRESHOLD else ""
+
+    _combined_stats["calls"] += 1
+    try:
+        raw_response = await arun_chain("route_and_answer", {
+            "document": context, "context_label": context_label,
+            "industry_rules": industry_rules, "query": user_query
+        })
+    except Exception as e:
+        _combined_stats["errors"] += 1
+        return {"agent_name": "document_analyst", "reasoning": "Ошибка комбинированного вызова — "
+                f"используется анализ по умолчанию. ({str(e)})", "answer": None, "cache": None,
+                "redispatch": "ошибка комбинированного вызова"}
+
+    parsed = parse_route_and_answer(raw_response)
+    if parsed is None:
+        _combined_stats["invalid"] += 1
+        return {"agent_name": "document_analyst", "reasoning": "Некорректный ответ модели — "
+                "используется анализ по умолчанию.", "answer": None, "cache": None,
+                "redispatch": "ответ модели не разобран"}
+    if parsed["answer"] is None:
+        _combined_stats["invalid"] += 1
+        return {**parsed, "cache": None, "redispatch": "модель не дала ответа"}
+    if parsed["agent_name"] not in COMBINED_CONTEXT_ROLES[context_kind]:
+        _combined_stats["redispatched"] += 1
+        return {**parsed, "answer": None, "cache": None,
+                "redispatch": "документ не поместился в один вызов, агенту нужен свой контекст"}
+
+    _combined_stats["answered"] += 1
+    await answer_cache.aset(cache_key, json.dumps(
+        {"agent": parsed["agent_name"], "reasoning": parsed["reasoning"], "answer": parsed["answer"]},
+        ensure_ascii=False
+    ))
+    return {**parsed, "cache": None, "redispatch": None}
+
+async def aselect_agent_and_answer(document_text: str, user_query: str, artifacts: dict, doc_hash: str) -> dict:
+    """
+    Режим single_call: локальный роутер, как в aselect_agent; неоднозначный запрос —
+    один вызов route_and_answer (одинаковые одновременные — одним вызовом).
+    routing_path: "local" или "combined"; при "combined" есть поля answer, cache, redispatch.
+    """
+    routing_result = get_local_router().route(user_query)
+    if routing_result is not None:
+        return {**routing_result, "routing_path": "local"}
+    routing_result, _ = await _single_flight.do(
+        ("route_and_answer", doc_hash, normalize_query(user_query)),
+        lambda publish: _aroute_and_answer(document_text, user_query, artifacts, doc_hash)
+    )
+    return {**routing_result, "routing_path": "combined"}
+
+ROUTE_LABELS = {"local": "локально", "llm": "LLM-диспетчер", "combined": "LLM, выбор и ответ одним вызовом"}
+
+async def _run_agent(agent_name: str, document_text: str, user_query: str, artifacts: dict,
+                     cache_key: tuple, on_token: Optional[Callable[[str], Awaitable[None]]]) -> dict:
+    """
+    Выполнение агента, общее для всех одинаковых одновременных запросов.
+    Возвращает {"final_answer", "steps"}, где steps — предупреждения агента.
+    """
+    steps = []
+    if agent_name == "summarizer":
+        final_answer = await asummarize_document(document_text, user_query, on_token)
+
+    elif agent_name == "marketing_expert":
+        final_answer = await agenerate_ab_tests(document_text, user_query, on_token,
+                                                precomputed_artifact(artifacts, "industry"))
+
+    elif agent_name == "technical_reviewer":
+        final_answer = await aanswer_technical_question(
+            document_text, user_query, artifacts.get("retrieval_index"), on_token
+        )
+
+    elif agent_name == "document_analyst":
+        # Два параллельных вызова не стримятся по токенам — ответ отдаётся целиком
+        final_answer = await run_document_analyst(document_text, user_query, steps)
+        if on_token is not None:
+            await on_token(final_answer)
+
+    else:
+        final_answer = "Неизвестный агент. Обратитесь к разработчикам системы."
+
+    # Частичный ответ (одна из веток упала) не кэшируем
+    if agent_name in AGENT_CHAINS and not any(step["agent"] == "⚠️ Система" for step in steps):
+        await get_answer_cache().aset(cache_key, final_answer)
+    return {"final_answer": final_answer, "steps": steps}
+
+async def aroute_query(document_text: str, user_query: str, artifacts: Optional[dict] = None,
+                       on_event: Optional[EventCallback] = None) -> dict:
     """
     Основная функция оркестратора.
-    Возвращает: {"steps": [...], "final_answer": "..."}
+    artifacts — производные данные документа, посчитанные при загрузке
+    (например, "retrieval_index" для technical_reviewer, "document_hash", а также
+    "summary", "outline" и "industry" из aprecompute_artifacts).
+    on_event — для потоковой выдачи: получает каждый шаг в момент его появления
+    и фрагменты ответа агента ({"type": "token", "text": ...}).
+    Возвращает: {"steps": [...], "final_answer": "...", "usage": {...}, "spans": [...], "error": ...},
+    где usage — токены промпта и ответа каждого вызова GigaChat и их сумма, spans —
+    длительность этапов (маршрутизация, кэш, агент, вызовы LLM с токенами), error —
+    текст ошибки агента (после всех повторов планировщика) или None. У шагов
+    выбора агента, кэша и агента есть duration_ms.
+    В режиме ORCHESTRATOR_MODE="single_call" неоднозначный запрос обходится одним
+    вызовом LLM (aselect_agent_and_answer); ответ при этом отдаётся целиком, без токенов.
     """
+    artifacts = artifacts or {}
+    doc_hash = artifacts.get("document_hash") or document_hash(document_text)
     steps = []
+    usage_calls = track_usage()
+    spans = track_spans()
+    on_token = None
+    if on_event is not None:
+        async def on_token(text: str) -> None:
+            await on_event({"type": "token", "text": text})
     
     # Шаг 1: Анализ запроса
-    steps.append({
+    await _add_step(steps, {
         "agent": "🧠",
         "message": "Анализирую ваш запрос для выбора подходящего агента..."
-    })
+    }, on_event)
     
-    # Шаг 2: Выбор агента через LLM
-    routing_result = route_with_llm(user_query)
-    steps.append({
+    # Шаг 2: Выбор агента — сначала локальный классификатор, LLM только для неоднозначных запросов
+    with span("route") as route_span:
+        if ORCHESTRATOR_MODE == "single_call":
+            routing_result = await aselect_agent_and_answer(document_text, user_query, artifacts, doc_hash)
+        else:
+            routing_result = await aselect_agent(user_query)
+        route_span["routing_path"] = routing_result["routing_path"]
+    route_label = ROUTE_LABELS[routing_result["routing_path"]]
+    await _add_step(steps, {
         "agent": "🧠",
-        "message": f"Выбран агент: {routing_result['agent_name']} → {routing_result['reasoning']}"
-    })
-    
-    # Шаг 3: Выполнение задачи выбранным агентом
+        "message": f"Выбран агент ({route_label}): {routing_result['agent_name']} → {routing_result['reasoning']}",
+        "routing_path": routing_result["routing_path"],
+        "duration_ms": route_span["duration_ms"]
+    }, on_event)
     agent_name = routing_result["agent_name"]
-    steps.append({
+
+    # Роль выбрана и ответ дан тем же вызовом — агента не запускаем
+    combined_answer = routing_result.get("answer")
+    if combined_answer is not None:
+        if routing_result["cache"]:
+            AGENT_REQUESTS.inc(agent=agent_name, outcome="cache")
+            await _add_step(steps, {
+                "agent": "⚡ Кэш",
+                "message": "Этот вопрос по документу уже задавали — ответ выдан мгновенно из кэша.",
+                "cache": routing_result["cache"]
+            }, on_event)
+        else:
+            AGENT_REQUESTS.inc(agent=agent_name, outcome="combined")
+            await _add_step(steps, {
+                "agent": f"🧑‍💼 {agent_name}",
+                "message": "Ответ сформирован тем же вызовом, что и выбор агента.",
+                "combined": True
+            }, on_event)
+        if on_token is not None:
+            await on_token(combined_answer)
+        return {"steps": steps, "final_answer": combined_answer, "usage": summarize_usage(usage_calls),
+                "spans": spans, "error": None}
+    if routing_result.get("redispatch"):
+        await _add_step(steps, {
+            "agent": "↪️",
+            "message": f"Передаю запрос агенту {agent_name}: {routing_result['redispatch']}.",
+            "redispatch": True
+        }, on_event)
+
+    # Общий вопрос («краткое содержание», «анализ документа») — ответ подготовлен при загрузке
+    precomputed = None
+    if is_generic_query(agent_name, user_query):
+        with span("precomputed") as precomputed_span:
+            precomputed = await _aprecomputed_answer(agent_name, document_text, user_query, artifacts, doc_hash)
+            precomputed_span["hit"] = precomputed is not None
+    if precomputed is not None:
+        _precompute_stats["served"] += 1
+        AGENT_REQUESTS.inc(agent=agent_name, outcome="precomputed")
+        await _add_step(steps, {
+            "agent": "📦 Заготовка",
+            "message": "Ответ на общий вопрос подготовлен заранее, при загрузке документа.",
+            "precomputed": True,
+            "duration_ms": precomputed_span["duration_ms"]
+        }, on_event)
+        if on_token is not None:
+            await on_token(precomputed)
+        return {"steps": steps, "final_answer": precomputed, "usage": summarize_usage(usage_calls),
+                "spans": spans, "error": None}
+
+    # Тот же вопрос к тому же документу уже задавали — ответ из кэша, без GigaChat
+    answer_cache = get_answer_cache()
+    cache_key = answer_cache.make_key(
+        doc_hash, agent_name, prompt_version(*AGENT_CHAINS.get(agent_name, ())), user_query
+    )
+    with span("answer_cache") as cache_span:
+        cached = await answer_cache.aget(cache_key)
+        cache_span["hit"] = cached is not None
+    if cached is not None:
+        AGENT_REQUESTS.inc(agent=agent_name, outcome="cache")
+        await _add_step(steps, {
+            "agent": "⚡ Кэш",
+            "message": "Этот вопрос по документу уже задавали — ответ выдан мгновенно из кэша.",
+            "cache": cached["tier"],
+            "duration_ms": cache_span["duration_ms"]
+        }, on_event)
+        if on_token is not None:
+            await on_token(cached["answer"])
+        return {"steps": steps, "final_answer": cached["answer"], "usage": summarize_usage(usage_calls),
+                "spans": spans, "error": None}
+
+    # Шаг 3: Выполнение задачи выбранным агентом
+    agent_step = {
         "agent": f"🧑‍💼 {agent_name}",
         "message": "Обрабатываю документ и формирую ответ..."
-    })
+    }
+    await _add_step(steps, agent_step, on_event)
     
+    error = None
+    tokens_sent = 0
+    forward_token = None
+    if on_token is not None:
+        async def forward_token(text: str) -> None:
+            nonlocal tokens_sent
+            tokens_sent += 1
+            await on_token(text)
+
+    outcome = "ok"
     try:
-        if agent_name == "summarizer":
-            final_answer = summarize_document(document_text, user_query)
-            
-        elif agent_name == "marketing_expert":
-            final_answer = generate_ab_tests(document_text, user_query)
-            
-        elif agent_name == "technical_reviewer":
-            final_answer = answer_technical_question(document_text, user_query)
-            
-        elif agent_name == "document_analyst":
-            analysis = analyze_document(document_text, user_query)
-            summary = summarize_document(document_text, user_query)
-            final_answer = f"🔍 **Глубокий анализ документа**:\n{analysis}\n\n📝 **Краткое содержание**:\n{summary}"
-            
-        else:
-            final_answer = "Неизвестный агент. Обратитесь к разработчикам системы."
-            
+        # Длительность шага агента известна только в конце — она будет в итоговых steps
+        with span(f"agent.{agent_name}") as agent_span:
+            result, shared = await _single_flight.do(
+                ("agent", *cache_key),
+                lambda publish: _run_agent(agent_name, document_text, user_query, artifacts, cache_key,
+                                           publish if on_token is not None else None),
+                forward_token
+            )
+            agent_span["coalesced"] = shared
+        if shared:
+            outcome = "coalesced"
+            await _add_step(steps, {
+                "agent": "🔗",
+                "message": "Такой же вопрос по документу уже обрабатывается — ответ получен вместе с ним.",
+                "coalesced": True
+            }, on_event)
+        for step in result["steps"]:
+            await _add_step(steps, step, on_event)
+        final_answer = result["final_answer"]
+        # Общий вызов шёл без потоковой выдачи — отдаём ответ целиком
+        if on_token is not None and not tokens_sent:
+            await on_token(final_answer)
+
     except Exception as e:
-        final_answer = f"❌ Ошибка выполнения агента: {str(e)}"
-        steps.append({
+        outcome = "error"
+        error = str(e)
+        final_answer = f"❌ Ошибка выполнения агента: {error}"
+        await _add_step(steps, {
             "agent": "⚠️ Система",
             "message": "Произошла ошибка при генерации ответа."
-        })
+        }, on_event)
     
+    agent_step["duration_ms"] = agent_span["duration_ms"]
+    AGENT_REQUESTS.inc(agent=agent_name, outcome=outcome)
     return {
         "steps": steps,
-        "final_answer": final_answer
-    }
\ No newline at end of file
+        "final_answer": final_answer,
+        "usage": summarize_usage(usage_calls),
+        "spans": spans,
+        "error": error
+    }
+
+def route_query(document_text: str, user_query: str, artifacts: Optional[dict] = None) -> dict:
+    """Синхронная обёртка над aroute_query (для скриптов и тестов)."""
+    return run_sync(aroute_query(document_text, user_query, artifacts))
+
+# Сколько вопросов пакета обрабатываются одновременно
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+async def aroute_batch(document_text: str, queries: List[str], artifacts: Optional[dict] = None,
+                       concurrency: int = BATCH_CONCURRENCY) -> List[dict]:
+    """
+    Пакет вопросов к одному документу. Одинаковые (после normalize_query) вопросы
+    выполняются один раз; остальные идут параллельно, не больше concurrency
+    одновременно. Агент выбирается как обычно: локально, LLM-диспетчер — только
+    для неоднозначных вопросов; готовые ответы берутся из кэша ответов.
+    Возвращает результаты в порядке queries: {"query", "steps", "final_answer",
+    "usage", "latency_ms", "error"} (+ "duplicate_of" — индекс первого такого же вопроса).
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    first_index = {}
+    for index, query in enumerate(queries):
+        first_index.setdefault(normalize_query(query), index)
+    unique = sorted(first_index.values())
+
+    async def run_one(index: int) -> dict:
+        query = queries[index]
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await aroute_query(document_text, query, artifacts)
+            except Exception as e:
+                result = {"steps": [], "final_answer": f"❌ Ошибка агентов: {str(e)}",
+                          "usage": summarize_usage([]), "spans": [], "error": str(e)}
+            return {"query": query, **result, "latency_ms": (time.perf_counter() - started) * 1000}
+
+    unique_results = dict(zip(unique, await asyncio.gather(*(run_one(index) for index in unique))))
+    results = []
+    for index, query in enumerate(queries):
+        first = first_index[normalize_query(query)]
+        if first == index:
+            results.append(unique_results[index])
+        else:
+            results.append({**unique_results[first], "query": query, "duplicate_of": first})
+    return results
@@ -1,20 +1,22 @@
-from langchain_gigachat import GigaChat
+from typing import Optional
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-import os
+from utils.llm_pool import register_chain, arun_chain, TokenCallback, run_sync
+from agents.summarizer import acondense_document
+
+ANALYST_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Ты — аналитик технической документации. Выдели ключевые разделы, цели и основные компоненты продукта. "
+               "Ответ дай в виде краткого структурированного описания."),
+    ("human", "Документ:\n{document}, запрос пользователя {user_query}")
+])
+
+register_chain("document_analyst", ANALYST_PROMPT)
+
+async def aanalyze_document(document_text: str, user_query: str,
+                            on_token: Optional[TokenCallback] = None) -> str:
+    # Большой документ анализируется по свёрнутым кратким содержаниям частей (map-reduce)
+    document = await acondense_document(document_text)
+    return await arun_chain("document_analyst", {"document": document, "user_query": user_query}, on_token)
 
 def analyze_document(document_text: str, user_query: str) -> str:
-    llm = GigaChat(
-        credentials=os.getenv("API_KEY"),
-        model="GigaChat",
-        verify_ssl_certs=False
-    )
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Ты — аналитик технической документации. Выдели ключевые разделы, цели и основные компоненты продукта. "
-                   "Ответ дай в виде краткого структурированного описания."),
-        ("human", "Документ:\n{document}, запрос пользователя {user_query}")
-    ])
-    
-    chain = prompt | llm | StrOutputParser()
-    return chain.invoke({"document": document_text, "user_query": user_query})
\ No newline at end of file
+    """Синхронная обёртка над aanalyze_document (для скриптов и тестов)."""
+    return run_sync(aanalyze_document(document_text, user_query))
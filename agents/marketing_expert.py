@@ -1,32 +1,144 @@
 # agents/marketing_expert.py
-from langchain_gigachat import GigaChat
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 import os
+from typing import Optional
+from langchain_core.prompts import ChatPromptTemplate
+from utils.cache import TTLCache
+from utils.llm_pool import register_chain, arun_chain, TokenCallback, run_sync
+from utils.metrics import span
+from utils.router import NgramClassifier, normalize_query
 
-def detect_industry_with_llm(user_query: str) -> str:
+VALID_INDUSTRIES = {"healthcare", "construction", "finance", "industry", "education", "it", "general"}
+
+# Лексикон для локального определения отрасли (основы слов в нижнем регистре)
+INDUSTRY_KEYWORDS = {
+    "healthcare": ["медиц", "клиник", "больниц", "врач", "пациент", "здравоохран", "телемедиц", "минздрав",
+                   "эмк", "фарм", "поликлиник"],
+    "construction": ["строит", "застройщ", "девелоп", "жк ", "bim", "прораб", "проектировщ", "недвижим"],
+    "finance": ["банк", "финанс", "финтех", "страхов", "кредит", "платеж", "инвест", "цб рф", "бухгалт"],
+    "industry": ["промышлен", "производств", "завод", "цех", "станк", "оборудован", "oee", "mtbf", "инженер"],
+    "education": ["школ", "вуз", "образован", "обучен", "студент", "егэ", "edtech", "университет", "учител",
+                  "преподават"],
+    "it": ["ит-", "it-", "айти", "разработчик", "программист", "devops", "saas", "облачн", "kubernetes",
+           "ит компан", "it компан"],
+}
+
+# Локальный ответ принимается только при уверенности не ниже порога
+INDUSTRY_LOCAL_THRESHOLD = float(os.getenv("INDUSTRY_LOCAL_THRESHOLD", "0.8"))
+_industry_classifier = NgramClassifier(keywords=INDUSTRY_KEYWORDS).fit([])
+# Кэш определённых отраслей: ключ — нормализованный запрос
+_industry_cache = TTLCache(
+    maxsize=int(os.getenv("INDUSTRY_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("INDUSTRY_CACHE_TTL", "3600"))
+)
+
+# Отрасль документа определяется по его началу (символов)
+DOCUMENT_INDUSTRY_SAMPLE_CHARS = int(os.getenv("DOCUMENT_INDUSTRY_SAMPLE_CHARS", "4000"))
+
+INDUSTRY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Ты — классификатор отраслей. Определи отрасль запроса.\n\n"
+               "Варианты: healthcare, construction, finance, industry, education, it, general.\n"
+               "Ответь ТОЛЬКО названием отрасли (например: healthcare)."),
+    ("human", "Запрос: {query}")
+])
+
+AB_TESTS_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Ты — эксперт по B2B-маркетингу. Создай A/B-тесты по запросу пользователя.\n\n"
+               "🔥 ОБЩИЕ ПРАВИЛА:\n"
+               "1. Вариант A: ТЕХНИЧЕСКИЕ преимущества (интеграции, архитектура, безопасность)\n"
+               "2. Вариант B: БИЗНЕС-ВЫГОДЫ (экономия, ROI, снижение рисков)\n"
+               "3. Обязательно используй ЦИФРЫ («на 40%», «с 8 часов до 15 минут»)\n"
+               "4. Заголовок — до 60 символов, тело — 3-5 предложения, подробно\n"
+               "5. Используй слова и указания из предложенной профессии/сферы для которой требуется реклама, делай отсылки с ключевыми словами, доказывай релевантность рекламы\n"
+               "6. Никаких общих фраз — только конкретика\n\n"
+               "{industry_rules}"  # ← ОТРАСЛЕВЫЕ ПРАВИЛА подставляются при вызове
+               "📊 После генерации оцени варианты по шкале от 1 до 10:\n"
+               "- Ясность выгоды\n"
+               "- Релевантность аудитории\n"
+               "- Уникальность предложения\n\n"
+               "Формат ответа (СТРОГО):\n"
+               "A: [заголовок]\n[тело]\n\n"
+               "B: [заголовок]\n[тело]\n\n"
+               "📈 Оценка эффективности:\n"
+               "• A: X/10 — [причина]\n"
+               "• B: Y/10 — [причина]\n"
+               "💡 Рекомендация: [какой выбрать и почему]\n\n"
+               "Документ:\n{document}"),
+    ("human", "Запрос пользователя: {user_query}\n\n"
+              "Сгенерируй A/B-тесты строго в указанном формате.")
+])
+
+DOCUMENT_INDUSTRY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Ты — классификатор отраслей. Определи по началу документа, к какой отрасли относятся "
+               "описанные в нём продукт или услуга и их аудитория.\n\n"
+               "Варианты: healthcare, construction, finance, industry, education, it, general.\n"
+               "Ответь ТОЛЬКО названием отрасли (например: healthcare)."),
+    ("human", "Начало документа:\n{document}")
+])
+
+register_chain("industry_classifier", INDUSTRY_PROMPT)
+register_chain("document_industry_classifier", DOCUMENT_INDUSTRY_PROMPT)
+register_chain("marketing_expert", AB_TESTS_PROMPT)
+
+async def _aclassify_industry_llm(user_query: str) -> str:
+    industry = (await arun_chain("industry_classifier", {"query": user_query})).strip().lower()
+    return industry if industry in VALID_INDUSTRIES else "general"
+
+async def adetect_industry_with_llm(user_query: str) -> str:
     """Определяет отрасль с помощью GigaChat"""
-    llm = GigaChat(
-        credentials=os.getenv("API_KEY"),
-        model="GigaChat",
-        verify_ssl_certs=False
-    )
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Ты — классификатор отраслей. Определи отрасль запроса.\n\n"
-                   "Варианты: healthcare, construction, finance, industry, education, it, general.\n"
-                   "Ответь ТОЛЬКО названием отрасли (например: healthcare)."),
-        ("human", "Запрос: {query}")
-    ])
-    
-    chain = prompt | llm | StrOutputParser()
     try:
-        industry = chain.invoke({"query": user_query}).strip().lower()
-        valid = {"healthcare", "construction", "finance", "industry", "education", "it", "general"}
-        return industry if industry in valid else "general"
-    except:
+        return await _aclassify_industry_llm(user_query)
+    except Exception:
         return "general"
 
+def detect_industry_with_llm(user_query: str) -> str:
+    """Синхронная обёртка над adetect_industry_with_llm."""
+    return run_sync(adetect_industry_with_llm(user_query))
+
+def detect_industry_locally(user_query: str):
+    """Лексический классификатор: (отрасль, уверенность) без обращения к LLM."""
+    return _industry_classifier.predict(user_query)
+
+async def adetect_industry(user_query: str, fallback: Optional[str] = None) -> str:
+    """
+    Определяет отрасль: кэш → локальный классификатор → GigaChat (только если
+    локальный не уверен). Ошибки LLM не кэшируются. fallback — отрасль, уже
+    известная иначе (например, определённая по документу при загрузке): если
+    локальный классификатор не уверен, берётся она, без вызова LLM и без кэширования.
+    """
+    key = normalize_query(user_query)
+    industry = _industry_cache.get(key)
+    if industry is not None:
+        return industry
+
+    industry, confidence = detect_industry_locally(user_query)
+    if confidence < INDUSTRY_LOCAL_THRESHOLD and fallback is not None:
+        return fallback
+    if confidence < INDUSTRY_LOCAL_THRESHOLD:
+        try:
+            industry = await _aclassify_industry_llm(user_query)
+        except Exception:
+            return "general"
+
+    _industry_cache.set(key, industry)
+    return industry
+
+async def adetect_document_industry(document_text: str) -> str:
+    """
+    Отрасль документа целиком (для подготовки при загрузке): локальный классификатор
+    по началу документа, если не уверен — GigaChat с промптом для документа.
+    Кэш запросов не используется; ошибки LLM не подменяются на "general", а
+    пробрасываются — вызывающий решает, что делать без отрасли.
+    """
+    sample = document_text[:DOCUMENT_INDUSTRY_SAMPLE_CHARS]
+    industry, confidence = detect_industry_locally(sample)
+    if confidence >= INDUSTRY_LOCAL_THRESHOLD:
+        return industry
+    industry = (await arun_chain("document_industry_classifier", {"document": sample})).strip().lower()
+    return industry if industry in VALID_INDUSTRIES else "general"
+
+def get_industry_cache_stats() -> dict:
+    return _industry_cache.stats()
+
 def get_industry_prompts(industry: str) -> str:
     """Возвращает отраслевые правила для промпта"""
     industry_rules = {
@@ -72,45 +184,25 @@ def get_industry_prompts(industry: str) -> str:
     }
     return industry_rules.get(industry, "")
 
-def generate_ab_tests(document_text: str, user_query: str) -> str:
+async def agenerate_ab_tests(document_text: str, user_query: str,
+                             on_token: Optional[TokenCallback] = None,
+                             document_industry: Optional[str] = None) -> str:
     """
     Генерирует A/B-тесты с автоматическим определением отрасли по запросу пользователя.
+    document_industry — отрасль документа, посчитанная заранее: заменяет вызов LLM,
+    если по запросу отрасль не ясна.
     """
-    llm = GigaChat(
-        credentials=os.getenv("API_KEY"),
-        model="GigaChat",
-        verify_ssl_certs=False
-    )
-    
-    # Определяем отрасль через LLM
-    industry = detect_industry_with_llm(user_query)
+    # Определяем отрасль: кэш и локальный классификатор, LLM — только как запасной вариант
+    with span("industry") as record:
+        industry = record["industry"] = await adetect_industry(user_query, document_industry)
     industry_rules = get_industry_prompts(industry)
     
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Ты — эксперт по B2B-маркетингу. Создай A/B-тесты по запросу пользователя.\n\n"
-                   "🔥 ОБЩИЕ ПРАВИЛА:\n"
-                   "1. Вариант A: ТЕХНИЧЕСКИЕ преимущества (интеграции, архитектура, безопасность)\n"
-                   "2. Вариант B: БИЗНЕС-ВЫГОДЫ (экономия, ROI, снижение рисков)\n"
-                   "3. Обязательно используй ЦИФРЫ («на 40%», «с 8 часов до 15 минут»)\n"
-                   "4. Заголовок — до 60 символов, тело — 3-5 предложения, подробно\n"
-                   "5. Используй слова и указания из предложенной профессии/сферы для которой требуется реклама, делай отсылки с ключевыми словами, доказывай релевантность рекламы\n"
-                   "6. Никаких общих фраз — только конкретика\n\n"
-                   f"{industry_rules}"  # ← ДОБАВЛЯЕМ ОТРАСЛЕВЫЕ ПРАВИЛА
-                   "📊 После генерации оцени варианты по шкале от 1 до 10:\n"
-                   "- Ясность выгоды\n"
-                   "- Релевантность аудитории\n"
-                   "- Уникальность предложения\n\n"
-                   "Формат ответа (СТРОГО):\n"
-                   "A: [заголовок]\n[тело]\n\n"
-                   "B: [заголовок]\n[тело]\n\n"
-                   "📈 Оценка эффективности:\n"
-                   "• A: X/10 — [причина]\n"
-                   "• B: Y/10 — [причина]\n"
-                   "💡 Рекомендация: [какой выбрать и почему]\n\n"
-                   "Документ:\n{document}"),
-        ("human", "Запрос пользователя: {user_query}\n\n"
-                  "Сгенерируй A/B-тесты строго в указанном формате.")
-    ])
-    
-    chain = prompt | llm | StrOutputParser()
-    return chain.invoke({"document": document_text, "user_query": user_query})
\ No newline at end of file
+    return await arun_chain(
+        "marketing_expert",
+        {"document": document_text, "user_query": user_query, "industry_rules": industry_rules},
+        on_token
+    )
+
+def generate_ab_tests(document_text: str, user_query: str) -> str:
+    """Синхронная обёртка над agenerate_ab_tests (для скриптов и тестов)."""
+    return run_sync(agenerate_ab_tests(document_text, user_query))
\ No newline at end of file
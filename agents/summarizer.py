@@ -1,19 +1,118 @@
-from langchain_gigachat import GigaChat
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+import asyncio
+import hashlib
 import os
+from typing import List, Optional
+from langchain_core.prompts import ChatPromptTemplate
+from utils.cache import TTLCache
+from utils.llm_pool import register_chain, arun_chain, TokenCallback, run_sync
+from utils.retrieval import split_into_chunks
+from utils.single_flight import SingleFlight
+from utils.tokens import estimate_tokens, tokens_to_chars
 
-def summarize_document(document_text: str, user_query: str) -> str:
-    llm = GigaChat(
-        credentials=os.getenv("API_KEY"),
-        model="GigaChat",
-        verify_ssl_certs=False
+# Сколько токенов документа помещается в один вызов; больше — режим map-reduce
+SUMMARY_CONTEXT_TOKENS = int(os.getenv("SUMMARY_CONTEXT_TOKENS", "6000"))
+# Сколько фрагментов суммаризируется одновременно на фазе map
+MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+# Ограничение глубины свёртки на случай, если модель не сокращает текст
+MAX_REDUCE_LEVELS = 5
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Сделай краткое содержание документа (3-5 предложений)."),
+    ("human", "Документ:\n{document}, запрос пользователя {user_query}")
+])
+
+MAP_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Сделай краткое содержание фрагмента большого документа (3-5 предложений). "
+               "Сохрани ключевые факты, цифры, названия и требования."),
+    ("human", "Фрагмент {part} из {total}:\n{document}")
+])
+
+REDUCE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Объедини краткие содержания частей документа в одно связное краткое содержание (5-7 предложений). "
+               "Сохрани ключевые факты и цифры, убери повторы."),
+    ("human", "Краткие содержания частей:\n{document}")
+])
+
+register_chain("summarizer", SUMMARY_PROMPT)
+register_chain("summarizer_map", MAP_PROMPT)
+register_chain("summarizer_reduce", REDUCE_PROMPT)
+
+# Промежуточные результаты map-фазы: ключ — (хэш документа, бюджет, номер фрагмента)
+_chunk_summaries = TTLCache(
+    maxsize=int(os.getenv("SUMMARY_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("SUMMARY_CACHE_TTL", "86400"))
+)
+# Уже идущие сжатия документов: параллельные вызовы ждут одну задачу
+_condense_flight = SingleFlight()
+
+def document_hash(document_text: str) -> str:
+    return hashlib.sha256(document_text.encode("utf-8")).hexdigest()
+
+def fits_context(document_text: str, budget: int = SUMMARY_CONTEXT_TOKENS) -> bool:
+    return estimate_tokens(document_text) <= budget
+
+async def _amap_chunks(doc_hash: str, chunks: List[str], budget: int) -> List[str]:
+    """Фаза map: краткое содержание каждого фрагмента, не больше MAP_CONCURRENCY одновременно."""
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+
+    async def summarize_chunk(i: int, chunk: str) -> str:
+        key = (doc_hash, budget, i)
+        cached = _chunk_summaries.get(key)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            summary = await arun_chain("summarizer_map", {"document": chunk, "part": i + 1, "total": len(chunks)})
+        _chunk_summaries.set(key, summary)
+        return summary
+
+    return list(await asyncio.gather(*(summarize_chunk(i, chunk) for i, chunk in enumerate(chunks))))
+
+async def _areduce(summaries: List[str], budget: int) -> str:
+    """Иерархическая свёртка: объединяем группы кратких содержаний, пока всё не влезет в бюджет."""
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+
+    async def combine(group: List[str]) -> str:
+        async with semaphore:
+            return await arun_chain("summarizer_reduce", {"document": "\n\n".join(group)})
+
+    for _ in range(MAX_REDUCE_LEVELS):
+        if fits_context("\n\n".join(summaries), budget):
+            break
+        groups: List[List[str]] = [[]]
+        for summary in summaries:
+            if groups[-1] and not fits_context("\n\n".join(groups[-1] + [summary]), budget):
+                groups.append([])
+            groups[-1].append(summary)
+        if len(groups) == 1:
+            # Одна группа, но всё ещё не влезает — сворачиваем попарно
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        summaries = list(await asyncio.gather(*(combine(group) for group in groups)))
+    return "\n\n".join(summaries)[:tokens_to_chars(budget)]
+
+async def _acondense(document_text: str, doc_hash: str, budget: int) -> str:
+    chunks = split_into_chunks(document_text, chunk_size=tokens_to_chars(budget // 2), overlap=0)
+    summaries = await _amap_chunks(doc_hash, chunks, budget)
+    return await _areduce(summaries, budget)
+
+async def acondense_document(document_text: str, budget: int = SUMMARY_CONTEXT_TOKENS) -> str:
+    """
+    Возвращает текст, который помещается в бюджет токенов: сам документ, если он
+    небольшой, иначе свёрнутые краткие содержания его фрагментов (map-reduce).
+    """
+    if fits_context(document_text, budget):
+        return document_text
+
+    doc_hash = document_hash(document_text)
+    condensed, _ = await _condense_flight.do(
+        (doc_hash, budget), lambda publish: _acondense(document_text, doc_hash, budget)
     )
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Сделай краткое содержание документа (3-5 предложений)."),
-        ("human", "Документ:\n{document}, запрос пользователя {user_query}")
-    ])
-    
-    chain = prompt | llm | StrOutputParser()
-    return chain.invoke({"document": document_text, "user_query": user_query})
\ No newline at end of file
+    return condensed
+
+async def asummarize_document(document_text: str, user_query: str,
+                              on_token: Optional[TokenCallback] = None) -> str:
+    document = await acondense_document(document_text)
+    return await arun_chain("summarizer", {"document": document, "user_query": user_query}, on_token)
+
+def summarize_document(document_text: str, user_query: str) -> str:
+    """Синхронная обёртка над asummarize_document (для скриптов и тестов)."""
+    return run_sync(asummarize_document(document_text, user_query))
@@ -1,20 +1,28 @@
-from langchain_gigachat import GigaChat
+from typing import Optional
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-import os
+from utils.llm_pool import register_chain, arun_chain, TokenCallback, run_sync
+from utils.metrics import span
+from utils.retrieval import BM25Index, TOP_K
 
-def answer_technical_question(document_text: str, question: str) -> str:
-    
-    llm = GigaChat(
-        credentials=os.getenv("API_KEY"),
-        model="GigaChat",
-        verify_ssl_certs=False
-    )
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Ты — технический эксперт. Отвечай на основе документа. Если информации нет — скажи об этом.\n\nДокумент:\n{document}"),
-        ("human", "{question}")
-    ])
-    
-    chain = prompt | llm | StrOutputParser()
-    return chain.invoke({"document": document_text, "question": question})
\ No newline at end of file
+REVIEWER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Ты — технический эксперт. Отвечай на основе документа. Если информации нет — скажи об этом.\n\nДокумент:\n{document}"),
+    ("human", "{question}")
+])
+
+register_chain("technical_reviewer", REVIEWER_PROMPT)
+
+def build_context(document_text: str, question: str, index: Optional[BM25Index] = None) -> str:
+    """Если есть поисковый индекс — в промпт идут только top-k фрагментов документа."""
+    if index is None or not index.chunks:
+        return document_text
+    return "\n\n---\n\n".join(index.top_chunks(question, TOP_K))
+
+async def aanswer_technical_question(document_text: str, question: str, index: Optional[BM25Index] = None,
+                                     on_token: Optional[TokenCallback] = None) -> str:
+    with span("retrieval"):
+        context = build_context(document_text, question, index)
+    return await arun_chain("technical_reviewer", {"document": context, "question": question}, on_token)
+
+def answer_technical_question(document_text: str, question: str, index: Optional[BM25Index] = None) -> str:
+    """Синхронная обёртка над aanswer_technical_question (для скриптов и тестов)."""
+    return run_sync(aanswer_technical_question(document_text, question, index))
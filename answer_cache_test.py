@@ -0,0 +1,121 @@
+# answer_cache_test.py
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from agent_orchestrator import aroute_query
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+
+FAKE_LATENCY = 0.2
+DOCUMENT = "Системный блок DEXP Atlas. Производитель: ООО Фактор. Питание: 220 В, 50 Гц.\n"
+QUERY = "Какое напряжение питания?"
+
+# Замеры тестов для отчёта run_answer_cache_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def ask(query: str = QUERY, document: str = DOCUMENT) -> tuple:
+    start = time.perf_counter()
+    result = asyncio.run(aroute_query(document, query))
+    return result, time.perf_counter() - start
+
+def cache_steps(result: dict) -> list:
+    return [step for step in result["steps"] if "cache" in step]
+
+def test_repeat_question_served_from_cache():
+    """Повторный вопрос (с другим регистром и пробелами) отвечается из памяти без вызова LLM."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(db_path=None))
+    first, first_time = ask()
+    second, second_time = ask("  какое   НАПРЯЖЕНИЕ питания? ")
+    assert not cache_steps(first)
+    assert cache_steps(second)[0]["cache"] == "memory"
+    assert second["final_answer"] == first["final_answer"]
+    assert second_time < FAKE_LATENCY / 2
+    # Другой документ — другой ключ
+    other, _ = ask(document=DOCUMENT.replace("220", "110"))
+    assert not cache_steps(other)
+    RESULTS["test_repeat_question_served_from_cache"] = first_time, second_time
+
+def test_sqlite_tier_survives_restart_and_invalidation():
+    """Ответ из SQLite находится новым экземпляром кэша; сброс по документу удаляет его."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "answers.sqlite")
+        set_answer_cache(AnswerCache(db_path=db_path))
+        first, _ = ask()
+
+        # «Перезапуск»: новый кэш с пустой памятью и тем же файлом
+        restarted = AnswerCache(db_path=db_path)
+        set_answer_cache(restarted)
+        second, _ = ask()
+        assert cache_steps(second)[0]["cache"] == "sqlite"
+        assert second["final_answer"] == first["final_answer"]
+
+        from agents.summarizer import document_hash
+        try:
+            assert restarted.invalidate_document(document_hash(DOCUMENT)) >= 1
+            third, _ = ask()
+            assert not cache_steps(third)
+        finally:
+            set_answer_cache(AnswerCache(db_path=None))
+
+def test_answer_cache_ttl():
+    cache = AnswerCache(ttl=0.05, db_path=None)
+    key = cache.make_key("doc", "summarizer", "v1", "Вопрос")
+    cache.set(key, "ответ")
+    assert cache.get(key)["answer"] == "ответ"
+    time.sleep(0.1)
+    assert cache.get(key) is None
+
+def test_sqlite_tier_is_bounded():
+    """Истёкшие записи удаляются при записи и при запуске, лишние — по давности использования."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "answers.sqlite")
+        cache = AnswerCache(db_path=db_path, db_max_rows=4, purge_every=2)
+        keys = [cache.make_key("doc", "summarizer", "v1", f"Вопрос {i}") for i in range(6)]
+        cache.set(keys[0], "ответ 0", ttl=0.05)
+        time.sleep(0.1)
+        cache.set(keys[1], "ответ 1")
+        # Вторая запись запустила очистку: истёкшая строка удалена, а не просто пропускается
+        assert cache.stats()["sqlite_entries"] == 1 and cache.db_expirations == 1
+        cache.set(keys[2], "ответ 2")
+        time.sleep(0.01)
+        # Чтение из SQLite продлевает жизнь записи: вытесняется keys[2], а не keys[1]
+        assert AnswerCache(db_path=db_path, maxsize=1).get(keys[1])["tier"] == "sqlite"
+        time.sleep(0.01)
+        for i in (3, 4, 5):
+            cache.set(keys[i], f"ответ {i}")
+        # Лимит соблюдается с точностью до purge_every записей между очистками
+        stats = cache.stats()
+        assert stats["sqlite_entries"] == 4 and stats["sqlite_evictions"] == 1
+        restarted = AnswerCache(db_path=db_path)
+        assert restarted.get(keys[2]) is None and restarted.get(keys[1])["answer"] == "ответ 1"
+        # Перезапуск с меньшим лимитом сразу обрезает таблицу
+        assert AnswerCache(db_path=db_path, db_max_rows=1).stats()["sqlite_entries"] == 1
+
+def run_answer_cache_test():
+    test_repeat_question_served_from_cache()
+    first_time, second_time = RESULTS["test_repeat_question_served_from_cache"]
+    test_sqlite_tier_survives_restart_and_invalidation()
+    test_answer_cache_ttl()
+    test_sqlite_tier_is_bounded()
+    with open("answer_cache_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ КЭША ОТВЕТОВ АГЕНТОВ\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Задержка одного вызова LLM: {FAKE_LATENCY:.2f} сек\n")
+        f.write(f"Первый вопрос: {first_time * 1000:.0f} мс\n")
+        f.write(f"Повторный вопрос (кэш в памяти): {second_time * 1000:.1f} мс\n")
+        f.write("SQLite переживает перезапуск, сброс по документу и TTL работают ✅\n")
+        f.write("SQLite ограничен: истёкшие записи удаляются, лишние вытесняются по LRU ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в answer_cache_test.txt")
+
+if __name__ == "__main__":
+    run_answer_cache_test()
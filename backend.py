@@ -1,17 +1,31 @@
 # main.py
+import asyncio
+import hashlib
+import json
 import os
-import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from langchain_gigachat import GigaChat
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain.document_loaders import TextLoader, PyPDFLoader, Docx2txtLoader
 from dotenv import load_dotenv
-from agent_orchestrator import route_query
-from utils.sanitizer import sanitize_extracted_text, is_text_safe
+from agent_orchestrator import (aprecompute_artifacts, aroute_batch, aroute_query, get_orchestrator_stats,
+                                get_single_flight_stats)
+from utils.extraction import aextract_document, shutdown_extraction_pool, warmup_extraction_pool
+from utils.retrieval import build_retrieval_index
+from utils.document_store import DocumentTooLarge, create_document_store
+from utils.upload_cache import UploadCache
+from utils import llm_pool
+from utils.llm_scheduler import get_scheduler, llm_lane
+from utils import metrics
+from utils.jobs import JobQueue
+from agents.marketing_expert import get_industry_cache_stats
+from agents.summarizer import document_hash
+from utils.answer_cache import get_answer_cache
 
 
 # Загружаем переменные окружения
@@ -28,23 +42,204 @@ STATIC_DIR.mkdir(exist_ok=True)
 # Монтируем статику
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-document_text = ""
+# Документы пользователей: у каждой сессии свой текст и производные данные.
+# DOCUMENT_STORE=shared — общее хранилище на диске для нескольких рабочих процессов uvicorn
+SESSION_COOKIE = "docuai_session"
+SESSION_HEADER = "X-Session-Id"
+document_store = create_document_store()
+# Результаты обработки файлов по SHA-256 содержимого, расширению и версии извлечения:
+# повторная загрузка без повторного извлечения
+upload_cache = UploadCache()
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Максимальный размер загружаемого файла (байт)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+# Запас на заголовки multipart при проверке размера тела запроса
+MULTIPART_OVERHEAD = 64 * 1024
+# Проверка и индексация документа нагружают CPU: много потоков только спорят за GIL и задерживают event loop
+# (само извлечение текста идёт в пуле процессов utils/extraction.py)
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))
+extraction_executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="extract")
+# Фоновые задачи агентов (/jobs): очередь в SQLite, выполняются рабочими в этом процессе
+job_queue = JobQueue(aroute_query)
+# Максимум вопросов в одном запросе /chat/batch
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "100"))
+# Краткое содержание, структура и отрасль документа считаются в фоне сразу после /upload
+PRECOMPUTE_ARTIFACTS = os.getenv("PRECOMPUTE_ARTIFACTS", "1") == "1"
+precompute_tasks: set = set()
 
-# Инициализация GigaChat
-llm = GigaChat(
-    credentials=os.getenv("API_KEY"), 
-    model="GigaChat",
-    verify_ssl_certs=False,
-)
+def get_session_id(request: Request) -> Optional[str]:
+    """Сессия берётся из заголовка X-Session-Id, иначе из cookie."""
+    return request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+
+# Время до первого токена (TTFT) потоковых ответов /chat/stream
+stream_stats = {"requests": 0, "with_tokens": 0, "ttft_last_ms": None, "ttft_sum_ms": 0.0}
+
+# Инициализация GigaChat: общий клиент и цепочки агентов собираются один раз
+@app.on_event("startup")
+async def warmup_llm():
+    llm_pool.warmup()
+    warmup_extraction_pool()
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_extraction_pool():
+    # Незавершённые задачи возвращаются в очередь и продолжатся после перезапуска
+    await job_queue.stop()
+    for task in list(precompute_tasks):
+        task.cancel()
+    shutdown_extraction_pool()
+
+class LimitUploadSize:
+    """
+    Ограничивает тело запроса /upload по сырым байтам: с Content-Length больше лимита — 413 сразу,
+    без него (chunked) — 413, как только прочитанное тело превысит лимит, до разбора multipart целиком.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/upload":
+            return await self.app(scope, receive, send)
+        limit = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+        detail = f"Файл больше {MAX_UPLOAD_BYTES} байт"
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            return await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Разбор тела прерывается, FastAPI отвечает 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Раньше метрик: middleware метрик оказывается внешним и учитывает ответы 413
+app.add_middleware(LimitUploadSize)
+
+HTTP_SECONDS = metrics.Histogram("docuai_http_request_duration_seconds",
+                                 "Время ответа HTTP (для потоковых — до начала ответа)", ("path",))
+HTTP_REQUESTS = metrics.Counter("docuai_http_requests_total", "HTTP-запросы по статусу", ("path", "method", "status"))
+LLM_IN_FLIGHT = metrics.Gauge("docuai_llm_in_flight", "Вызовы LLM, выполняющиеся сейчас")
+LLM_QUEUE_DEPTH = metrics.Gauge("docuai_llm_queue_depth", "Вызовы LLM в очереди планировщика", ("lane",))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Шаблон маршрута, а не сам URL — чтобы не плодить метки
+        route = request.scope.get("route")
+        path = getattr(route, "path", "other")
+        HTTP_SECONDS.observe(time.perf_counter() - started, path=path)
+        HTTP_REQUESTS.inc(path=path, method=request.method, status=str(status))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Метрики в формате Prometheus."""
+    scheduler_stats = get_scheduler().stats()
+    LLM_IN_FLIGHT.set(scheduler_stats["in_flight"])
+    for lane, depth in scheduler_stats["queue_depth"].items():
+        LLM_QUEUE_DEPTH.set(depth, lane=lane)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "worker_pid": os.getpid(),
+        "llm_pool": llm_pool.get_pool_stats(),
+        "industry_cache": get_industry_cache_stats(),
+        "document_store": document_store.stats(),
+        "upload_cache": upload_cache.stats(),
+        "answer_cache": get_answer_cache().stats(),
+        "llm_scheduler": get_scheduler().stats(),
+        "single_flight": get_single_flight_stats(),
+        "orchestrator": get_orchestrator_stats(),
+        "jobs": await job_queue.astats(),
+        "streaming": {
+            "requests": stream_stats["requests"],
+            "ttft_last_ms": stream_stats["ttft_last_ms"],
+            "ttft_avg_ms": stream_stats["ttft_sum_ms"] / stream_stats["with_tokens"] if stream_stats["with_tokens"] else None
+        }
+    }
 
 @app.get("/", response_class=HTMLResponse)
 async def get_chat():
     with open("static/index.html", encoding="utf-8") as f:
         return HTMLResponse(f.read())
 
+async def save_upload(file: UploadFile, file_path: Path) -> str:
+    """
+    Пишет загрузку на диск блоками по UPLOAD_CHUNK_SIZE, не блокируя event loop,
+    и по ходу считает SHA-256. Файл больше MAX_UPLOAD_BYTES — 413 (тело запроса целиком
+    ограничено раньше, в LimitUploadSize; здесь — точная проверка размера самого файла).
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Файл больше {MAX_UPLOAD_BYTES} байт")
+            sha256.update(chunk)
+            await run_in_threadpool(buffer.write, chunk)
+    return sha256.hexdigest()
+
+def build_document(document_text: str, sanitized_chars: int, safe: bool) -> dict:
+    """Проверяет извлечённый текст и строит производные данные документа."""
+    # === САНИТАЙЗАЦИЯ === (потоковая очистка уже выполнена при извлечении, без ограничения длины)
+    if not safe:
+        raise ValueError("Файл содержит недопустимый контент")
+
+    if sanitized_chars < 10:  # Слишком короткий после очистки
+        raise ValueError("Файл не содержит допустимого текста")
+
+    # Индекс BM25 строится один раз — technical_reviewer получает только нужные фрагменты
+    document_artifacts = {
+        "retrieval_index": build_retrieval_index(document_text),
+        # Ключ кэша ответов агентов
+        "document_hash": document_hash(document_text)
+    }
+
+    # Размер промпта ограничивается при каждом вызове модели (бюджет токенов в utils/llm_pool.py)
+
+    return document_artifacts
+
+async def precompute_document(session_id: str, cache_key: str, document_text: str,
+                              document_artifacts: dict) -> None:
+    """
+    Заготовки для общих вопросов (см. aprecompute_artifacts) — в полосе LLM "background".
+    Пишутся в документ сессии и в кэш загрузок: повторная загрузка файла их не пересчитывает.
+    """
+    with llm_lane("background"):
+        computed = await aprecompute_artifacts(document_text, document_artifacts)
+    if not computed:
+        return
+    document = await run_in_threadpool(document_store.get, session_id)
+    # Пока считали, в сессию могли загрузить другой документ
+    if document is not None and document["artifacts"].get("document_hash") == document_artifacts["document_hash"]:
+        await run_in_threadpool(document_store.update_artifacts, session_id, **computed)
+    await run_in_threadpool(upload_cache.put, cache_key, document_text, {**document_artifacts, **computed})
+
+def schedule_precompute(*args) -> None:
+    # Задача, а не BackgroundTasks: ответ /upload не ждёт её ни при каком сервере (и в тестах через ASGITransport)
+    task = asyncio.create_task(precompute_document(*args))
+    precompute_tasks.add(task)
+    task.add_done_callback(precompute_tasks.discard)
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    global document_text
+async def upload_file(request: Request, response: Response, file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="Файл не выбран")
 
@@ -52,56 +247,235 @@ async def upload_file(file: UploadFile = File(...)):
     if ext not in ["txt", "pdf", "docx"]:
         raise HTTPException(status_code=400, detail="Поддерживаются только .txt, .pdf, .docx")
 
-    file_path = UPLOAD_DIR / file.filename
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Уникальное имя: одинаковые имена файлов разных пользователей не перезаписывают друг друга
+    file_path = UPLOAD_DIR / f"{uuid.uuid4().hex}.{ext}"
+    # Длительность этапов загрузки, мс — возвращается клиенту
+    timings = {}
+    started = time.perf_counter()
+
+    def mark(stage: str, since: float) -> float:
+        now = time.perf_counter()
+        timings[stage] = round((now - since) * 1000, 1)
+        metrics.observe_stage("upload." + stage.removesuffix("_ms"), now - since)
+        return now
 
     try:
-        if ext == "txt":
-            loader = TextLoader(file_path, encoding="utf-8")
-        elif ext == "pdf":
-            loader = PyPDFLoader(str(file_path))
-        elif ext == "docx":
-            loader = Docx2txtLoader(str(file_path))
-        else:
-            raise ValueError("Неподдерживаемый формат")
+        content_hash = await save_upload(file, file_path)
+        stage_start = mark("save_ms", started)
+        # Те же байты с другим расширением или после смены конвейера извлечения — другая запись
+        cache_key = UploadCache.make_key(content_hash, ext)
 
-        docs = loader.load()
-        document_text = "\n\n".join([doc.page_content for doc in docs])
-            # === САНИТАЙЗАЦИЯ ===
-        if not is_text_safe(document_text):
-            raise ValueError("Файл содержит недопустимый контент")
-    
-        sanitized_text = sanitize_extracted_text(document_text)
-    
-        if len(sanitized_text) < 10:  # Слишком короткий после очистки
-            raise ValueError("Файл не содержит допустимого текста")
+        session_id = get_session_id(request) or uuid.uuid4().hex
+        cached = await run_in_threadpool(upload_cache.get, cache_key)
+        if cached is not None:
+            document_text, document_artifacts = cached["text"], cached["artifacts"]
+            mark("cache_ms", stage_start)
+        else:
+            # Разбор и санитайзинг по страницам — в пуле процессов, индексация — вне event loop
+            extracted = await aextract_document(file_path, ext)
+            stage_start = mark("extract_ms", stage_start)
+            timings.update(extracted["timings"], pages=extracted["pages"])
+            metrics.observe_stage("upload.sanitize", extracted["timings"]["sanitize_cpu_ms"] / 1000)
+            document_text = extracted["text"]
+            loop = asyncio.get_running_loop()
+            document_artifacts = await loop.run_in_executor(
+                extraction_executor, build_document, document_text, extracted["sanitized_chars"], extracted["safe"]
+            )
+            stage_start = mark("index_ms", stage_start)
+            await run_in_threadpool(upload_cache.put, cache_key, document_text, document_artifacts)
+            mark("cache_ms", stage_start)
 
-        # # Ограничиваем размер (GigaChat имеет лимит контекста ~8K токенов)
-        # if len(document_text) > 8000:
-        #     document_text = document_text[:8000] + "... (обрезано для укладки в контекст)"
+        await run_in_threadpool(document_store.put, session_id, document_text, document_artifacts)
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+        if PRECOMPUTE_ARTIFACTS:
+            schedule_precompute(session_id, cache_key, document_text, document_artifacts)
 
-        return {"message": f"✅ Документ '{file.filename}' загружен и готов к анализу."}
+        return {
+            "message": f"✅ Документ '{file.filename}' загружен и готов к анализу.",
+            "session_id": session_id,
+            "cached": cached is not None,
+            "timings": {**timings, "total_ms": round((time.perf_counter() - started) * 1000, 1)}
+        }
 
+    except HTTPException:
+        raise
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"Документ слишком большой: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка обработки файла: {str(e)}")
+    finally:
+        # Исходный файл нужен только на время извлечения текста
+        await run_in_threadpool(file_path.unlink, missing_ok=True)
 
 
 # В эндпоинте /chat
 @app.post("/chat")
 async def chat(request: Request):
-    global document_text
     body = await request.json()
     user_message = body.get("message", "").strip()
 
-    if not document_text:
+    document = await run_in_threadpool(document_store.get, get_session_id(request))
+    if document is None:
         return {"response": "⚠️ Сначала загрузите документ."}
     if not user_message:
         return {"response": "💬 Пожалуйста, введите запрос."}
 
     try:
         # Запускаем многоагентную систему!
-        final_response = route_query(document_text, user_message)
+        final_response = await aroute_query(document["text"], user_message, document["artifacts"])
         return final_response
     except Exception as e:
-        return {"response": f"❌ Ошибка агентов: {str(e)}"}
\ No newline at end of file
+        return {"response": f"❌ Ошибка агентов: {str(e)}"}
+
+
+@app.post("/chat/batch")
+async def chat_batch(request: Request):
+    """
+    Пакет вопросов к документу сессии: {"queries": [...]}.
+    Ответы — в порядке вопросов, у каждого latency_ms и error.
+    """
+    started = time.perf_counter()
+    body = await request.json()
+    queries = body.get("queries")
+    if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+        raise HTTPException(status_code=400, detail="Ожидается {\"queries\": [\"вопрос\", ...]}")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Не больше {MAX_BATCH_QUERIES} вопросов за раз")
+
+    document = await run_in_threadpool(document_store.get, get_session_id(request))
+    if document is None:
+        raise HTTPException(status_code=404, detail="⚠️ Сначала загрузите документ.")
+
+    queries = [query.strip() for query in queries]
+    results = [None] * len(queries)
+    to_run = []
+    for index, query in enumerate(queries):
+        if query:
+            to_run.append(index)
+        else:
+            results[index] = {"query": query, "steps": [], "final_answer": "💬 Пожалуйста, введите запрос.",
+                              "usage": llm_pool.summarize_usage([]), "latency_ms": 0.0, "error": "empty query"}
+    # Пакет уступает место интерактивным запросам /chat в очереди к LLM
+    with llm_lane("batch"):
+        answered = await aroute_batch(document["text"], [queries[index] for index in to_run],
+                                      document["artifacts"])
+    for index, result in zip(to_run, answered):
+        if "duplicate_of" in result:
+            result["duplicate_of"] = to_run[result["duplicate_of"]]
+        results[index] = result
+    return {"results": results, "total_ms": (time.perf_counter() - started) * 1000}
+
+
+@app.delete("/cache/answers")
+async def invalidate_answers(request: Request):
+    """Сбрасывает закэшированные ответы агентов по документу текущей сессии."""
+    document = await run_in_threadpool(document_store.get, get_session_id(request))
+    if document is None:
+        raise HTTPException(status_code=404, detail="Документ сессии не найден")
+    doc_hash = document["artifacts"].get("document_hash") or document_hash(document["text"])
+    removed = await run_in_threadpool(get_answer_cache().invalidate_document, doc_hash)
+    return {"invalidated": removed}
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request):
+    """Ставит запрос к документу сессии в фоновую очередь и сразу возвращает id задачи."""
+    body = await request.json()
+    user_message = body.get("message", "").strip()
+    if not user_message:
+        raise HTTPException(status_code=400, detail="💬 Пожалуйста, введите запрос.")
+    document = await run_in_threadpool(document_store.get, get_session_id(request))
+    if document is None:
+        raise HTTPException(status_code=404, detail="⚠️ Сначала загрузите документ.")
+    doc_hash = document["artifacts"].get("document_hash") or document_hash(document["text"])
+    job_id = await job_queue.submit(document["text"], document["artifacts"], user_message, doc_hash)
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Статус задачи (queued, running, done, failed) и, когда готово, результат как у /chat."""
+    job = await job_queue.aget(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str):
+    """SSE: статус задачи, шаги и фрагменты ответа по мере выполнения, в конце {"type": "done", ...}."""
+    if await job_queue.aget(job_id) is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+
+    async def events():
+        async for event in job_queue.events(job_id):
+            yield _sse(event)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def _record_ttft(ttft_ms):
+    stream_stats["requests"] += 1
+    if ttft_ms is not None:
+        stream_stats["with_tokens"] += 1
+        stream_stats["ttft_last_ms"] = ttft_ms
+        stream_stats["ttft_sum_ms"] += ttft_ms
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Потоковый вариант /chat (Server-Sent Events): шаги оркестратора приходят
+    по мере выполнения, ответ агента — по токенам. Последнее событие
+    {"type": "done"} содержит steps, final_answer, usage и ttft_ms.
+    """
+    started = time.perf_counter()
+    body = await request.json()
+    user_message = body.get("message", "").strip()
+    # Снимок документа на момент запроса: новая загрузка не должна менять идущий ответ
+    document = await run_in_threadpool(document_store.get, get_session_id(request))
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_agents():
+        if document is None:
+            result = {"steps": [], "final_answer": "⚠️ Сначала загрузите документ."}
+        elif not user_message:
+            result = {"steps": [], "final_answer": "💬 Пожалуйста, введите запрос."}
+        else:
+            try:
+                result = await aroute_query(document["text"], user_message, document["artifacts"], queue.put)
+            except Exception as e:
+                result = {"steps": [], "final_answer": f"❌ Ошибка агентов: {str(e)}"}
+        await queue.put({"type": "done", **result})
+
+    async def events():
+        task = asyncio.create_task(run_agents())
+        ttft_ms = None
+        try:
+            while True:
+                event = await queue.get()
+                if event["type"] == "token" and ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                if event["type"] == "done":
+                    event["ttft_ms"] = ttft_ms
+                    event["total_ms"] = (time.perf_counter() - started) * 1000
+                    _record_ttft(ttft_ms)
+                    yield _sse(event)
+                    break
+                yield _sse(event)
+        finally:
+            # Клиент отключился — не тратим вызовы LLM впустую
+            task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,79 @@
+# batch_test.py
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+from backend import app
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+
+FAKE_LATENCY = 0.3
+DOCUMENT = "System unit DEXP Atlas. Manufacturer: Faktor LLC. Power supply: 220 V, 50 Hz.\n"
+QUERIES = [
+    "Какой производитель системного блока указан в документе?",
+    "Какое напряжение требуется для питания системного блока?",
+    "Какие интерфейсы используются для подключения монитора?",
+    "Какой телефон у производителя?",
+    "какое  напряжение требуется для питания системного блока?",
+    "Сделай краткое содержание документа",
+    "",
+    "Придумай A/B-тест для рекламы",
+    "Проанализируй структуру документа",
+    "Какой телефон у производителя?",
+]
+
+# Замеры тестов для отчёта run_batch_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+async def run_batch(queries: list) -> tuple:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        files = {"file": ("batch_test.txt", DOCUMENT.encode("utf-8"), "text/plain")}
+        (await client.post("/upload", files=files)).raise_for_status()
+        start = time.perf_counter()
+        response = await client.post("/chat/batch", json={"queries": queries})
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        bad = await client.post("/chat/batch", json={"queries": "не список"})
+        assert bad.status_code == 400
+    return response.json()["results"], elapsed
+
+def test_batch_runs_in_parallel_and_keeps_order():
+    """Пакет из 10 вопросов: порядок сохранён, дубли не выполняются повторно, время ≈ самого медленного."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    results, elapsed = asyncio.run(run_batch(QUERIES))
+
+    assert [r["query"] for r in results] == [q.strip() for q in QUERIES]
+    assert results[4]["duplicate_of"] == 1 and results[9]["duplicate_of"] == 3
+    assert results[4]["final_answer"] == results[1]["final_answer"]
+    assert results[6]["error"] == "empty query"
+    # У пустого вопроса та же форма ответа: нулевой расход токенов
+    assert results[6]["usage"] == {"calls": [], "prompt_tokens": 0, "completion_tokens": 0}
+    assert all(set(r["usage"]) == set(results[6]["usage"]) for r in results)
+    assert all(r["error"] is None for i, r in enumerate(results) if i != 6)
+    slowest = max(r["latency_ms"] for r in results) / 1000
+    serial = sum(r["latency_ms"] for r in results if "duplicate_of" not in r) / 1000
+    assert elapsed < slowest + FAKE_LATENCY, f"{elapsed:.2f} сек при самом медленном {slowest:.2f} сек"
+    RESULTS["test_batch_runs_in_parallel_and_keeps_order"] = elapsed, slowest, serial
+
+def run_batch_test():
+    test_batch_runs_in_parallel_and_keeps_order()
+    elapsed, slowest, serial = RESULTS["test_batch_runs_in_parallel_and_keeps_order"]
+    with open("batch_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ПАКЕТНЫХ ВОПРОСОВ /chat/batch\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Вопросов: {len(QUERIES)}, задержка одного вызова LLM: {FAKE_LATENCY:.2f} сек\n")
+        f.write(f"Пакет целиком: {elapsed:.2f} сек\n")
+        f.write(f"Самый медленный вопрос: {slowest:.2f} сек\n")
+        f.write(f"Сумма по уникальным вопросам (последовательно): {serial:.2f} сек\n")
+    print("✅ Тест завершён. Результаты сохранены в batch_test.txt")
+
+if __name__ == "__main__":
+    run_batch_test()
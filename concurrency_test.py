@@ -0,0 +1,97 @@
+# concurrency_test.py
+import asyncio
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+from backend import app
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+
+# Задержка одного вызова заглушки и число одновременных запросов
+FAKE_LATENCY = 0.3
+CONCURRENT_REQUESTS = 8
+
+DOCUMENT = "Системный блок DEXP. Производитель: ООО Фактор. Питание: 220 В.\n"
+
+# Замеры тестов для отчёта run_concurrency_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+async def measure_chat_latency(concurrency: int) -> float:
+    """Загружает документ и отправляет concurrency запросов /chat одновременно."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        files = {"file": ("concurrency_test.txt", DOCUMENT.encode("utf-8"), "text/plain")}
+        response = await client.post("/upload", files=files)
+        response.raise_for_status()
+
+        async def ask(i: int) -> dict:
+            r = await client.post("/chat", json={"message": f"Какое напряжение питания? #{i}"})
+            r.raise_for_status()
+            return r.json()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(ask(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    assert all("final_answer" in r for r in results)
+    return elapsed
+
+def test_concurrent_chat_requests():
+    """N одновременных /chat должны занимать примерно столько же, сколько один."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    # Повторные вопросы не должны отвечаться из кэша — меряем сами вызовы агентов
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    single = asyncio.run(measure_chat_latency(1))
+    parallel = asyncio.run(measure_chat_latency(CONCURRENT_REQUESTS))
+    assert parallel < single * 2, f"{CONCURRENT_REQUESTS} запросов: {parallel:.2f} с, один: {single:.2f} с"
+    RESULTS["test_concurrent_chat_requests"] = single, parallel
+
+def expiring_client() -> SimpleNamespace:
+    """Клиент с токеном, истекающим через секунду: aget_token считает вызовы и выдаёт токен на час."""
+    inner = SimpleNamespace(_use_auth=True, _access_token=SimpleNamespace(expires_at=time.time() + 1), refreshes=0)
+
+    async def aget_token():
+        inner.refreshes += 1
+        await asyncio.sleep(0.05)
+        inner._access_token = SimpleNamespace(expires_at=time.time() + 3600)
+
+    inner.aget_token = aget_token
+    return SimpleNamespace(_client=inner)
+
+def test_token_refresh_runs_once():
+    """Запросы, одновременно заставшие истекающий токен, обновляют его одним вызовом OAuth."""
+    llm = expiring_client()
+    refreshes_before = llm_pool.get_pool_stats()["token_refreshes"]
+
+    async def main():
+        await asyncio.gather(*(llm_pool.arefresh_token_if_needed(llm) for _ in range(CONCURRENT_REQUESTS)))
+        # Токен свежий — дальше обновлять нечего
+        await llm_pool.arefresh_token_if_needed(llm)
+
+    asyncio.run(main())
+    assert llm._client.refreshes == 1
+    assert llm_pool.get_pool_stats()["token_refreshes"] == refreshes_before + 1
+
+def run_concurrency_test():
+    test_concurrent_chat_requests()
+    single, parallel = RESULTS["test_concurrent_chat_requests"]
+    test_token_refresh_runs_once()
+    with open("concurrency_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ПАРАЛЛЕЛЬНОЙ ОБРАБОТКИ /chat (заглушка GigaChat)\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Задержка одного вызова LLM: {FAKE_LATENCY:.2f} сек\n")
+        f.write(f"Один запрос: {single:.2f} сек\n")
+        f.write(f"{CONCURRENT_REQUESTS} одновременных запросов: {parallel:.2f} сек\n")
+        f.write(f"Ускорение относительно последовательного: {single * CONCURRENT_REQUESTS / parallel:.1f}x\n")
+        f.write(f"{CONCURRENT_REQUESTS} запросов при истекающем токене — одно обновление токена ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в concurrency_test.txt")
+
+if __name__ == "__main__":
+    run_concurrency_test()
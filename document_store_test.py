@@ -0,0 +1,89 @@
+# document_store_test.py
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.document_store import DocumentStore, DocumentTooLarge, approx_size
+
+TEXT = "System unit DEXP Atlas. Power supply: 220 V, 50 Hz.\n" * 20
+SIZE = approx_size(TEXT) + approx_size({})
+
+# Замеры тестов для отчёта run_document_store_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def test_lru_eviction():
+    """При переполнении бюджета вытесняется сессия, к которой дольше всего не обращались."""
+    store = DocumentStore(max_bytes=SIZE * 3, idle_ttl=3600)
+    for session_id in ("s1", "s2", "s3"):
+        store.put(session_id, TEXT)
+    # s1 прочитана — теперь самая старая s2
+    assert store.get("s1")["text"] == TEXT
+    store.put("s4", TEXT)
+    assert store.get("s2") is None
+    assert all(store.get(session_id) for session_id in ("s1", "s3", "s4"))
+    stats = store.stats()
+    assert stats["documents"] == 3 and stats["evictions"] == 1
+    assert stats["resident_bytes"] == SIZE * 3 <= stats["max_bytes"]
+    RESULTS["test_lru_eviction"] = stats
+
+def test_update_artifacts_keeps_current_session():
+    """Производные данные учитываются в бюджете; вытесняются другие сессии, а не обновляемая."""
+    store = DocumentStore(max_bytes=SIZE * 3, idle_ttl=3600)
+    for session_id in ("s1", "s2", "s3"):
+        store.put(session_id, TEXT)
+    assert store.update_artifacts("s1", summary="x" * (SIZE // 2))
+    assert store.get("s2") is None and store.get("s1")["artifacts"]["summary"]
+    assert store.stats()["resident_bytes"] <= store.max_bytes
+    assert not store.update_artifacts("missing", summary="x")
+
+def test_idle_ttl_expiration():
+    """Сессия, простаивающая дольше idle_ttl, удаляется; обращение продлевает срок."""
+    store = DocumentStore(max_bytes=SIZE * 10, idle_ttl=0.2)
+    store.put("idle", TEXT)
+    store.put("active", TEXT)
+    for _ in range(3):
+        time.sleep(0.1)
+        assert store.get("active")
+    assert store.get("idle") is None and store.get("active")
+    stats = store.stats()
+    assert stats["expirations"] == 1 and stats["documents"] == 1
+
+def test_stats_counters():
+    store = DocumentStore(max_bytes=SIZE * 2, idle_ttl=3600)
+    store.put("s1", TEXT)
+    store.get("s1")
+    store.get("s1")
+    store.get("missing")
+    store.get(None)
+    stats = store.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 2) and stats["hit_rate"] == 0.5
+    store.delete("s1")
+    assert store.stats()["documents"] == 0 and store.stats()["resident_bytes"] == 0
+    try:
+        store.put("huge", TEXT * 3)
+    except DocumentTooLarge:
+        pass
+    else:
+        raise AssertionError("ожидалась ошибка DocumentTooLarge")
+
+def run_document_store_test():
+    test_lru_eviction()
+    stats = RESULTS["test_lru_eviction"]
+    test_update_artifacts_keeps_current_session()
+    test_idle_ttl_expiration()
+    test_stats_counters()
+    with open("document_store_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ХРАНИЛИЩА ДОКУМЕНТОВ ПО СЕССИЯМ (DocumentStore)\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Бюджет {stats['max_bytes']} байт, занято {stats['resident_bytes']}, "
+                f"вытеснено {stats['evictions']} (LRU) ✅\n")
+        f.write("Производные данные учитываются в бюджете ✅\n")
+        f.write("Простаивающие сессии удаляются по idle_ttl ✅\n")
+        f.write("Счётчики попаданий и промахов ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в document_store_test.txt")
+
+if __name__ == "__main__":
+    run_document_store_test()
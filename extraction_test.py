@@ -0,0 +1,46 @@
+# extraction_test.py
+import asyncio
+import multiprocessing
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from pdf_benchmark import extract_serially, extract_with_pool, make_pdf
+from utils.extraction import aextract_document
+from utils.sanitizer import sanitize_extracted_text
+
+def test_parallel_extraction_matches_loader():
+    """Параллельное извлечение по диапазонам страниц даёт тот же очищенный текст и порядок, что PyPDFLoader."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "sample.pdf"
+        make_pdf(path, pages=60, lines_per_page=5)
+        _, sanitized = extract_serially(path)
+        result, _ = asyncio.run(extract_with_pool(path, processes=2))
+    assert result["pages"] == 60
+    assert result["text"] == sanitized
+    assert result["sanitized_chars"] == len(sanitized)
+    assert result["safe"]
+    assert sanitized.index("Page 59 line 1") < sanitized.index("Page 60 line 1")
+
+def test_text_file_is_sanitized():
+    """Хранится и уходит в промпты очищенный текст: опасные строки и теги удалены, кириллица сохранена."""
+    raw = "Системный блок DEXP\n<script>alert(1)</script>\nПитание: <b>220 В</b>\n"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "sample.txt"
+        path.write_text(raw, encoding="utf-8")
+        pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            result = asyncio.run(aextract_document(str(path), "txt", pool=pool))
+        finally:
+            pool.shutdown()
+    assert result["text"] == sanitize_extracted_text(raw) == "Системный блок DEXP\nПитание: 220 В"
+    assert not result["safe"]
+
+if __name__ == "__main__":
+    test_parallel_extraction_matches_loader()
+    test_text_file_is_sanitized()
+    print("✅ Параллельное извлечение совпадает с PyPDFLoader")
@@ -0,0 +1,257 @@
+# jobs_test.py
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+import backend
+from backend import app
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+from utils.jobs import JobQueue
+from utils.llm_scheduler import current_lane
+
+FAKE_LATENCY = 0.3
+DOCUMENT = "System unit DEXP Atlas. Power supply: 220 V, 50 Hz.\n"
+
+# Замеры тестов для отчёта run_jobs_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+async def wait_for_status(queue: JobQueue, job_id: str, statuses: set, timeout: float = 5.0) -> dict:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        job = await queue.aget(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"задача {job_id} не перешла в {statuses}: {job['status']}")
+
+async def jobs_over_http(db_path: str) -> tuple:
+    backend.job_queue = JobQueue(backend.aroute_query, db_path=db_path, poll_interval=0.1)
+    await backend.job_queue.start()
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            files = {"file": ("jobs_test.txt", DOCUMENT.encode("utf-8"), "text/plain")}
+            (await client.post("/upload", files=files)).raise_for_status()
+
+            start = time.perf_counter()
+            response = await client.post("/jobs", json={"message": "Сделай краткое содержание документа"})
+            submit_time = time.perf_counter() - start
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+            job = await wait_for_status(backend.job_queue, job_id, {"done", "failed"})
+            assert job == (await client.get(f"/jobs/{job_id}")).json()
+
+            streamed_id = (await client.post("/jobs", json={"message": "Какое напряжение питания?"})).json()["job_id"]
+            events = []
+            async with client.stream("GET", f"/jobs/{streamed_id}/stream") as stream:
+                async for line in stream.aiter_lines():
+                    if line.startswith("data: "):
+                        events.append(json.loads(line[len("data: "):]))
+            assert (await client.get("/jobs/unknown")).status_code == 404
+    finally:
+        await backend.job_queue.stop()
+    return submit_time, job, events
+
+def test_jobs_over_http():
+    """POST /jobs отвечает сразу, результат доступен по опросу и потоком SSE."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    with tempfile.TemporaryDirectory() as tmp:
+        submit_time, job, events = asyncio.run(jobs_over_http(os.path.join(tmp, "jobs.sqlite")))
+    assert submit_time < FAKE_LATENCY / 2
+    assert job["status"] == "done" and job["result"]["final_answer"] and job["attempts"] == 1
+    types = [event["type"] for event in events]
+    assert types[0] == "status" and "step" in types and "token" in types and types[-1] == "done"
+    assert events[-1]["result"]["final_answer"]
+    RESULTS["test_jobs_over_http"] = submit_time
+
+def test_jobs_survive_restart_and_respect_concurrency():
+    """Остановленная на середине задача выполняется после «перезапуска»; рабочих не больше workers."""
+    running = 0
+    max_running = 0
+    lanes = set()
+
+    async def runner(text, query, artifacts, on_event):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        lanes.add(current_lane())
+        try:
+            await asyncio.sleep(0.1)
+            return {"steps": [], "final_answer": f"{query}: {artifacts['marker']}", "error": None}
+        finally:
+            running -= 1
+
+    async def main(db_path: str):
+        queue = JobQueue(runner, db_path=db_path, workers=2, poll_interval=0.05)
+        ids = [await queue.submit(DOCUMENT, {"marker": "ok"}, f"q{i}", "doc") for i in range(6)]
+        await queue.start()
+        await wait_for_status(queue, ids[0], {"running"})
+        await queue.stop()
+        assert (await queue.aget(ids[0]))["status"] == "queued"
+
+        restarted = JobQueue(runner, db_path=db_path, workers=2, poll_interval=0.05)
+        await restarted.start()
+        try:
+            jobs = [await wait_for_status(restarted, job_id, {"done", "failed"}) for job_id in ids]
+        finally:
+            await restarted.stop()
+        return jobs
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = asyncio.run(main(os.path.join(tmp, "jobs.sqlite")))
+    assert all(job["status"] == "done" for job in jobs)
+    assert jobs[0]["result"]["final_answer"] == "q0: ok" and jobs[0]["attempts"] == 1
+    assert max_running == 2 and lanes == {"background"}
+
+def test_expired_lease_is_taken_over():
+    """Процесс упал посреди задачи: после истечения аренды её берёт другой рабочий."""
+    async def runner(text, query, artifacts, on_event):
+        return {"steps": [], "final_answer": "готово", "error": None}
+
+    async def main(db_path: str):
+        crashed = JobQueue(runner, db_path=db_path, lease=0.1)
+        job_id = await crashed.submit(DOCUMENT, {}, "q", "doc")
+        assert crashed._claim()["id"] == job_id  # взяли и «упали», не завершив
+        survivor = JobQueue(runner, db_path=db_path, lease=0.1, poll_interval=0.05)
+        await survivor.start()
+        try:
+            return await wait_for_status(survivor, job_id, {"done", "failed"})
+        finally:
+            await survivor.stop()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        job = asyncio.run(main(os.path.join(tmp, "jobs.sqlite")))
+    assert job["status"] == "done" and job["attempts"] == 2
+
+def test_stale_worker_cannot_overwrite_result():
+    """Рабочий, чья аренда истекла и была перехвачена, не перезаписывает чужой результат."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "jobs.sqlite")
+        slow = JobQueue(None, db_path=db_path, lease=0.05)
+        job_id = asyncio.run(slow.submit(DOCUMENT, {}, "q", "doc"))
+        stale = slow._claim()
+        time.sleep(0.1)
+        fresh = JobQueue(None, db_path=db_path, lease=0.05)._claim()
+        assert fresh["id"] == job_id and fresh["token"] != stale["token"]
+        assert fresh["text"] == DOCUMENT
+        assert slow._finish(job_id, fresh["token"], "done", {"final_answer": "новый"}, None)
+        assert not slow._finish(job_id, stale["token"], "done", {"final_answer": "старый"}, None)
+        job = slow.get(job_id)
+    assert job["status"] == "done" and job["result"]["final_answer"] == "новый"
+
+def test_worker_survives_errors():
+    """Сбой при записи итога или нечитаемый документ: задача failed, рабочий берёт следующую."""
+    async def runner(text, query, artifacts, on_event):
+        return {"steps": [], "final_answer": f"{query}: ok", "error": None}
+
+    async def main(db_path: str):
+        queue = JobQueue(runner, db_path=db_path, workers=1, poll_interval=0.05)
+        broken = await queue.submit(DOCUMENT, {}, "broken", "doc1")
+        corrupt = await queue.submit(DOCUMENT + "2", {"x": 1}, "corrupt", "doc2")
+        healthy = await queue.submit(DOCUMENT + "3", {}, "healthy", "doc3")
+        queue._execute("UPDATE job_documents SET artifacts = ? WHERE doc_hash = 'doc2'", (b"not a pickle",))
+        finish = queue._finish
+
+        def failing_finish(job_id, token, status, result, error):
+            if job_id == broken and status == "done":
+                raise sqlite3.OperationalError("database is locked")
+            return finish(job_id, token, status, result, error)
+
+        queue._finish = failing_finish
+        await queue.start()
+        try:
+            return [await wait_for_status(queue, job_id, {"done", "failed"}) for job_id in (broken, corrupt, healthy)], \
+                queue.stats()
+        finally:
+            await queue.stop()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        (broken, corrupt, healthy), stats = asyncio.run(main(os.path.join(tmp, "jobs.sqlite")))
+    assert broken["status"] == "failed" and "database is locked" in broken["error"]
+    assert corrupt["status"] == "failed" and "документ" in corrupt["error"]
+    assert healthy["status"] == "done" and healthy["result"]["final_answer"] == "healthy: ok"
+    assert stats["worker_errors"] == 1
+
+def test_finished_jobs_are_purged():
+    """Завершённые задачи старше retention удаляются при запуске рабочих."""
+    async def main(db_path: str):
+        old = JobQueue(None, db_path=db_path)
+        finished = await old.submit(DOCUMENT, {}, "done", "doc1")
+        claimed = old._claim()
+        old._finish(finished, claimed["token"], "done", {"final_answer": "ok"}, None)
+        queued = await old.submit(DOCUMENT, {}, "queued", "doc2")
+        queue = JobQueue(None, db_path=db_path, retention=0, poll_interval=0.05)
+        queue._claim = lambda: None  # оставшаяся задача не выполняется — проверяем только очистку
+        await queue.start()
+        await asyncio.sleep(0.1)
+        await queue.stop()
+        documents = queue._fetch("SELECT doc_hash FROM job_documents")
+        return queue.get(finished), queue.get(queued), documents, queue.stats()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        finished, queued, documents, stats = asyncio.run(main(os.path.join(tmp, "jobs.sqlite")))
+    assert finished is None and queued["status"] == "queued"
+    assert documents == [("doc2",)] and stats["purged"] == 1
+
+def test_resubmitted_document_refreshes_artifacts():
+    """Повторная задача по тому же документу обновляет сохранённые заготовки, а не оставляет первые."""
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(None, db_path=os.path.join(tmp, "jobs.sqlite"))
+        asyncio.run(queue.submit(DOCUMENT, {}, "первый", "doc"))
+        asyncio.run(queue.submit(DOCUMENT, {"summary": "готово"}, "второй", "doc"))
+        assert queue._claim()["artifacts"] == {"summary": "готово"}
+        assert queue._fetch("SELECT COUNT(*) FROM job_documents") == [(1,)]
+
+def test_events_end_when_job_is_deleted():
+    """Задачу удалили, пока поток ждал событий: поток заканчивается, а не падает на None."""
+    async def main(db_path: str):
+        queue = JobQueue(None, db_path=db_path, poll_interval=0.05)
+        job_id = await queue.submit(DOCUMENT, {}, "q", "doc")
+        events = []
+        async for event in queue.events(job_id):
+            events.append(event)
+            queue._execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return events, await queue.astats()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        events, stats = asyncio.run(asyncio.wait_for(main(os.path.join(tmp, "jobs.sqlite")), 2.0))
+    assert events == [{"type": "status", "status": "queued"}]
+    assert stats["by_status"] == {} and stats["submitted"] == 1
+
+def run_jobs_test():
+    test_jobs_over_http()
+    submit_time = RESULTS["test_jobs_over_http"]
+    test_jobs_survive_restart_and_respect_concurrency()
+    test_expired_lease_is_taken_over()
+    test_stale_worker_cannot_overwrite_result()
+    test_worker_survives_errors()
+    test_finished_jobs_are_purged()
+    test_resubmitted_document_refreshes_artifacts()
+    test_events_end_when_job_is_deleted()
+    with open("jobs_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ФОНОВЫХ ЗАДАЧ /jobs\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"POST /jobs ответил за {submit_time * 1000:.1f} мс (вызов LLM — {FAKE_LATENCY:.2f} сек)\n")
+        f.write("Опрос и SSE-поток возвращают результат ✅\n")
+        f.write("Задачи переживают перезапуск, не больше 2 рабочих одновременно ✅\n")
+        f.write("Задачу упавшего процесса подхватывают после истечения аренды ✅\n")
+        f.write("Опоздавший рабочий не перезаписывает результат (токен аренды) ✅\n")
+        f.write("Ошибки рабочего не останавливают очередь ✅\n")
+        f.write("Завершённые задачи старше JOB_RETENTION удаляются ✅\n")
+        f.write("Повторная задача обновляет заготовки документа, поток удалённой задачи завершается ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в jobs_test.txt")
+
+if __name__ == "__main__":
+    run_jobs_test()
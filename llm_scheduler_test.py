@@ -0,0 +1,147 @@
+# llm_scheduler_test.py
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from agent_orchestrator import aroute_query
+from utils import llm_pool, metrics
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+from utils.llm_scheduler import LLMScheduler, llm_lane, set_scheduler
+
+# «Сервер» принимает SERVER_RPS запросов в секунду, остальным отвечает 429
+SERVER_RPS = 5
+CALLS = 15
+FAKE_LATENCY = 0.05
+
+# Замеры тестов для отчёта run_llm_scheduler_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def use_fake(**options) -> None:
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY, **options))
+
+async def burst_of_calls(count: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(llm_pool.arun_chain("router", {"query": f"Какое напряжение? #{i}"})
+                           for i in range(count)))
+    return time.perf_counter() - start
+
+def test_retries_throttled_calls():
+    """Без ограничения частоты сервер отвечает 429, планировщик повторяет с задержкой — все вызовы успешны."""
+    use_fake(rate_limit=SERVER_RPS)
+    scheduler = LLMScheduler(rate=0, max_retries=10, backoff_base=0.1, backoff_max=2.0)
+    set_scheduler(scheduler)
+    retries_before = metrics.LLM_RETRIES.value()
+    try:
+        elapsed = asyncio.run(burst_of_calls(CALLS))
+    finally:
+        set_scheduler(LLMScheduler())
+    stats = scheduler.stats()
+    assert stats["throttled"] > 0 and stats["retries"] >= stats["throttled"]
+    # Счётчик Prometheus растёт на каждый повтор, а не выставляется значением
+    assert metrics.LLM_RETRIES.value() - retries_before == stats["retries"]
+    assert stats["failures"] == 0 and stats["in_flight"] == 0
+    RESULTS["test_retries_throttled_calls"] = elapsed, stats
+
+def test_rate_limit_avoids_throttling():
+    """Token bucket чуть ниже лимита сервера: ни одного 429."""
+    use_fake(rate_limit=SERVER_RPS)
+    scheduler = LLMScheduler(rate=SERVER_RPS * 0.9, burst=1, max_retries=0)
+    set_scheduler(scheduler)
+    try:
+        elapsed = asyncio.run(burst_of_calls(CALLS))
+    finally:
+        set_scheduler(LLMScheduler())
+    stats = scheduler.stats()
+    assert stats["throttled"] == 0 and stats["failures"] == 0
+    assert stats["wait_ms"]["interactive"]["max"] > 1000
+    RESULTS["test_rate_limit_avoids_throttling"] = elapsed, stats
+
+def test_rate_wait_does_not_hold_slot():
+    """Вызов, ждущий токена bucket, не занимает место: in_flight не больше реально выполняющихся."""
+    scheduler = LLMScheduler(rate=10, burst=1, max_in_flight=4)
+    running = 0
+    observed = []
+
+    async def call():
+        nonlocal running
+        running += 1
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def main():
+        tasks = [asyncio.create_task(scheduler.run(call)) for _ in range(5)]
+        while not all(task.done() for task in tasks):
+            observed.append((scheduler.stats()["in_flight"], running))
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert all(in_flight <= max(running, 1) for in_flight, running in observed), observed
+    assert max(in_flight for in_flight, _ in observed) <= 1
+
+def test_interactive_lane_goes_first():
+    """При занятом единственном месте первыми его получают интерактивные вызовы, потом пакетные, потом фоновые."""
+    scheduler = LLMScheduler(rate=0, max_in_flight=1)
+    order = []
+
+    async def call(label: str, duration: float = 0.01):
+        await asyncio.sleep(duration)
+        order.append(label)
+
+    async def submit(lane: str, label: str):
+        with llm_lane(lane):
+            await scheduler.run(lambda: call(label))
+
+    async def main():
+        blocker = asyncio.create_task(scheduler.run(lambda: call("blocker", 0.1)))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(submit(lane, f"{lane}{i}"))
+                 for i in range(2) for lane in ("background", "batch", "interactive")]
+        await asyncio.sleep(0.02)
+        assert scheduler.stats()["queue_depth"] == {"interactive": 2, "batch": 2, "background": 2}
+        await asyncio.gather(blocker, *tasks)
+
+    asyncio.run(main())
+    assert order == ["blocker", "interactive0", "interactive1", "batch0", "batch1", "background0", "background1"]
+
+def test_persistent_failure_reported_as_error():
+    """Сервер стабильно отвечает 503: после всех повторов ошибка попадает в поле error ответа."""
+    use_fake(error_rate=1.0, error_status=503)
+    scheduler = LLMScheduler(rate=0, max_retries=2, backoff_base=0.01)
+    set_scheduler(scheduler)
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    try:
+        result = asyncio.run(aroute_query("Power supply 220 V.", "Какое напряжение питания?"))
+    finally:
+        set_scheduler(LLMScheduler())
+    assert result["error"] and "503" in result["error"]
+    assert scheduler.stats()["server_errors"] == 3 and scheduler.stats()["failures"] == 1
+
+def run_llm_scheduler_test():
+    test_retries_throttled_calls()
+    throttled_time, throttled_stats = RESULTS["test_retries_throttled_calls"]
+    test_rate_limit_avoids_throttling()
+    limited_time, limited_stats = RESULTS["test_rate_limit_avoids_throttling"]
+    test_rate_wait_does_not_hold_slot()
+    test_interactive_lane_goes_first()
+    test_persistent_failure_reported_as_error()
+    with open("llm_scheduler_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ПЛАНИРОВЩИКА ВЫЗОВОВ LLM\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Сервер принимает {SERVER_RPS} запросов/сек, одновременно отправлено {CALLS} вызовов\n")
+        f.write(f"Только повторы: {throttled_time:.2f} сек, ответов 429: {throttled_stats['throttled']}, "
+                f"повторов: {throttled_stats['retries']}\n")
+        f.write(f"Token bucket {SERVER_RPS * 0.9:.1f}/сек: {limited_time:.2f} сек, ответов 429: "
+                f"{limited_stats['throttled']}, макс. ожидание {limited_stats['wait_ms']['interactive']['max']:.0f} мс\n")
+        f.write("Ожидание токена bucket не занимает место in-flight ✅\n")
+        f.write("Приоритет полос interactive → batch → background соблюдается ✅\n")
+        f.write("Постоянная ошибка 503 возвращается в поле error ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в llm_scheduler_test.txt")
+
+if __name__ == "__main__":
+    run_llm_scheduler_test()
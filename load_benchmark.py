@@ -0,0 +1,271 @@
+# load_benchmark.py
+"""
+Нагрузочный бенчмарк без сети: /upload и /chat через приложение FastAPI
+(httpx.ASGITransport) с локальной заглушкой GigaChat.
+
+Задержка, скорость генерации и доля ошибок заглушки задаются переменными
+окружения BENCH_*. Результат — p50/p95/p99 задержки, запросов в секунду и
+задержка event loop — сохраняется в benchmark_results/load_<время>.json и
+сравнивается с предыдущим прогоном в load_benchmark.txt.
+
+A/B режимов оркестратора — два прогона подряд, второй сравнится с первым:
+BENCH_ORCHESTRATOR_MODE=pipeline, затем BENCH_ORCHESTRATOR_MODE=single_call.
+"""
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+import agent_orchestrator
+import backend
+from backend import app
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.extraction import EXTRACTION_PROCESSES, get_extraction_pool
+from utils.fake_gigachat import FakeGigaChat
+from utils.llm_scheduler import LLMScheduler, get_scheduler, set_scheduler
+from utils.upload_cache import UploadCache
+
+BENCH_DOCUMENTS = int(os.getenv("BENCH_DOCUMENTS", "8"))
+BENCH_REQUESTS = int(os.getenv("BENCH_REQUESTS", "200"))
+BENCH_CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "16"))
+# Заглушка GigaChat: задержка первого токена (сек), токенов в секунду (0 — мгновенно), доля ошибок 5xx
+BENCH_LLM_LATENCY = float(os.getenv("BENCH_LLM_LATENCY", "0.2"))
+BENCH_LLM_TOKEN_RATE = float(os.getenv("BENCH_LLM_TOKEN_RATE", "200"))
+BENCH_LLM_ERROR_RATE = float(os.getenv("BENCH_LLM_ERROR_RATE", "0.0"))
+BENCH_SEED = int(os.getenv("BENCH_SEED", "42"))
+# 1 — включить кэш ответов (по умолчанию каждый запрос доходит до LLM)
+BENCH_ANSWER_CACHE = os.getenv("BENCH_ANSWER_CACHE", "0") == "1"
+# Режим оркестратора: pipeline или single_call (см. agent_orchestrator.ORCHESTRATOR_MODE)
+BENCH_ORCHESTRATOR_MODE = os.getenv("BENCH_ORCHESTRATOR_MODE", agent_orchestrator.ORCHESTRATOR_MODE)
+# 1 — фоновая подготовка артефактов после /upload (по умолчанию выключена: её вызовы LLM
+# смешались бы со счётчиком вызовов на запрос /chat); при включении считается отдельно
+BENCH_PRECOMPUTE = os.getenv("BENCH_PRECOMPUTE", "0") == "1"
+RESULTS_DIR = project_root / "benchmark_results"
+
+QUERIES = [
+    "Какой производитель системного блока указан в документе?",
+    "Какое напряжение требуется для питания системного блока?",
+    "Какие интерфейсы используются для подключения монитора?",
+    "Сделай краткое содержание документа",
+    "Придумай A/B-тест для рекламы этого блока",
+    "Проанализируй структуру документа",
+    "Расскажи про гарантию",
+    # Неоднозначные для локального роутера: их разбирает LLM
+    "Чем этот блок лучше других?",
+    "Что важно знать покупателю?",
+]
+
+def make_document(i: int) -> bytes:
+    lines = [
+        f"Document {i}. System unit DEXP Atlas H{i:03d}. Manufacturer: Faktor LLC, Vladivostok.",
+        "Power supply: 220 V, 50 Hz. Maximum power consumption 450 W.",
+        "Monitor interfaces: VGA, DVI, HDMI. Optical drive: DVD+-R/RW.",
+        f"Warranty: {12 + i} months. Service phone: (423) 279-55-89.",
+    ]
+    return ("\n".join(lines * 40) + "\n").encode("utf-8")
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль по методу ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": errors / len(latencies) if latencies else 0.0,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "elapsed_s": elapsed,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": max(latencies, default=0.0) * 1000,
+        },
+    }
+
+async def measure_loop_lag(stop: asyncio.Event, lags: List[float], interval: float = 0.005) -> None:
+    """Опоздания периодической задачи — насколько event loop был занят."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(time.perf_counter() - start - interval, 0.0))
+
+async def upload_phase(client: httpx.AsyncClient, documents: int) -> tuple:
+    latencies, sessions, errors = [], [], 0
+
+    async def upload(i: int) -> None:
+        nonlocal errors
+        files = {"file": (f"bench_{i}.txt", make_document(i), "text/plain")}
+        start = time.perf_counter()
+        response = await client.post("/upload", files=files)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code == 200:
+            sessions.append(response.json()["session_id"])
+        else:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(upload(i) for i in range(documents)))
+    return summarize(latencies, errors, time.perf_counter() - start), sessions
+
+async def chat_phase(client: httpx.AsyncClient, sessions: List[str], requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            # Номер в вопросе — чтобы запросы не попадали в кэш и не объединялись
+            query = f"{QUERIES[i % len(QUERIES)]} (#{i})"
+            headers = {"X-Session-Id": sessions[i % len(sessions)]}
+            start = time.perf_counter()
+            response = await client.post("/chat", json={"message": query}, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or response.json().get("error"):
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+async def run_load(config: dict) -> dict:
+    token_delay = 1 / config["llm_token_rate"] if config["llm_token_rate"] > 0 else 0.0
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(
+        model=model, latency=config["llm_latency"], token_delay=token_delay,
+        error_rate=config["llm_error_rate"], error_status=503, seed=config["seed"]
+    ))
+    set_answer_cache(AnswerCache(maxsize=2048 if config["answer_cache"] else 0, db_path=None))
+    # Без ограничения частоты: меряем само приложение, а не лимит провайдера
+    set_scheduler(LLMScheduler(rate=0, backoff_base=0.05, backoff_max=1.0))
+    original_mode = agent_orchestrator.ORCHESTRATOR_MODE
+    agent_orchestrator.ORCHESTRATOR_MODE = config.get("orchestrator_mode", original_mode)
+    original_precompute = backend.PRECOMPUTE_ARTIFACTS
+    backend.PRECOMPUTE_ARTIFACTS = config.get("precompute", False)
+    # Процессы извлечения текста стартуют до замеров (в приложении это делает startup)
+    pool = get_extraction_pool()
+    await asyncio.gather(*(asyncio.wrap_future(pool.submit(os.getpid)) for _ in range(EXTRACTION_PROCESSES)))
+
+    lags: List[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop, lags))
+    transport = httpx.ASGITransport(app=app)
+    original_upload_cache = backend.upload_cache
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            # Пустой кэш загрузок: каждый прогон честно извлекает текст
+            backend.upload_cache = UploadCache(root=Path(tmp))
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                upload, sessions = await upload_phase(client, config["documents"])
+                if not sessions:
+                    raise RuntimeError("Ни один документ не загрузился")
+                # Подготовка артефактов (если включена) завершается до /chat и в его вызовы LLM не входит
+                while backend.precompute_tasks:
+                    await asyncio.gather(*backend.precompute_tasks, return_exceptions=True)
+                precompute_calls = get_scheduler().stats()["calls"]
+                chat = await chat_phase(client, sessions, config["requests"], config["concurrency"])
+        scheduler_stats = get_scheduler().stats()
+    finally:
+        stop.set()
+        await lag_task
+        backend.upload_cache = original_upload_cache
+        agent_orchestrator.ORCHESTRATOR_MODE = original_mode
+        backend.PRECOMPUTE_ARTIFACTS = original_precompute
+        set_scheduler(LLMScheduler())
+
+    return {
+        "upload": upload,
+        "chat": chat,
+        "llm": {**{key: scheduler_stats[key] for key in ("calls", "retries", "server_errors", "failures")},
+                "precompute_calls": precompute_calls, "chat_calls": scheduler_stats["calls"] - precompute_calls},
+        "loop_lag_ms": {"p99": percentile(lags, 99) * 1000, "max": max(lags, default=0.0) * 1000},
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous_result(results_dir: Path) -> Optional[dict]:
+    runs = sorted(results_dir.glob("load_*.json"))
+    if not runs:
+        return None
+    with open(runs[-1], encoding="utf-8") as f:
+        return json.load(f)
+
+def describe_change(current: float, previous: Optional[float]) -> str:
+    if not previous:
+        return ""
+    return f" ({(current - previous) / previous * 100:+.0f}% к прошлому прогону)"
+
+def run_load_benchmark(config: Optional[dict] = None) -> dict:
+    config = config or {
+        "documents": BENCH_DOCUMENTS,
+        "requests": BENCH_REQUESTS,
+        "concurrency": BENCH_CONCURRENCY,
+        "llm_latency": BENCH_LLM_LATENCY,
+        "llm_token_rate": BENCH_LLM_TOKEN_RATE,
+        "llm_error_rate": BENCH_LLM_ERROR_RATE,
+        "seed": BENCH_SEED,
+        "answer_cache": BENCH_ANSWER_CACHE,
+        "orchestrator_mode": BENCH_ORCHESTRATOR_MODE,
+        "precompute": BENCH_PRECOMPUTE,
+    }
+    previous = previous_result(RESULTS_DIR)
+    metrics = asyncio.run(run_load(config))
+    now = datetime.now(timezone.utc)
+    result = {"timestamp": now.isoformat(), "git_commit": git_commit(), "config": config, **metrics}
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    result_path = RESULTS_DIR / f"load_{now.strftime('%Y%m%dT%H%M%S')}.json"
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    with open("load_benchmark.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 Нагрузочный бенчмарк /upload и /chat (заглушка GigaChat)\n\n")
+        f.write(f"Конфигурация: {json.dumps(config, ensure_ascii=False)}\n")
+        f.write(f"Коммит: {result['git_commit']}\n\n")
+        for phase in ("upload", "chat"):
+            stats = result[phase]
+            old = previous.get(phase) if previous else None
+            latency = stats["latency_ms"]
+            f.write(f"{phase}: {stats['requests']} запросов, ошибок {stats['errors']} "
+                    f"({stats['error_rate'] * 100:.1f}%)\n")
+            f.write(f"   RPS: {stats['rps']:.1f}{describe_change(stats['rps'], old and old['rps'])}\n")
+            for p in ("p50", "p95", "p99"):
+                f.write(f"   {p}: {latency[p]:.1f} мс"
+                        f"{describe_change(latency[p], old and old['latency_ms'][p])}\n")
+        llm = result["llm"]
+        f.write(f"\nВызовов LLM: {llm['calls']}, повторов: {llm['retries']}, "
+                f"ошибок сервера: {llm['server_errors']}, отказов после повторов: {llm['failures']}\n")
+        requests = result["chat"]["requests"]
+        if llm["precompute_calls"]:
+            f.write(f"Из них подготовка артефактов после /upload: {llm['precompute_calls']}\n")
+        f.write(f"Вызовов LLM на запрос /chat (режим {config.get('orchestrator_mode', 'pipeline')}): "
+                f"{llm['chat_calls'] / max(requests, 1):.2f}\n")
+        f.write(f"Задержка event loop: p99 {result['loop_lag_ms']['p99']:.1f} мс, "
+                f"максимум {result['loop_lag_ms']['max']:.1f} мс\n")
+        f.write(f"JSON: {result_path.relative_to(project_root)}\n")
+
+    print(f"✅ Бенчмарк завершён. Результаты сохранены в load_benchmark.txt и {result_path.name}")
+    return result
+
+if __name__ == "__main__":
+    run_load_benchmark()
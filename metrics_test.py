@@ -0,0 +1,74 @@
+# metrics_test.py
+import asyncio
+import re
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+from backend import app
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+
+FAKE_LATENCY = 0.1
+DOCUMENT = "System unit DEXP Atlas. Power supply: 220 V, 50 Hz. Phone: (423) 279-55-89.\n"
+QUERY = "Придумай A/B-тест для рекламы блока"
+
+# Строка образца в текстовом формате Prometheus: имя{метки} значение
+SAMPLE_RE = re.compile(r'^[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? (-?[0-9.e+-]+|\+Inf)$')
+
+# Замеры тестов для отчёта run_metrics_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+async def upload_and_ask() -> tuple:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        files = {"file": ("metrics_test.txt", DOCUMENT.encode("utf-8"), "text/plain")}
+        (await client.post("/upload", files=files)).raise_for_status()
+        first = (await client.post("/chat", json={"message": QUERY})).json()
+        second = (await client.post("/chat", json={"message": QUERY})).json()
+        exposition = await client.get("/metrics")
+        exposition.raise_for_status()
+    return first, second, exposition.text
+
+def test_spans_and_metrics():
+    """Шаги получают duration_ms, интервалы — токены вызовов LLM, /metrics — корректный формат Prometheus."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(db_path=None))
+    first, second, text = asyncio.run(upload_and_ask())
+
+    spans = {span["stage"]: span for span in first["spans"]}
+    assert {"route", "answer_cache", "industry", "agent.marketing_expert", "llm.marketing_expert"} <= set(spans)
+    llm_span = spans["llm.marketing_expert"]
+    assert llm_span["duration_ms"] >= FAKE_LATENCY * 1000 and llm_span["prompt_tokens"] > 0
+    assert spans["agent.marketing_expert"]["duration_ms"] >= llm_span["duration_ms"]
+    timed_steps = [step for step in first["steps"] if "duration_ms" in step]
+    assert len(timed_steps) == 2
+    assert any(step.get("cache") and "duration_ms" in step for step in second["steps"])
+
+    for line in text.splitlines():
+        assert line.startswith("#") or SAMPLE_RE.match(line), line
+    assert 'docuai_stage_duration_seconds_bucket{stage="llm.marketing_expert",le="+Inf"}' in text
+    assert 'docuai_stage_duration_seconds_count{stage="upload.save"}' in text
+    assert re.search(r'docuai_agent_requests_total\{agent="marketing_expert",outcome="cache"\} [1-9]', text)
+    assert 'docuai_llm_tokens_total{chain="marketing_expert",kind="prompt"}' in text
+    assert re.search(r'docuai_http_requests_total\{path="/chat",method="POST",status="200"\} [1-9]', text)
+    RESULTS["test_spans_and_metrics"] = first["spans"], text
+
+def run_metrics_test():
+    test_spans_and_metrics()
+    spans, text = RESULTS["test_spans_and_metrics"]
+    with open("metrics_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ИНТЕРВАЛОВ И /metrics\n")
+        f.write("=" * 50 + "\n\n")
+        for span in spans:
+            tokens = f", токены {span['prompt_tokens']}+{span['completion_tokens']}" if "prompt_tokens" in span else ""
+            f.write(f"{span['stage']}: {span['duration_ms']:.1f} мс{tokens}\n")
+        f.write(f"\n/metrics: {len(text.splitlines())} строк, формат Prometheus ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в metrics_test.txt")
+
+if __name__ == "__main__":
+    run_metrics_test()
@@ -0,0 +1,177 @@
+# multiworker_test.py
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+from utils import llm_pool
+from utils.document_store import SharedDocumentStore
+from utils.fake_gigachat import FakeGigaChat
+
+# Рабочие процессы uvicorn импортируют этот модуль как приложение: GigaChat заменён заглушкой
+llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=0.05))
+from backend import app  # noqa: E402
+
+WORKERS = 3
+REQUESTS = 30
+DOCUMENT = "System unit DEXP Atlas. Power supply: 220 V, 50 Hz. Warranty: 12 months.\n"
+
+# Замеры тестов для отчёта run_multiworker_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_until_ready(base_url: str, timeout: float = 60.0) -> None:
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.perf_counter() < deadline:
+            try:
+                if (await client.get("/stats")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise AssertionError("uvicorn не запустился")
+
+async def upload_and_chat(base_url: str) -> tuple:
+    await wait_until_ready(base_url)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        files = {"file": ("multiworker_test.txt", DOCUMENT.encode("utf-8"), "text/plain")}
+        response = await client.post("/upload", files=files)
+        response.raise_for_status()
+        session_id = response.json()["session_id"]
+
+    async def ask(i: int) -> tuple:
+        # Новое соединение на каждый запрос: балансировка между рабочими идёт по соединениям
+        async with httpx.AsyncClient(base_url=base_url, timeout=30, headers={"X-Session-Id": session_id}) as client:
+            answer = await client.post("/chat", json={"message": f"Какое напряжение питания? (#{i})"})
+            stats = await client.get("/stats")
+        return answer.status_code, answer.json(), stats.json()["worker_pid"]
+
+    return await asyncio.gather(*(ask(i) for i in range(REQUESTS)))
+
+def test_session_visible_from_every_worker():
+    """Документ загружен в одном рабочем процессе, а /chat успешно отвечает в любом из них."""
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = {
+            **os.environ,
+            "DOCUMENT_STORE": "shared",
+            "DOCUMENT_STORE_DIR": os.path.join(tmp, "documents"),
+            "UPLOAD_CACHE_DIR": os.path.join(tmp, "uploads"),
+            "JOBS_DB": os.path.join(tmp, "jobs.sqlite"),
+            "EXTRACTION_PROCESSES": "1",
+        }
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "multiworker_test:app", "--port", str(port),
+             "--workers", str(WORKERS), "--log-level", "warning"],
+            cwd=project_root, env=env,
+        )
+        try:
+            results = asyncio.run(upload_and_chat(f"http://127.0.0.1:{port}"))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    assert all(status == 200 and not body.get("error") and body["final_answer"] for status, body, _ in results)
+    pids = {pid for _, _, pid in results}
+    assert len(pids) >= 2
+    RESULTS["test_session_visible_from_every_worker"] = len(results), pids
+
+def test_shared_store_across_instances():
+    """Два экземпляра (как два процесса) видят документы, производные данные и удаление друг друга."""
+    with tempfile.TemporaryDirectory() as tmp:
+        first = SharedDocumentStore(root=Path(tmp))
+        second = SharedDocumentStore(root=Path(tmp))
+        first.put("s1", DOCUMENT, {"document_hash": "doc1", "safe": True})
+        first.put("s2", DOCUMENT, {"document_hash": "doc1", "safe": True})
+        assert second.get("s1") == {"text": DOCUMENT, "artifacts": {"document_hash": "doc1", "safe": True}}
+        assert second.stats()["documents"] == 1  # одинаковый документ хранится один раз
+
+        assert first.update_artifacts("s1", summary="Kratko")
+        assert second.get("s2")["artifacts"]["summary"] == "Kratko"
+        second.get("s2")
+        assert second.stats()["process_cache"]["hits"] >= 1
+
+        second.delete("s1")
+        assert first.get("s1") is None and first.get("s2")["text"] == DOCUMENT
+        second.delete("s2")
+        assert first.stats()["documents"] == 0 and not list((Path(tmp) / "blobs").iterdir())
+
+def test_shared_store_budget():
+    """При переполнении бюджета вытесняются давно не использованные сессии."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SharedDocumentStore(root=Path(tmp), max_bytes=2500)
+        for i in range(3):
+            store.put(f"s{i}", f"{i}" * 1000)
+            time.sleep(0.01)
+        assert store.get("s0") is None and store.get("s2")["text"] == "2" * 1000
+        assert store.stats()["evictions"] == 1
+
+def test_shared_store_update_artifacts_budget():
+    """Производные данные учитываются в бюджете: вытесняются другие сессии, а не обновляемая."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SharedDocumentStore(root=Path(tmp), max_bytes=2500)
+        for i in range(2):
+            store.put(f"s{i}", f"{i}" * 1000)
+            time.sleep(0.01)
+        assert store.update_artifacts("s1", summary="x" * 1000)
+        assert store.get("s0") is None and store.get("s1")["artifacts"]["summary"]
+        assert store.stats()["disk_bytes"] <= store.max_bytes and store.stats()["evictions"] == 1
+        store.delete("s1")
+        assert not store.update_artifacts("s1", summary="y")
+
+def test_shared_store_concurrent_put_and_delete():
+    """Процессы одновременно загружают и удаляют один документ: у каждой сессии остаются файлы."""
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = [SharedDocumentStore(root=Path(tmp)) for _ in range(2)]
+
+        lost = []
+
+        def churn(worker: int) -> None:
+            # Удаление сессии оставляет документ без ссылок — его файлы удаляются, пока другой его загружает
+            for i in range(150):
+                session_id = f"w{worker}-{i}"
+                stores[worker].put(session_id, DOCUMENT)
+                if stores[worker].get(session_id) is None:
+                    lost.append(session_id)
+                stores[worker].delete(session_id)
+
+        threads = [threading.Thread(target=churn, args=(worker,)) for worker in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert lost == []
+
+def run_multiworker_test():
+    test_session_visible_from_every_worker()
+    requests, pids = RESULTS["test_session_visible_from_every_worker"]
+    test_shared_store_across_instances()
+    test_shared_store_budget()
+    test_shared_store_update_artifacts_budget()
+    test_shared_store_concurrent_put_and_delete()
+    with open("multiworker_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ НЕСКОЛЬКИХ РАБОЧИХ ПРОЦЕССОВ (DOCUMENT_STORE=shared)\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"uvicorn --workers {WORKERS}: {requests} запросов /chat без ошибок ✅\n")
+        f.write(f"Ответили рабочие процессы: {sorted(pids)}\n")
+        f.write("Экземпляры хранилища видят загрузки, обновления и удаления друг друга ✅\n")
+        f.write("Бюджет на диске соблюдается вытеснением старых сессий ✅\n")
+        f.write("Обновление производных данных тоже укладывается в бюджет ✅\n")
+        f.write("Одновременные загрузка и удаление документа не теряют файлы ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в multiworker_test.txt")
+
+if __name__ == "__main__":
+    run_multiworker_test()
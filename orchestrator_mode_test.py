@@ -0,0 +1,153 @@
+# orchestrator_mode_test.py
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from langchain_core.messages import BaseMessage
+
+import agent_orchestrator
+from agent_orchestrator import aroute_query, parse_route_and_answer
+from agents.summarizer import fits_context
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+from utils.retrieval import build_retrieval_index
+
+FAKE_LATENCY = 0.1
+DOCUMENT = "System unit DEXP Atlas. Power supply: 220 V, 50 Hz. Warranty: 12 months.\n"
+LARGE_DOCUMENT = "".join(
+    f"Section {i}. System unit DEXP Atlas H{i:03d}. Power supply: 220 V, 50 Hz. Warranty: {12 + i} months.\n\n"
+    for i in range(400)
+)
+# Неоднозначный для локального роутера вопрос: в режиме pipeline его разбирает LLM-диспетчер
+QUERY = "Чем этот блок лучше других?"
+
+# Замеры тестов для отчёта run_orchestrator_mode_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+
+class CombinedReplyFake(FakeGigaChat):
+    """Заглушка с заданным ответом на комбинированный промпт (выбор роли вместе с ответом)."""
+
+    combined_reply: str = ""
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        if len(messages) > 1 and "сразу ответь" in messages[0].content:
+            return self.combined_reply
+        return super()._respond(messages)
+
+
+def chains(result: dict) -> List[str]:
+    return [call["chain"] for call in result["usage"]["calls"]]
+
+def ask(mode: str, document: str, query: str, artifacts: dict = None) -> tuple:
+    agent_orchestrator.ORCHESTRATOR_MODE = mode
+    try:
+        start = time.perf_counter()
+        result = asyncio.run(aroute_query(document, query, artifacts))
+        return result, time.perf_counter() - start
+    finally:
+        agent_orchestrator.ORCHESTRATOR_MODE = "pipeline"
+
+def test_single_call_saves_a_round_trip():
+    """Неоднозначный вопрос: в режиме single_call один вызов LLM вместо диспетчера и агента."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    pipeline, pipeline_time = ask("pipeline", DOCUMENT, QUERY)
+    single, single_time = ask("single_call", DOCUMENT, QUERY)
+
+    assert chains(pipeline) == ["router", "technical_reviewer"]
+    assert chains(single) == ["route_and_answer"]
+    assert single["error"] is None and single["final_answer"].startswith("Ответ заглушки")
+    assert single["steps"][1]["routing_path"] == "combined"
+    assert any(step.get("combined") for step in single["steps"])
+    assert single_time < pipeline_time - FAKE_LATENCY / 2
+    # Локально распознанные вопросы идут обычным путём в обоих режимах
+    local, _ = ask("single_call", DOCUMENT, "Какое напряжение требуется для питания системного блока?")
+    assert chains(local) == ["technical_reviewer"]
+    RESULTS["test_single_call_saves_a_round_trip"] = pipeline_time, single_time
+
+def test_combined_answer_is_cached():
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(db_path=None))
+    first, _ = ask("single_call", DOCUMENT, QUERY)
+    second, _ = ask("single_call", DOCUMENT, QUERY)
+    assert chains(second) == [] and second["final_answer"] == first["final_answer"]
+    assert any(step.get("cache") == "memory" for step in second["steps"])
+
+def test_concurrent_variants_share_one_call():
+    """Одновременные варианты вопроса (регистр, пробелы) объединяются в один вызов route_and_answer."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+
+    async def main():
+        return await asyncio.gather(*(aroute_query(DOCUMENT, query) for query in (QUERY, f"  {QUERY.upper()} ")))
+
+    agent_orchestrator.ORCHESTRATOR_MODE = "single_call"
+    try:
+        results = asyncio.run(main())
+    finally:
+        agent_orchestrator.ORCHESTRATOR_MODE = "pipeline"
+    assert sum(len(chains(result)) for result in results) == 1
+    assert results[0]["final_answer"] == results[1]["final_answer"]
+
+def test_redispatch_when_role_needs_other_context():
+    """Документ не поместился в один вызов: ответ technical_reviewer принимается, document_analyst — нет."""
+    assert not fits_context(LARGE_DOCUMENT)
+    artifacts = {"retrieval_index": build_retrieval_index(LARGE_DOCUMENT)}
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=0.01))
+    reviewer, _ = ask("single_call", LARGE_DOCUMENT, QUERY, artifacts)
+    assert chains(reviewer) == ["route_and_answer"]
+
+    reply = json.dumps({"agent": "document_analyst", "reasoning": "Нужен обзор.", "answer": "Обзор."})
+    llm_pool.set_llm_factory(lambda model: CombinedReplyFake(model=model, latency=0.01, combined_reply=reply))
+    analyst, _ = ask("single_call", LARGE_DOCUMENT, QUERY, artifacts)
+    assert chains(analyst)[0] == "route_and_answer" and "document_analyst" in chains(analyst)
+    assert any(step.get("redispatch") for step in analyst["steps"])
+    assert analyst["error"] is None and analyst["final_answer"] != "Обзор."
+
+def test_invalid_combined_reply_falls_back():
+    llm_pool.set_llm_factory(lambda model: CombinedReplyFake(model=model, latency=0.01, combined_reply="Не JSON"))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    result, _ = ask("single_call", DOCUMENT, QUERY)
+    assert chains(result)[0] == "route_and_answer" and "document_analyst" in chains(result)
+    assert result["error"] is None
+
+def test_parse_route_and_answer():
+    fenced = '```json\n{"agent": "summarizer", "reasoning": "r", "answer": " Итог "}\n```'
+    assert parse_route_and_answer(fenced) == {"agent_name": "summarizer", "reasoning": "r", "answer": "Итог"}
+    assert parse_route_and_answer('{"agent": "summarizer", "answer": ""}')["answer"] is None
+    assert parse_route_and_answer('{"agent": "poet", "answer": "Стих"}') is None
+    assert parse_route_and_answer('["summarizer"]') is None
+    assert parse_route_and_answer("summarizer") is None
+
+def run_orchestrator_mode_test():
+    test_single_call_saves_a_round_trip()
+    pipeline_time, single_time = RESULTS["test_single_call_saves_a_round_trip"]
+    test_combined_answer_is_cached()
+    test_concurrent_variants_share_one_call()
+    test_redispatch_when_role_needs_other_context()
+    test_invalid_combined_reply_falls_back()
+    test_parse_route_and_answer()
+    with open("orchestrator_mode_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ РЕЖИМА ORCHESTRATOR_MODE=single_call\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Вопрос: {QUERY}\n")
+        f.write(f"pipeline (диспетчер + агент): {pipeline_time * 1000:.0f} мс\n")
+        f.write(f"single_call (один вызов): {single_time * 1000:.0f} мс\n\n")
+        f.write("Повторный вопрос — из кэша ответов ✅\n")
+        f.write("Одновременные варианты вопроса — один вызов модели ✅\n")
+        f.write("Роли, которой нужен другой контекст, запрос передаётся заново ✅\n")
+        f.write("Неразобранный ответ модели — запасной путь через document_analyst ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в orchestrator_mode_test.txt")
+
+if __name__ == "__main__":
+    run_orchestrator_mode_test()
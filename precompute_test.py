@@ -0,0 +1,200 @@
+# precompute_test.py
+import asyncio
+import hashlib
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+from langchain_core.messages import BaseMessage
+import backend
+from backend import app
+from agent_orchestrator import (PRECOMPUTE_CHAINS, aprecompute_artifacts, aroute_query, get_orchestrator_stats,
+                                is_generic_query)
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+from utils.upload_cache import UploadCache
+
+FAKE_LATENCY = 0.2
+DOCUMENT = "System unit DEXP Atlas. Manufacturer: Faktor LLC. Power supply: 220 V, 50 Hz. Warranty: 12 months.\n"
+SUMMARY_QUERY = "Сделай краткое содержание документа"
+ANALYSIS_QUERY = "Проанализируй структуру документа"
+
+# Замеры тестов для отчёта run_precompute_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def chains(result: dict) -> list:
+    return [call["chain"] for call in result["usage"]["calls"]]
+
+async def wait_for_precompute() -> None:
+    while backend.precompute_tasks:
+        await asyncio.gather(*backend.precompute_tasks)
+
+async def upload_and_ask(client: httpx.AsyncClient, name: str, wait: bool) -> tuple:
+    start = time.perf_counter()
+    response = await client.post("/upload", files={"file": (name, DOCUMENT.encode("utf-8"), "text/plain")})
+    upload_time = time.perf_counter() - start
+    response.raise_for_status()
+    if wait:
+        await wait_for_precompute()
+    answers = {}
+    for query in (SUMMARY_QUERY, ANALYSIS_QUERY, "О чём раздел про гарантию, кратко?"):
+        start = time.perf_counter()
+        answer = (await client.post("/chat", json={"message": query})).json()
+        answers[query] = (answer, time.perf_counter() - start)
+    return upload_time, answers
+
+async def precompute_over_http() -> tuple:
+    transport = httpx.ASGITransport(app=app)
+    original_upload_cache = backend.upload_cache
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            backend.upload_cache = UploadCache(root=Path(tmp))
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                # Первое извлечение в процессе пула импортирует библиотеки разбора — не в счёт
+                warmup = {"file": ("warmup.txt", b"Warm-up document: DEXP Atlas, 220 V.\n", "text/plain")}
+                (await client.post("/upload", files=warmup)).raise_for_status()
+                upload_time, ready = await upload_and_ask(client, "precompute_test.txt", wait=True)
+                runs_before = get_orchestrator_stats()["precompute"]["runs"]
+                # Повторная загрузка того же файла: заготовки уже в кэше загрузок
+                await client.post("/upload", files={"file": ("again.txt", DOCUMENT.encode("utf-8"), "text/plain")})
+                await wait_for_precompute()
+                cached = backend.upload_cache.get(
+                    UploadCache.make_key(hashlib.sha256(DOCUMENT.encode("utf-8")).hexdigest(), "txt"))
+                runs_after = get_orchestrator_stats()["precompute"]["runs"]
+    finally:
+        backend.upload_cache = original_upload_cache
+    return upload_time, ready, cached, runs_after - runs_before
+
+def test_generic_questions_are_served_from_precomputed_artifacts():
+    """/upload отвечает, не дожидаясь LLM; общие вопросы потом отвечаются без вызовов модели."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    upload_time, answers, cached, extra_runs = asyncio.run(precompute_over_http())
+
+    assert upload_time < FAKE_LATENCY
+    for query in (SUMMARY_QUERY, ANALYSIS_QUERY):
+        answer, elapsed = answers[query]
+        assert chains(answer) == [] and answer["final_answer"] and elapsed < FAKE_LATENCY
+        assert any(step.get("precomputed") for step in answer["steps"])
+    assert "🔍" in answers[ANALYSIS_QUERY][0]["final_answer"]
+    # Вопрос со своей спецификой идёт к агенту
+    specific, _ = answers["О чём раздел про гарантию, кратко?"]
+    assert chains(specific) and not any(step.get("precomputed") for step in specific["steps"])
+    assert {"summary", "outline", "industry"} <= set(cached["artifacts"]) and extra_runs == 0
+    RESULTS["test_generic_questions_are_served_from_precomputed_artifacts"] = upload_time, answers
+
+def test_generic_question_joins_running_precompute():
+    """Вопрос, заданный пока заготовки считаются, ждёт их, а не вызывает модель второй раз."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+
+    async def main():
+        artifacts = {"document_hash": "joins-running-precompute"}
+        precompute = asyncio.create_task(aprecompute_artifacts(DOCUMENT, artifacts))
+        await asyncio.sleep(0)
+        answer = await aroute_query(DOCUMENT, SUMMARY_QUERY, artifacts)
+        return answer, await precompute
+
+    answer, computed = asyncio.run(main())
+    assert chains(answer) == [] and answer["final_answer"] == computed["summary"]
+
+def test_precomputed_industry_replaces_classifier_call():
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=0.01))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    query = "Придумай A/B-тест для рекламы этого блока (precompute_test)"
+    artifacts = {"industry": "it",
+                 "precompute_versions": {"industry": llm_pool.prompt_version(*PRECOMPUTE_CHAINS["industry"])}}
+    result = asyncio.run(aroute_query(DOCUMENT, query, artifacts))
+    assert chains(result) == ["marketing_expert"]
+    assert next(span for span in result["spans"] if span["stage"] == "industry")["industry"] == "it"
+
+def test_stale_precomputed_artifacts_are_recomputed():
+    """Заготовки другой версии промптов не отдаются и считаются заново."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=0.01))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    stale = {"document_hash": "stale-precompute", "summary": "старое содержание", "outline": "старая структура",
+             "industry": "it", "precompute_versions": {name: "old" for name in PRECOMPUTE_CHAINS}}
+    # Без версий (записи до её появления) — тоже устаревшие
+    unversioned = {"document_hash": "unversioned-precompute", "summary": "старое содержание"}
+    for artifacts in (stale, unversioned):
+        answer = asyncio.run(aroute_query(DOCUMENT, SUMMARY_QUERY, artifacts))
+        assert "summarizer" in chains(answer) and answer["final_answer"] != "старое содержание"
+    computed = asyncio.run(aprecompute_artifacts(DOCUMENT, stale))
+    assert set(computed) == {"summary", "outline", "industry", "precompute_versions"}
+    assert computed["summary"] != "старое содержание"
+    fresh = {**stale, **computed}
+    # Актуальные заготовки больше не пересчитываются
+    assert asyncio.run(aprecompute_artifacts(DOCUMENT, fresh)) == {}
+    answer = asyncio.run(aroute_query(DOCUMENT, SUMMARY_QUERY, fresh))
+    assert chains(answer) == [] and answer["final_answer"] == computed["summary"]
+
+class BrokenDocumentIndustryFake(FakeGigaChat):
+    """Заглушка, у которой классификатор отрасли документа недоступен."""
+
+    async def _agenerate(self, messages: List[BaseMessage], *args, **kwargs):
+        if len(messages) > 1 and "по началу документа" in messages[0].content:
+            raise RuntimeError("классификатор недоступен")
+        return await super()._agenerate(messages, *args, **kwargs)
+
+def test_document_industry_uses_document_prompt():
+    """Отрасль документа — своим промптом по началу документа, не классификатором запросов."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=0.01))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+
+    async def main():
+        calls = llm_pool.track_usage()
+        computed = await aprecompute_artifacts(DOCUMENT, {"document_hash": "document-industry-prompt"})
+        return computed, [call["chain"] for call in calls]
+
+    computed, called = asyncio.run(main())
+    assert computed["industry"] == "general"
+    assert "document_industry_classifier" in called and "industry_classifier" not in called
+
+def test_failed_industry_counts_as_failed_part():
+    """Ошибка классификатора не превращается в "general": отрасли нет, сбой учтён в failed_parts."""
+    llm_pool.set_llm_factory(lambda model: BrokenDocumentIndustryFake(model=model, latency=0.01))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    failed_before = get_orchestrator_stats()["precompute"]["failed_parts"]
+    computed = asyncio.run(aprecompute_artifacts(DOCUMENT, {"document_hash": "document-industry-failed"}))
+    assert "industry" not in computed and {"summary", "outline"} <= set(computed)
+    assert get_orchestrator_stats()["precompute"]["failed_parts"] == failed_before + 1
+
+def test_is_generic_query():
+    assert is_generic_query("summarizer", "Сделай краткое содержание документа")
+    assert is_generic_query("summarizer", "резюме, пожалуйста")
+    assert is_generic_query("document_analyst", "Проанализируй структуру документа")
+    assert not is_generic_query("summarizer", "Кратко о гарантии")
+    assert not is_generic_query("technical_reviewer", "Сделай краткое содержание документа")
+    assert not is_generic_query("summarizer", "")
+
+def run_precompute_test():
+    test_generic_questions_are_served_from_precomputed_artifacts()
+    upload_time, answers = RESULTS["test_generic_questions_are_served_from_precomputed_artifacts"]
+    test_generic_question_joins_running_precompute()
+    test_precomputed_industry_replaces_classifier_call()
+    test_stale_precomputed_artifacts_are_recomputed()
+    test_document_industry_uses_document_prompt()
+    test_failed_industry_counts_as_failed_part()
+    test_is_generic_query()
+    with open("precompute_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ФОНОВОЙ ПОДГОТОВКИ АРТЕФАКТОВ ПОСЛЕ /upload\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"/upload ответил за {upload_time * 1000:.1f} мс (вызов LLM — {FAKE_LATENCY:.2f} сек)\n")
+        for query, (answer, elapsed) in answers.items():
+            source = "заготовка" if any(step.get("precomputed") for step in answer["steps"]) else "агент"
+            f.write(f"{query}: {elapsed * 1000:.1f} мс ({source})\n")
+        f.write("\nВопрос во время подготовки дожидается её ✅\n")
+        f.write("Отрасль документа заменяет вызов классификатора ✅\n")
+        f.write("Заготовки другой версии промптов считаются заново ✅\n")
+        f.write("Отрасль документа определяется своим промптом, сбой учитывается в failed_parts ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в precompute_test.txt")
+
+if __name__ == "__main__":
+    run_precompute_test()
@@ -0,0 +1,88 @@
+# retrieval_benchmark.py
+import os
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from langchain.document_loaders import PyPDFLoader
+from test import PDF_PATH, TEST_CASES
+from utils.retrieval import build_retrieval_index
+from utils.sanitizer import sanitize_extracted_text
+
+K_VALUES = (1, 3, 5)
+# Синтетическая замена руководства — если PDF из test.py нет в рабочей копии. Текст написан
+# под вопросы TEST_CASES, а не извлечён из 20091.pdf: recall на нём проверяет работу поиска,
+# но не говорит о качестве на настоящем документе
+TEXT_PATH = "./tests/test_documents/dexp_manual.txt"
+
+def extract_text(pdf_path: str) -> str:
+    """Извлекает текст PDF (как PyPDFLoader) и очищает его санитайзером — как индексирует backend.upload_file."""
+    docs = PyPDFLoader(pdf_path).load()
+    return sanitize_extracted_text("\n\n".join([doc.page_content for doc in docs]))
+
+def load_document() -> tuple:
+    """Текст документа, его источник и синтетический ли он: PDF из test.py, иначе синтетическая замена."""
+    if os.path.exists(PDF_PATH):
+        return extract_text(PDF_PATH), PDF_PATH, False
+    if os.path.exists(TEXT_PATH):
+        return sanitize_extracted_text(Path(TEXT_PATH).read_text(encoding="utf-8")), TEXT_PATH, True
+    return None, None, False
+
+def is_retrieved(chunks_text: str, expected, test_type: str) -> bool:
+    """Есть ли ожидаемый ответ в найденных фрагментах."""
+    chunks_text = chunks_text.lower()
+    if test_type == "exact":
+        return expected.lower() in chunks_text
+    if test_type == "keywords":
+        return all(keyword.lower() in chunks_text for keyword in expected)
+    return False
+
+def run_retrieval_benchmark():
+    """Recall@k поиска BM25 на TEST_CASES из test.py — без обращения к LLM."""
+    with open("retrieval_benchmark.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 Бенчмарк поиска фрагментов (BM25, recall@k)\n\n")
+
+        document_text, source, synthetic = load_document()
+        if document_text is None:
+            f.write(f"❌ Ошибка: не найден ни {PDF_PATH}, ни {TEXT_PATH}.\n")
+            return
+
+        start = time.perf_counter()
+        index = build_retrieval_index(document_text)
+        build_time = time.perf_counter() - start
+        f.write(f"✅ Документ {source}: {len(document_text)} символов, {len(index.chunks)} фрагментов, "
+                f"индекс построен за {build_time * 1000:.1f} мс.\n")
+        if synthetic:
+            f.write(f"⚠️ {PDF_PATH} не найден: используется синтетический документ, написанный под вопросы "
+                    "TEST_CASES. Recall на нём проверяет работу поиска, но не качество на настоящем руководстве.\n")
+        f.write("\n")
+
+        # Кейсы "no_info" не имеют ответа в документе — в recall не участвуют
+        cases = [case for case in TEST_CASES if case["type"] != "no_info"]
+        hits = {k: 0 for k in K_VALUES}
+        search_time = 0.0
+
+        for i, case in enumerate(cases, 1):
+            f.write(f"[{i}/{len(cases)}] Запрос: {case['query']}\n")
+            for k in K_VALUES:
+                start = time.perf_counter()
+                chunks = index.top_chunks(case["query"], k)
+                search_time += time.perf_counter() - start
+                found = is_retrieved("\n".join(chunks), case["expected"], case["type"])
+                hits[k] += found
+                f.write(f"    recall@{k}: {'✅' if found else '❌'}\n")
+
+        f.write("\n" + "=" * 60 + "\n")
+        for k in K_VALUES:
+            f.write(f"📊 Recall@{k}: {hits[k]}/{len(cases)} ({hits[k] / len(cases) * 100:.1f}%)"
+                    f"{' (синтетический документ)' if synthetic else ''}\n")
+        searches = len(cases) * len(K_VALUES)
+        f.write(f"⏱️ Среднее время поиска: {search_time / searches * 1000:.3f} мс\n")
+
+    print("✅ Бенчмарк завершён. Результаты сохранены в retrieval_benchmark.txt")
+
+if __name__ == "__main__":
+    run_retrieval_benchmark()
@@ -0,0 +1,78 @@
+# router_benchmark.py
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.router import AGENT_KEYWORDS, GENERAL_LABEL, LOCAL_ROUTER_THRESHOLD, NgramClassifier, load_examples
+
+def leave_one_out(examples, threshold: float) -> dict:
+    """
+    Оценка без утечки: каждый пример классифицируется моделью,
+    обученной на всех остальных примерах.
+    """
+    correct = 0
+    local = 0
+    local_correct = 0
+    # Запросы не по документу, которые локальный роутер всё же отдал агенту
+    general_leaked = 0
+    latencies = []
+    errors = []
+
+    for i, (query, expected) in enumerate(examples):
+        classifier = NgramClassifier(keywords=AGENT_KEYWORDS).fit(examples[:i] + examples[i + 1:])
+        start = time.perf_counter()
+        predicted, confidence = classifier.predict(query)
+        latencies.append(time.perf_counter() - start)
+
+        if predicted == expected:
+            correct += 1
+        else:
+            errors.append((query, expected, predicted, confidence))
+        # Класс general локально не решается — такой запрос уходит LLM-диспетчеру
+        if confidence >= threshold and predicted != GENERAL_LABEL:
+            local += 1
+            local_correct += predicted == expected
+            general_leaked += expected == GENERAL_LABEL
+
+    latencies.sort()
+    total = len(examples)
+    general = sum(expected == GENERAL_LABEL for _, expected in examples)
+    return {
+        "total": total,
+        "general": general,
+        "accuracy": correct / total,
+        # Доля вопросов к агентам, решённых без LLM
+        "coverage": (local - general_leaked) / (total - general),
+        "general_leaked": general_leaked,
+        "local_accuracy": local_correct / local if local else 0.0,
+        "latency_mean_ms": sum(latencies) / total * 1000,
+        "latency_p95_ms": latencies[int(total * 0.95) - 1] * 1000,
+        "errors": errors,
+    }
+
+def run_router_benchmark():
+    examples = load_examples()
+    result = leave_one_out(examples, LOCAL_ROUTER_THRESHOLD)
+
+    with open("router_benchmark.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 Бенчмарк локального роутера (leave-one-out)\n\n")
+        f.write(f"Примеров: {result['total']} (из них {result['general']} не по документу), "
+                f"порог уверенности: {LOCAL_ROUTER_THRESHOLD:.2f}\n")
+        f.write(f"Точность top-1: {result['accuracy'] * 100:.1f}%\n")
+        f.write(f"Вопросов к агентам решено локально (без LLM): {result['coverage'] * 100:.1f}%\n")
+        f.write(f"Точность среди локальных решений: {result['local_accuracy'] * 100:.1f}%\n")
+        f.write(f"Запросы не по документу, отданные агенту локально: "
+                f"{result['general_leaked']} из {result['general']}\n")
+        f.write(f"Задержка: среднее {result['latency_mean_ms']:.3f} мс, p95 {result['latency_p95_ms']:.3f} мс\n\n")
+        if result["errors"]:
+            f.write("Ошибки классификации:\n")
+            for query, expected, predicted, confidence in result["errors"]:
+                f.write(f"   • {query} → {predicted} ({confidence:.2f}), ожидался {expected}\n")
+
+    print("✅ Бенчмарк завершён. Результаты сохранены в router_benchmark.txt")
+
+if __name__ == "__main__":
+    run_router_benchmark()
@@ -0,0 +1,43 @@
+# router_test.py
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.router import get_local_router
+
+# Фразы не по документу, которых нет в data/routing_examples.jsonl
+GREETINGS = ["Приветик", "Здравствуйте, как поживаете?", "Спасибо!", "Добрый день, коллеги",
+             "Какая сегодня погода в Москве?", "Где ты живёшь?"]
+QUESTIONS = {
+    "Где находится разъём питания?": "technical_reviewer",
+    "Как подключить монитор?": "technical_reviewer",
+    "Сделай краткое содержание инструкции": "summarizer",
+}
+
+def test_greetings_fall_back_to_llm():
+    """Приветствия и разговор не о документе не отдаются агенту локально — решает LLM-диспетчер."""
+    router = get_local_router()
+    routed = {query: router.route(query) for query in GREETINGS}
+    assert all(result is None for result in routed.values()), routed
+
+def test_document_questions_stay_local():
+    """Вопросы по документу, в том числе начинающиеся с «где» и «как», по-прежнему решаются локально."""
+    router = get_local_router()
+    for query, agent in QUESTIONS.items():
+        result = router.route(query)
+        assert result is not None and result["agent_name"] == agent, (query, result)
+
+def run_router_test():
+    test_greetings_fall_back_to_llm()
+    test_document_questions_stay_local()
+    with open("router_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ЛОКАЛЬНОГО РОУТЕРА\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Фраз не по документу ушло LLM-диспетчеру: {len(GREETINGS)} из {len(GREETINGS)} ✅\n")
+        f.write(f"Вопросов по документу решено локально: {len(QUESTIONS)} из {len(QUESTIONS)} ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в router_test.txt")
+
+if __name__ == "__main__":
+    run_router_test()
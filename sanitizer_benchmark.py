@@ -0,0 +1,62 @@
+# sanitizer_benchmark.py
+import random
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.sanitizer import sanitize_extracted_text, sanitize_text
+from utils.sanitizer_reference import legacy_sanitize_extracted_text, legacy_sanitize_text
+
+# Размеры входных данных для замера, МБ
+BENCHMARK_SIZES_MB = [1, 4]
+
+def make_large_document(size_mb: float) -> str:
+    """Похожий на реальный документ текст: в основном обычные строки, изредка опасные."""
+    rng = random.Random(42)
+    lines = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        if rng.random() < 0.02:
+            line = rng.choice(["<script>alert(1)</script>", "Click <a href=\"javascript:x()\">here</a>",
+                               "document.cookie = \"session=1\"", "eval(\"rm -rf /\")"])
+        else:
+            line = (f"Пункт {len(lines)}: напряжение питания 220 В, ток {rng.randint(1, 16)} А, "
+                    f"модель DEXP-{rng.randint(100, 999)} <b>Atlas</b> & Co.")
+        lines.append(line)
+        size += len(line.encode("utf-8")) + 1
+    return "\n".join(lines)
+
+def measure(function, text: str, repeats: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_sanitizer_benchmark():
+    rows = []
+    for size_mb in BENCHMARK_SIZES_MB:
+        text = make_large_document(size_mb)
+        for name, legacy, compiled in (
+            ("sanitize_extracted_text", legacy_sanitize_extracted_text, sanitize_extracted_text),
+            ("sanitize_text", legacy_sanitize_text, sanitize_text),
+        ):
+            assert legacy(text) == compiled(text)
+            rows.append((size_mb, name, measure(legacy, text), measure(compiled, text)))
+
+    with open("sanitizer_benchmark.txt", "w", encoding="utf-8") as f:
+        f.write("📊 БЕНЧМАРК САНИТАЙЗЕРА (прежняя реализация vs скомпилированная)\n")
+        f.write("=" * 50 + "\n\n")
+        for size_mb, name, legacy_s, compiled_s in rows:
+            f.write(f"{name}, {size_mb} МБ: было {legacy_s * 1000:.0f} мс ({size_mb / legacy_s:.1f} МБ/с), "
+                    f"стало {compiled_s * 1000:.0f} мс ({size_mb / compiled_s:.1f} МБ/с), "
+                    f"ускорение {legacy_s / compiled_s:.1f}x\n")
+        f.write("\nРезультаты побайтно совпадают с прежней реализацией ✅\n")
+    print("✅ Бенчмарк завершён. Результаты сохранены в sanitizer_benchmark.txt")
+
+if __name__ == "__main__":
+    run_sanitizer_benchmark()
@@ -0,0 +1,111 @@
+# sanitizer_memory_test.py
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.sanitizer import StreamingSanitizer, sanitize_extracted_text
+
+# Размер части, подаваемой в санитайзер, и объёмы синтетических документов
+CHUNK_CHARS = 256 * 1024
+TRACEMALLOC_DOCUMENT_MB = 16
+RSS_DOCUMENT_MB = 64
+
+LINES = [
+    "Пункт {n}: напряжение питания 220 В, ток 16 А, модель DEXP <b>Atlas</b> & Co.",
+    "Section {n}. Maximum operating temperature 45 C, see table {n}.",
+    "<script>alert('{n}')</script>",
+    "   ",
+]
+
+# Замеры тестов для отчёта run_sanitizer_memory_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def synthetic_chunks(total_mb: float, chunk_chars: int = CHUNK_CHARS):
+    """Синтетический «технический мануал», генерируется по частям и целиком в памяти не существует."""
+    produced = 0
+    n = 0
+    while produced < total_mb * 1024 * 1024:
+        lines = []
+        size = 0
+        while size < chunk_chars:
+            line = LINES[n % len(LINES)].format(n=n)
+            lines.append(line)
+            size += len(line) + 1
+            n += 1
+        chunk = "\n".join(lines) + "\n"
+        produced += len(chunk)
+        yield chunk
+
+def stream_peak_bytes(total_mb: float) -> tuple:
+    """Пиковый объём памяти Python (tracemalloc) при потоковой очистке документа."""
+    tracemalloc.start()
+    sanitizer = StreamingSanitizer()
+    for chunk in synthetic_chunks(total_mb):
+        sanitizer.feed(chunk)
+    sanitizer.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, sanitizer.output_chars
+
+def whole_text_peak_bytes(total_mb: float) -> int:
+    """Для сравнения: весь документ в памяти и sanitize_extracted_text."""
+    tracemalloc.start()
+    text = "".join(synthetic_chunks(total_mb))
+    sanitize_extracted_text(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def child_max_rss_mb(total_mb: float) -> float:
+    """Пиковый RSS отдельного процесса, который очищает документ потоково (0 МБ — только импорт)."""
+    code = (
+        "import resource, sys; sys.path.insert(0, %r)\n"
+        "from sanitizer_memory_test import synthetic_chunks\n"
+        "from utils.sanitizer import StreamingSanitizer\n"
+        "s = StreamingSanitizer()\n"
+        "for chunk in synthetic_chunks(%r): s.feed(chunk)\n"
+        "s.close()\n"
+        "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+    ) % (str(project_root), total_mb)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return int(output.strip()) / 1024  # ru_maxrss в Linux — в килобайтах
+
+def test_streaming_sanitizer_peak_memory():
+    """Пик памяти зависит от размера части, а не от размера документа."""
+    small_peak, _ = stream_peak_bytes(TRACEMALLOC_DOCUMENT_MB / 8)
+    large_peak, output_chars = stream_peak_bytes(TRACEMALLOC_DOCUMENT_MB)
+    assert output_chars > 0
+    # Части до 256К символов кириллицы (2 байта на символ) и несколько их копий
+    assert large_peak < 16 * CHUNK_CHARS * 2, f"пик {large_peak / 1024 / 1024:.1f} МБ"
+    assert large_peak < small_peak * 1.5
+    RESULTS["test_streaming_sanitizer_peak_memory"] = small_peak, large_peak
+
+def test_streaming_sanitizer_rss():
+    """RSS процесса, очищающего документ в десятки мегабайт, почти не растёт."""
+    baseline = child_max_rss_mb(0)
+    streamed = child_max_rss_mb(RSS_DOCUMENT_MB)
+    assert streamed - baseline < 64, f"RSS вырос на {streamed - baseline:.0f} МБ"
+    RESULTS["test_streaming_sanitizer_rss"] = baseline, streamed
+
+def run_sanitizer_memory_test():
+    test_streaming_sanitizer_peak_memory()
+    small_peak, large_peak = RESULTS["test_streaming_sanitizer_peak_memory"]
+    whole_peak = whole_text_peak_bytes(TRACEMALLOC_DOCUMENT_MB / 8)
+    test_streaming_sanitizer_rss()
+    baseline, streamed = RESULTS["test_streaming_sanitizer_rss"]
+    with open("sanitizer_memory_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ПАМЯТИ ПОТОКОВОГО САНИТАЙЗЕРА\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Размер части: {CHUNK_CHARS // 1024} К символов\n")
+        f.write(f"Потоково, {TRACEMALLOC_DOCUMENT_MB / 8:.0f} МБ: пик {small_peak / 1024 / 1024:.1f} МБ\n")
+        f.write(f"Потоково, {TRACEMALLOC_DOCUMENT_MB} МБ: пик {large_peak / 1024 / 1024:.1f} МБ\n")
+        f.write(f"Весь текст в памяти, {TRACEMALLOC_DOCUMENT_MB / 8:.0f} МБ: пик {whole_peak / 1024 / 1024:.1f} МБ\n")
+        f.write(f"RSS процесса: только импорт {baseline:.0f} МБ, потоково {RSS_DOCUMENT_MB} МБ — {streamed:.0f} МБ\n")
+    print("✅ Тест завершён. Результаты сохранены в sanitizer_memory_test.txt")
+
+if __name__ == "__main__":
+    run_sanitizer_memory_test()
@@ -1,7 +1,9 @@
 # sanitizer_test.py
 import os
+import random
 from pathlib import Path
-from utils.sanitizer import sanitize_extracted_text
+from utils.sanitizer import is_text_safe, iter_sanitized, sanitize_extracted_text, sanitize_text
+from utils.sanitizer_reference import legacy_sanitize_extracted_text, legacy_sanitize_text, random_document
 
 def create_malicious_test_file():
     """Создаёт тестовый файл с XSS-кодом и другими угрозами"""
@@ -73,6 +75,45 @@ def run_sanitizer_test():
 
     print("✅ Тест завершён. Результаты сохранены в sanitizer_test.txt")
 
+def test_compiled_sanitizer_matches_legacy():
+    """Скомпилированный санитайзер побайтно совпадает с прежней реализацией."""
+    corpus = [open(create_malicious_test_file(), encoding="utf-8").read(), "", "   \n\n  "]
+    rng = random.Random(0)
+    corpus += [random_document(rng, rng.randint(1, 60)) for _ in range(3000)]
+    for text in corpus:
+        assert sanitize_extracted_text(text) == legacy_sanitize_extracted_text(text), repr(text)
+        assert sanitize_text(text) == legacy_sanitize_text(text), repr(text)
+
+# Теги и их части — чтобы граница фрагментов чаще попадала внутрь тега
+TAG_FRAGMENTS = ["<b>", "</b>", "<a href=\"/x\">", "<div\nclass=\"x\">", "<!-- note -->", "<", ">", "< >",
+                 "<script>alert(1)</script>", "<img src=x onerror=alert(1)>", "текст ", "text ", "\n", "  "]
+
+def random_split(rng: random.Random, text: str) -> list:
+    """Делит текст на части по случайным границам (в том числе пустые части и по одному символу)."""
+    if rng.random() < 0.1:
+        return list(text)
+    cuts = sorted(rng.randint(0, len(text)) for _ in range(rng.randint(0, 12)))
+    return [text[start:stop] for start, stop in zip([0] + cuts, cuts + [len(text)])]
+
+def test_streaming_sanitizer_matches_whole_text():
+    """iter_sanitized на частях с произвольными границами побайтно совпадает с sanitize_extracted_text."""
+    rng = random.Random(1)
+    corpus = [open(create_malicious_test_file(), encoding="utf-8").read(), "", "   \n\n  ", "<b>bold</b>\n<i>x</i>"]
+    corpus += [random_document(rng, rng.randint(1, 60)) for _ in range(1500)]
+    corpus += ["".join(rng.choice(TAG_FRAGMENTS) for _ in range(rng.randint(1, 40))) for _ in range(1500)]
+    for text in corpus:
+        expected = sanitize_extracted_text(text)
+        safe = not text or is_text_safe(text, max_length=len(text))
+        for _ in range(4):
+            chunks = random_split(rng, text)
+            parts = list(iter_sanitized(chunks))
+            assert "".join(part for part, _ in parts) == expected, repr(chunks)
+            assert parts[-1][1] == safe, repr(chunks)
+    # Тег через перевод строки, разрезанный в каждой позиции
+    text = "до <a\nhref=\"/x\">ссылка</a> после\n"
+    for cut in range(len(text) + 1):
+        assert "".join(part for part, _ in iter_sanitized([text[:cut], text[cut:]])) == sanitize_extracted_text(text)
+
 if __name__ == "__main__":
     run_sanitizer_test()
     
\ No newline at end of file
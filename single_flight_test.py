@@ -0,0 +1,119 @@
+# single_flight_test.py
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import agent_orchestrator
+from agent_orchestrator import aroute_query
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+from utils.llm_scheduler import LLMScheduler, set_scheduler
+from utils.single_flight import SingleFlight
+
+FAKE_LATENCY = 0.3
+CONCURRENT_REQUESTS = 10
+DOCUMENT = "System unit DEXP Atlas. Power supply: 220 V, 50 Hz.\n"
+QUERY = "Какое напряжение питания?"
+
+# Замеры тестов для отчёта run_single_flight_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+async def ask_together(count: int, streaming: int = 0) -> tuple:
+    """count одинаковых запросов одновременно; первые streaming из них — с потоковой выдачей."""
+    tokens = [[] for _ in range(streaming)]
+
+    def collector(i):
+        async def on_event(event):
+            if event["type"] == "token":
+                tokens[i].append(event["text"])
+        return on_event
+
+    results = await asyncio.gather(*(
+        aroute_query(DOCUMENT, QUERY, None, collector(i) if i < streaming else None) for i in range(count)
+    ))
+    return results, tokens
+
+def run_with_fresh_state(coro_factory, **fake_options):
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=FAKE_LATENCY, **fake_options))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    scheduler = LLMScheduler(rate=0, max_retries=0)
+    set_scheduler(scheduler)
+    agent_orchestrator._single_flight = SingleFlight()
+    try:
+        start = time.perf_counter()
+        result = asyncio.run(coro_factory())
+        return result, time.perf_counter() - start, scheduler.stats(), agent_orchestrator._single_flight.stats()
+    finally:
+        set_scheduler(LLMScheduler())
+
+def test_identical_requests_share_one_call():
+    """10 одинаковых запросов — один вызов агента; потоковые клиенты получают фрагменты."""
+    (results, tokens), elapsed, scheduler_stats, flight_stats = run_with_fresh_state(
+        lambda: ask_together(CONCURRENT_REQUESTS, streaming=2))
+    assert scheduler_stats["calls"] == 1
+    assert flight_stats["collapsed"] == CONCURRENT_REQUESTS - 1 and flight_stats["in_flight"] == 0
+    assert len({r["final_answer"] for r in results}) == 1 and all(r["error"] is None for r in results)
+    assert sum(any(step.get("coalesced") for step in r["steps"]) for r in results) == CONCURRENT_REQUESTS - 1
+    assert all("".join(parts) == results[0]["final_answer"] for parts in tokens)
+    assert elapsed < FAKE_LATENCY * 2
+    RESULTS["test_identical_requests_share_one_call"] = elapsed, flight_stats
+
+def test_error_reaches_every_waiter():
+    (results, _), _, scheduler_stats, _ = run_with_fresh_state(
+        lambda: ask_together(5), error_rate=1.0, error_status=500)
+    assert scheduler_stats["calls"] == 1
+    assert all(r["error"] and "500" in r["error"] for r in results)
+
+def test_cancellation():
+    """Отмена одного ждущего не мешает остальным; отмена всех отменяет сам вызов."""
+    flight = SingleFlight()
+    cancelled = []
+
+    async def slow(publish):
+        try:
+            await asyncio.sleep(0.1)
+            return "ответ"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        first = asyncio.create_task(flight.do("key", slow))
+        second = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == ("ответ", True)
+        assert not cancelled
+
+        third = asyncio.create_task(flight.do("other", slow))
+        fourth = asyncio.create_task(flight.do("other", slow))
+        await asyncio.sleep(0.01)
+        third.cancel()
+        fourth.cancel()
+        await asyncio.gather(third, fourth, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert cancelled == [True] and flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+def run_single_flight_test():
+    test_identical_requests_share_one_call()
+    elapsed, flight_stats = RESULTS["test_identical_requests_share_one_call"]
+    test_error_reaches_every_waiter()
+    test_cancellation()
+    with open("single_flight_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ОБЪЕДИНЕНИЯ ОДИНАКОВЫХ ЗАПРОСОВ\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"{CONCURRENT_REQUESTS} одинаковых запросов одновременно: {elapsed:.2f} сек "
+                f"(один вызов LLM — {FAKE_LATENCY:.2f} сек)\n")
+        f.write(f"Выполнено вызовов: {flight_stats['leaders']}, объединено запросов: {flight_stats['collapsed']}\n")
+        f.write("Ошибка доходит до всех ждущих, отмена обрабатывается корректно ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в single_flight_test.txt")
+
+if __name__ == "__main__":
+    run_single_flight_test()
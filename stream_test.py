@@ -0,0 +1,154 @@
+# stream_test.py
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+from langchain_core.messages import BaseMessage
+import backend
+from backend import app
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+
+DOCUMENT = "System unit DEXP Atlas. Manufacturer: Faktor LLC. Power supply: 220 V, 50 Hz.\n"
+QUERY = "Какое напряжение требуется для питания системного блока?"
+# Задержка зависающего вызова: отключившийся клиент не должен её дожидаться
+HANG_LATENCY = 5.0
+# Начатые и отменённые вызовы модели во всех экземплярах заглушки
+CALLS = Counter()
+
+
+class CancelTrackingFake(FakeGigaChat):
+    """Заглушка, считающая начатые и отменённые вызовы."""
+
+    async def _agenerate(self, messages: List[BaseMessage], *args, **kwargs):
+        CALLS["started"] += 1
+        try:
+            return await super()._agenerate(messages, *args, **kwargs)
+        except asyncio.CancelledError:
+            CALLS["cancelled"] += 1
+            raise
+
+    async def _astream(self, messages: List[BaseMessage], *args, **kwargs):
+        CALLS["started"] += 1
+        try:
+            async for chunk in super()._astream(messages, *args, **kwargs):
+                yield chunk
+        except asyncio.CancelledError:
+            CALLS["cancelled"] += 1
+            raise
+
+
+async def upload(client: httpx.AsyncClient) -> str:
+    files = {"file": ("stream_test.txt", DOCUMENT.encode("utf-8"), "text/plain")}
+    response = await client.post("/upload", files=files)
+    response.raise_for_status()
+    return response.json()["session_id"]
+
+def parse_sse(body: str) -> list:
+    """События SSE: каждое — строка "data: <json>", за ней пустая строка."""
+    assert body.endswith("\n\n"), "поток должен заканчиваться пустой строкой"
+    events = []
+    for block in body[:-2].split("\n\n"):
+        assert block.startswith("data: ") and "\n" not in block, f"неверный кадр SSE: {block!r}"
+        events.append(json.loads(block[len("data: "):]))
+    return events
+
+async def stream_chat() -> tuple:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await upload(client)
+        response = await client.post("/chat/stream", json={"message": QUERY})
+        response.raise_for_status()
+    return response.headers["content-type"], parse_sse(response.text)
+
+async def stream_and_disconnect() -> tuple:
+    """Запрос к /chat/stream на уровне ASGI: клиент отключается, как только начался вызов модели."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await upload(client)
+    # Фоновая подготовка заготовок выключена: считаются только вызовы модели самого запроса
+    assert not backend.precompute_tasks
+    body = json.dumps({"message": QUERY}).encode("utf-8")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/chat/stream", "raw_path": b"/chat/stream", "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"x-session-id", session_id.encode())],
+        "client": ("test", 1), "server": ("test", 80),
+    }
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        while not CALLS["started"]:
+            await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    await asyncio.wait_for(app(scope, receive, send), timeout=HANG_LATENCY)
+    elapsed = time.perf_counter() - start
+    # Отмена доходит до вызова модели через задачу single flight. Считаем внутри цикла событий:
+    # при выходе из asyncio.run оставшиеся задачи отменились бы и без отключения клиента
+    for _ in range(100):
+        if CALLS["cancelled"]:
+            break
+        await asyncio.sleep(0.01)
+    return elapsed, CALLS["cancelled"]
+
+def test_stream_events():
+    """SSE-кадры корректны, шаги приходят раньше токенов, последнее событие done несёт ttft_ms."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=0.05, token_delay=0.005))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    content_type, events = asyncio.run(stream_chat())
+    assert content_type.startswith("text/event-stream")
+    types = [event["type"] for event in events]
+    assert "step" in types and "token" in types
+    assert types.index("step") < types.index("token")
+    assert types[-1] == "done" and types.count("done") == 1
+    done = events[-1]
+    tokens = "".join(event["text"] for event in events if event["type"] == "token")
+    assert tokens == done["final_answer"]
+    assert isinstance(done["ttft_ms"], float) and 0 < done["ttft_ms"] <= done["total_ms"]
+    assert backend.stream_stats["ttft_last_ms"] == done["ttft_ms"]
+
+def test_disconnect_cancels_llm_call():
+    """Клиент отключился — идущий вызов модели отменяется, а не дорабатывает впустую."""
+    CALLS.clear()
+    llm_pool.set_llm_factory(lambda model: CancelTrackingFake(model=model, latency=HANG_LATENCY))
+    set_answer_cache(AnswerCache(maxsize=0, db_path=None))
+    original = backend.PRECOMPUTE_ARTIFACTS
+    backend.PRECOMPUTE_ARTIFACTS = False
+    try:
+        elapsed, cancelled = asyncio.run(stream_and_disconnect())
+    finally:
+        backend.PRECOMPUTE_ARTIFACTS = original
+    assert elapsed < HANG_LATENCY / 2, f"ответ завершился через {elapsed:.2f} сек"
+    assert CALLS["started"] >= 1 and cancelled == CALLS["started"]
+
+def run_stream_test():
+    test_stream_events()
+    test_disconnect_cancels_llm_call()
+    with open("stream_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ПОТОКОВОГО ОТВЕТА /chat/stream (SSE)\n")
+        f.write("=" * 50 + "\n\n")
+        f.write("Кадры SSE, шаги до токенов, событие done с ttft_ms ✅\n")
+        f.write(f"TTFT последнего ответа: {backend.stream_stats['ttft_last_ms']:.1f} мс\n")
+        f.write(f"Отключение клиента отменяет вызов модели: отменено {CALLS['cancelled']} из {CALLS['started']} ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в stream_test.txt")
+
+if __name__ == "__main__":
+    run_stream_test()
@@ -0,0 +1,108 @@
+# summarizer_test.py
+import asyncio
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import List
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from langchain_core.messages import BaseMessage
+
+from agents import summarizer
+from agents.summarizer import acondense_document, asummarize_document, fits_context
+from utils import llm_pool
+from utils.fake_gigachat import FakeGigaChat
+from utils.retrieval import split_into_chunks
+from utils.tokens import tokens_to_chars
+
+BUDGET = 600
+LARGE_DOCUMENT = "".join(
+    f"Section {i}. System unit DEXP Atlas H{i:03d}. Power supply: 220 V, 50 Hz. Warranty: {12 + i} months.\n\n"
+    for i in range(120)
+)
+STAGES = {
+    "Сделай краткое содержание документа": "summarizer",
+    "Сделай краткое содержание фрагмента": "summarizer_map",
+    "Объедини краткие содержания": "summarizer_reduce",
+}
+# Вызовы цепочек суммаризатора во всех экземплярах заглушки
+CALLS = Counter()
+
+# Замеры тестов для отчёта run_summarizer_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+
+class CountingFake(FakeGigaChat):
+    """Заглушка, считающая вызовы по цепочкам суммаризатора."""
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        system = messages[0].content if len(messages) > 1 else ""
+        for prefix, stage in STAGES.items():
+            if system.startswith(prefix):
+                CALLS[stage] += 1
+        return super()._respond(messages)
+
+
+def fresh_state() -> Counter:
+    CALLS.clear()
+    llm_pool.set_llm_factory(lambda model: CountingFake(model=model, latency=0.02))
+    summarizer._chunk_summaries.clear()
+    return CALLS
+
+def test_map_reduce_for_large_document():
+    """Документ больше бюджета: краткое содержание каждого фрагмента, затем свёртка в бюджет."""
+    calls = fresh_state()
+    assert not fits_context(LARGE_DOCUMENT, BUDGET)
+    chunks = split_into_chunks(LARGE_DOCUMENT, chunk_size=tokens_to_chars(BUDGET // 2), overlap=0)
+
+    condensed = asyncio.run(acondense_document(LARGE_DOCUMENT, BUDGET))
+    assert fits_context(condensed, BUDGET) and condensed.startswith("Ответ заглушки")
+    assert calls["summarizer_map"] == len(chunks) > 1
+    assert calls["summarizer_reduce"] >= 1
+    # Небольшой документ идёт в модель как есть
+    assert asyncio.run(acondense_document("Short document.", BUDGET)) == "Short document."
+    RESULTS["test_map_reduce_for_large_document"] = len(chunks), calls["summarizer_reduce"]
+
+def test_chunk_summaries_are_cached():
+    """Повторное сжатие того же документа не вызывает map-фазу: краткие содержания фрагментов в кэше."""
+    calls = fresh_state()
+    first = asyncio.run(acondense_document(LARGE_DOCUMENT, BUDGET))
+    map_calls = calls["summarizer_map"]
+    second = asyncio.run(acondense_document(LARGE_DOCUMENT, BUDGET))
+    assert second == first and calls["summarizer_map"] == map_calls
+    # Другой бюджет — другое разбиение на фрагменты
+    asyncio.run(acondense_document(LARGE_DOCUMENT, BUDGET * 2))
+    assert calls["summarizer_map"] > map_calls
+
+def test_concurrent_condense_runs_once():
+    """Одновременные запросы сжатия одного документа выполняют map-reduce один раз."""
+    calls = fresh_state()
+
+    async def main():
+        return await asyncio.gather(*(acondense_document(LARGE_DOCUMENT, BUDGET) for _ in range(4)))
+
+    condensed = asyncio.run(main())
+    chunks = split_into_chunks(LARGE_DOCUMENT, chunk_size=tokens_to_chars(BUDGET // 2), overlap=0)
+    assert len(set(condensed)) == 1 and calls["summarizer_map"] == len(chunks)
+    # Небольшой документ сжимать не нужно: один вызов краткого содержания
+    asyncio.run(asummarize_document("Short document.", "Кратко"))
+    assert calls["summarizer"] == 1
+
+def run_summarizer_test():
+    test_map_reduce_for_large_document()
+    chunks, reduce_calls = RESULTS["test_map_reduce_for_large_document"]
+    test_chunk_summaries_are_cached()
+    test_concurrent_condense_runs_once()
+    with open("summarizer_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ MAP-REDUCE СУММАРИЗАЦИИ\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Документ {len(LARGE_DOCUMENT)} символов, бюджет {BUDGET} токенов: "
+                f"{chunks} фрагментов, {reduce_calls} вызовов свёртки ✅\n")
+        f.write("Повторное сжатие берёт краткие содержания фрагментов из кэша ✅\n")
+        f.write("Одновременные запросы сжимают документ один раз ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в summarizer_test.txt")
+
+if __name__ == "__main__":
+    run_summarizer_test()
@@ -0,0 +1,64 @@
+# token_budget_test.py
+import asyncio
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from agent_orchestrator import aroute_query
+from utils import llm_pool
+from utils.answer_cache import AnswerCache, set_answer_cache
+from utils.fake_gigachat import FakeGigaChat
+from utils.tokens import (ANSWER_RESERVE_TOKENS, TRIM_MARKER, compact_text, context_tokens, estimate_tokens,
+                          fit_text_to_budget)
+
+PARAGRAPH = ("Системный блок DEXP Atlas H388. Напряжение питания 220 В. "
+             "Максимальная потребляемая мощность 450 Вт.   \n\n\n\n")
+LARGE_DOCUMENT = PARAGRAPH * 3000
+
+# Замеры тестов для отчёта run_token_budget_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def test_fit_text_to_budget():
+    """Сначала сжатие без потери текста, затем обрезка по границе предложения с пометкой."""
+    small = "Пункт 1.    Питание 220 В.\n\n\n\nПункт 2."
+    assert compact_text(small) == "Пункт 1. Питание 220 В.\n\nПункт 2."
+    assert fit_text_to_budget(small, 100) == (small, False)
+    assert fit_text_to_budget(small, estimate_tokens(compact_text(small))) == (compact_text(small), False)
+
+    text, trimmed = fit_text_to_budget(LARGE_DOCUMENT, 1000)
+    assert trimmed and text.endswith(TRIM_MARKER)
+    assert estimate_tokens(text) <= 1000
+    assert text[:-len(TRIM_MARKER)].endswith(".")
+
+def test_agent_prompt_fits_context_and_reports_usage():
+    """Большой документ ужимается под контекст модели, токены каждого вызова видны в ответе."""
+    llm_pool.set_llm_factory(lambda model: FakeGigaChat(model=model, latency=0.0))
+    set_answer_cache(AnswerCache(db_path=None))
+    result = asyncio.run(aroute_query(LARGE_DOCUMENT, "Придумай A/B-тест для рекламы этого блока"))
+    usage = result["usage"]
+    assert usage["calls"], result
+    call = usage["calls"][-1]
+    assert call["chain"] == "marketing_expert" and call["trimmed"]
+    assert call["prompt_tokens"] + ANSWER_RESERVE_TOKENS <= context_tokens(call["model"])
+    assert usage["prompt_tokens"] == sum(c["prompt_tokens"] for c in usage["calls"])
+    assert usage["completion_tokens"] > 0
+    RESULTS["test_agent_prompt_fits_context_and_reports_usage"] = usage
+
+def run_token_budget_test():
+    test_fit_text_to_budget()
+    test_agent_prompt_fits_context_and_reports_usage()
+    usage = RESULTS["test_agent_prompt_fits_context_and_reports_usage"]
+    with open("token_budget_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ БЮДЖЕТА ТОКЕНОВ\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Документ: {len(LARGE_DOCUMENT)} символов, ~{estimate_tokens(LARGE_DOCUMENT)} токенов\n")
+        for call in usage["calls"]:
+            f.write(f"{call['chain']}: промпт {call['prompt_tokens']}, ответ {call['completion_tokens']} "
+                    f"({call['source']}{', документ обрезан' if call['trimmed'] else ''})\n")
+        f.write(f"Итого: промпт {usage['prompt_tokens']}, ответ {usage['completion_tokens']}\n")
+    print("✅ Тест завершён. Результаты сохранены в token_budget_test.txt")
+
+if __name__ == "__main__":
+    run_token_budget_test()
@@ -0,0 +1,111 @@
+# upload_cache_test.py
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils.extraction import EXTRACTION_VERSION
+from utils.upload_cache import UploadCache
+
+TEXT = "System unit DEXP Atlas. Power supply: 220 V, 50 Hz.\n" * 20
+
+# Замеры тестов для отчёта run_upload_cache_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def sha(i: int) -> str:
+    return f"{i:02d}" + "ab" * 31
+
+def entry_size(root: Path) -> int:
+    probe = UploadCache(root=root)
+    probe.put(sha(99), TEXT, {})
+    return probe.stats()["bytes"]
+
+def test_hits_and_misses():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = UploadCache(root=Path(tmp))
+        assert cache.get(sha(1)) is None
+        cache.put(sha(1), TEXT, {"document_hash": "doc1"})
+        assert cache.get(sha(1)) == {"text": TEXT, "artifacts": {"document_hash": "doc1"}}
+        # Новый экземпляр (перезапуск процесса) находит запись на диске
+        restarted = UploadCache(root=Path(tmp))
+        assert restarted.get(sha(1))["text"] == TEXT
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+        assert stats["hit_rate"] == 0.5
+
+def test_byte_budget_eviction():
+    """При переполнении удаляется запись, к которой дольше всего не обращались."""
+    with tempfile.TemporaryDirectory() as tmp:
+        size = entry_size(Path(tmp) / "probe")
+        cache = UploadCache(root=Path(tmp) / "cache", max_bytes=size * 3)
+        for i in range(3):
+            cache.put(sha(i), TEXT, {})
+            time.sleep(0.01)
+        cache.get(sha(0))
+        cache.put(sha(3), TEXT, {})
+        assert cache.get(sha(1)) is None
+        assert all(cache.get(sha(i)) for i in (0, 2, 3))
+        stats = cache.stats()
+        assert stats["evictions"] == 1 and stats["bytes"] <= stats["max_bytes"]
+        RESULTS["test_byte_budget_eviction"] = stats
+
+def test_budget_shared_between_processes():
+    """Два экземпляра (как два рабочих процесса) на одном каталоге соблюдают общий бюджет."""
+    with tempfile.TemporaryDirectory() as tmp:
+        size = entry_size(Path(tmp) / "probe")
+        root = Path(tmp) / "cache"
+        # Пересчёт каталога при каждой записи — чтобы проверить бюджет без ожидания интервала
+        first = UploadCache(root=root, max_bytes=size * 3, rescan_interval=0)
+        second = UploadCache(root=root, max_bytes=size * 3, rescan_interval=0)
+        for i in range(6):
+            (first if i % 2 else second).put(sha(i), TEXT, {})
+            time.sleep(0.01)
+        on_disk = sum(os.path.getsize(path) for path in root.glob("*/*.pkl"))
+        assert on_disk <= size * 3
+        assert first.get(sha(5)) and second.get(sha(4)) and first.get(sha(0)) is None
+        assert first.evictions + second.evictions == 3
+
+def test_key_includes_extension_and_version():
+    """Те же байты с другим расширением или после смены версии извлечения — другая запись."""
+    key = UploadCache.make_key(sha(1), "txt")
+    assert key == UploadCache.make_key(sha(1), "txt", EXTRACTION_VERSION)
+    assert key != UploadCache.make_key(sha(1), "pdf")
+    assert key != UploadCache.make_key(sha(1), "txt", EXTRACTION_VERSION + "-next")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = UploadCache(root=Path(tmp))
+        cache.put(UploadCache.make_key(sha(1), "txt", "old"), "сырой текст", {})
+        assert cache.get(key) is None
+
+def test_running_size_total():
+    """Размер ведётся нарастающим итогом: перезапись записи не удваивает его, перезапуск пересчитывает."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = UploadCache(root=Path(tmp))
+        cache.put(sha(1), TEXT, {})
+        cache.put(sha(2), TEXT, {})
+        cache.put(sha(1), TEXT, {})
+        on_disk = sum(os.path.getsize(path) for path in Path(tmp).glob("*/*.pkl"))
+        assert cache.stats()["bytes"] == on_disk and cache.stats()["entries"] == 2
+        assert UploadCache(root=Path(tmp)).stats()["bytes"] == on_disk
+
+def run_upload_cache_test():
+    test_hits_and_misses()
+    test_byte_budget_eviction()
+    stats = RESULTS["test_byte_budget_eviction"]
+    test_budget_shared_between_processes()
+    test_key_includes_extension_and_version()
+    test_running_size_total()
+    with open("upload_cache_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ДИСКОВОГО КЭША ЗАГРУЗОК (UploadCache)\n")
+        f.write("=" * 50 + "\n\n")
+        f.write("Повторная загрузка находится по хэшу, в том числе после перезапуска ✅\n")
+        f.write(f"Бюджет {stats['max_bytes']} байт, занято {stats['bytes']}, вытеснено {stats['evictions']} ✅\n")
+        f.write("Общий каталог нескольких процессов не превышает бюджет ✅\n")
+        f.write("Ключ учитывает расширение и версию конвейера извлечения ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в upload_cache_test.txt")
+
+if __name__ == "__main__":
+    run_upload_cache_test()
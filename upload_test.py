@@ -0,0 +1,146 @@
+# upload_test.py
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import httpx
+import backend
+from backend import app
+from utils.upload_cache import UploadCache
+
+# Число одновременных загрузок и размер каждого файла (символов)
+CONCURRENT_UPLOADS = 16
+DOCUMENT_CHARS = 256_000
+# Допустимая задержка event loop во время загрузок
+MAX_LOOP_LAG = 0.25
+
+# Замеры тестов для отчёта run_upload_test: pytest требует, чтобы test_* возвращали None
+RESULTS = {}
+
+def make_document(i: int) -> bytes:
+    """Уникальный текст для каждой загрузки, чтобы не попасть в кэш загрузок."""
+    line = f"Upload {i}: power supply 220 V, manufacturer DEXP, serial {i:06d}.\n"
+    return (line * (DOCUMENT_CHARS // len(line) + 1))[:DOCUMENT_CHARS].encode("utf-8")
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Максимальное опоздание периодической задачи — насколько event loop был заблокирован."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+async def measure_uploads(concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        async def upload(i: int) -> None:
+            files = {"file": ("same_name.txt", make_document(i), "text/plain")}
+            r = await client.post("/upload", files=files)
+            r.raise_for_status()
+
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(upload(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        lag = await lag_task
+
+    megabytes = concurrency * DOCUMENT_CHARS / 1024 / 1024
+    return {"elapsed": elapsed, "throughput": megabytes / elapsed, "loop_lag": lag}
+
+async def upload_oversized(limit: int) -> int:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        files = {"file": ("big.txt", b"x" * (limit + 1), "text/plain")}
+        r = await client.post("/upload", files=files)
+        return r.status_code
+
+async def upload_chunked(total: int, chunk_size: int = 64 * 1024) -> tuple:
+    """
+    Загрузка без Content-Length (Transfer-Encoding: chunked).
+    Возвращает статус и сколько байт тела сервер успел прочитать.
+    """
+    boundary = "docuaiboundary"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.txt\"\r\n"
+            f"Content-Type: text/plain\r\n\r\n").encode()
+    sent = 0
+
+    async def body():
+        nonlocal sent
+        for part in [head] + [b"x" * chunk_size] * (total // chunk_size) + [f"\r\n--{boundary}--\r\n".encode()]:
+            sent += len(part)
+            yield part
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.post("/upload", content=body(),
+                              headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        assert "content-length" not in r.request.headers
+        return r.status_code, sent
+
+def test_concurrent_uploads():
+    """Одновременные загрузки не блокируют event loop, временные файлы не остаются."""
+    uploads_before = set(os.listdir(backend.UPLOAD_DIR))
+    original_cache = backend.upload_cache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        backend.upload_cache = UploadCache(root=Path(cache_dir))
+        try:
+            single = asyncio.run(measure_uploads(1))
+            parallel = asyncio.run(measure_uploads(CONCURRENT_UPLOADS))
+        finally:
+            backend.upload_cache = original_cache
+    assert parallel["loop_lag"] < MAX_LOOP_LAG, f"event loop заблокирован на {parallel['loop_lag']:.3f} с"
+    assert set(os.listdir(backend.UPLOAD_DIR)) == uploads_before
+    RESULTS["test_concurrent_uploads"] = single, parallel
+
+def test_upload_size_limit():
+    """Файл больше MAX_UPLOAD_BYTES отклоняется с 413 (в middleware и при потоковой записи)."""
+    original = backend.MAX_UPLOAD_BYTES
+    try:
+        backend.MAX_UPLOAD_BYTES = 1024
+        # Content-Length превышает лимит — отказ до разбора multipart
+        assert asyncio.run(upload_oversized(1024 + backend.MULTIPART_OVERHEAD)) == 413
+        # Content-Length в пределах запаса — отказ при потоковой записи
+        assert asyncio.run(upload_oversized(1024)) == 413
+    finally:
+        backend.MAX_UPLOAD_BYTES = original
+
+def test_chunked_upload_size_limit():
+    """Без Content-Length тело читается только до лимита, а не целиком."""
+    original = backend.MAX_UPLOAD_BYTES
+    chunk_size = 64 * 1024
+    try:
+        backend.MAX_UPLOAD_BYTES = 1024
+        status, sent = asyncio.run(upload_chunked(50 * 1024 * 1024, chunk_size))
+    finally:
+        backend.MAX_UPLOAD_BYTES = original
+    assert status == 413
+    assert sent <= 1024 + backend.MULTIPART_OVERHEAD + 2 * chunk_size, f"прочитано {sent} байт"
+
+def run_upload_test():
+    test_concurrent_uploads()
+    single, parallel = RESULTS["test_concurrent_uploads"]
+    test_upload_size_limit()
+    test_chunked_upload_size_limit()
+    with open("upload_test.txt", "w", encoding="utf-8") as f:
+        f.write("🔍 ТЕСТ ПАРАЛЛЕЛЬНЫХ ЗАГРУЗОК /upload\n")
+        f.write("=" * 50 + "\n\n")
+        f.write(f"Размер файла: {DOCUMENT_CHARS} байт\n")
+        f.write(f"Одна загрузка: {single['elapsed']:.2f} сек, задержка loop: {single['loop_lag'] * 1000:.1f} мс\n")
+        f.write(f"{CONCURRENT_UPLOADS} одновременных загрузок: {parallel['elapsed']:.2f} сек\n")
+        f.write(f"Пропускная способность: {parallel['throughput']:.2f} МБ/с\n")
+        f.write(f"Максимальная задержка event loop: {parallel['loop_lag'] * 1000:.1f} мс\n")
+        f.write("Лимит размера: 413 ✅\n")
+        f.write("Лимит размера без Content-Length (chunked): 413 до чтения всего тела ✅\n")
+    print("✅ Тест завершён. Результаты сохранены в upload_test.txt")
+
+if __name__ == "__main__":
+    run_upload_test()
@@ -0,0 +1,201 @@
+# utils/answer_cache.py
+"""
+Кэш готовых ответов агентов.
+
+Ключ — (хэш документа, агент, версия промптов, нормализованный запрос):
+один и тот же вопрос к тому же документу повторно не отправляется в GigaChat.
+Два уровня: LRU в памяти и, если задан ANSWER_CACHE_DB, таблица SQLite,
+которая переживает перезапуск. У записей есть TTL; все ответы по документу
+можно сбросить разом (invalidate_document). Таблица SQLite ограничена
+ANSWER_CACHE_DB_MAX_ROWS: при запуске и каждые ANSWER_CACHE_PURGE_EVERY записей
+удаляются истёкшие ответы и самые давно использованные сверх лимита.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from utils.cache import TTLCache
+from utils.router import normalize_query
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2048"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+# Путь к файлу SQLite; пусто — только кэш в памяти
+ANSWER_CACHE_DB = os.getenv("ANSWER_CACHE_DB", "")
+# Максимум строк в SQLite; лишние вытесняются по времени последнего использования
+# (между очистками таблица может превысить лимит не больше чем на ANSWER_CACHE_PURGE_EVERY строк)
+ANSWER_CACHE_DB_MAX_ROWS = int(os.getenv("ANSWER_CACHE_DB_MAX_ROWS", "100000"))
+# Очистка SQLite — раз в столько записей
+ANSWER_CACHE_PURGE_EVERY = int(os.getenv("ANSWER_CACHE_PURGE_EVERY", "256"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    doc_hash TEXT NOT NULL,
+    agent TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    query TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    used_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (doc_hash, agent, prompt_version, query)
+);
+CREATE INDEX IF NOT EXISTS answers_used_at ON answers (used_at);
+"""
+
+
+class AnswerCache:
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 db_path: Optional[str] = ANSWER_CACHE_DB or None,
+                 db_max_rows: int = ANSWER_CACHE_DB_MAX_ROWS, purge_every: int = ANSWER_CACHE_PURGE_EVERY):
+        self.ttl = ttl
+        self.db_max_rows = db_max_rows
+        self.purge_every = purge_every
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.db_hits = 0
+        self.db_evictions = 0
+        self.db_expirations = 0
+        self._writes_since_purge = 0
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(answers)")}
+            if columns and "used_at" not in columns:
+                # База, созданная до вытеснения по времени использования
+                self._db.execute("ALTER TABLE answers ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+            # Записи, истёкшие или лишние за время простоя, удаляются сразу
+            self.purge_expired()
+
+    @staticmethod
+    def make_key(doc_hash: str, agent: str, version: str, query: str) -> tuple:
+        return (doc_hash, agent, version, normalize_query(query))
+
+    def _db_get(self, key: tuple) -> Optional[str]:
+        now = time.time()
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT answer, expires_at FROM answers "
+                "WHERE doc_hash = ? AND agent = ? AND prompt_version = ? AND query = ?", key
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            self._db.execute("UPDATE answers SET used_at = ? "
+                             "WHERE doc_hash = ? AND agent = ? AND prompt_version = ? AND query = ?", (now, *key))
+            self._db.commit()
+        return row[0]
+
+    def _db_set(self, key: tuple, answer: str, ttl: float) -> None:
+        now = time.time()
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (*key, answer, now + ttl, now))
+            self._db.commit()
+            self._writes_since_purge += 1
+            purge = self._writes_since_purge >= self.purge_every
+        if purge:
+            self.purge_expired()
+
+    def get(self, key: tuple) -> Optional[dict]:
+        """Возвращает {"answer", "tier": "memory" | "sqlite"} или None."""
+        answer = self._memory.get(key)
+        if answer is not None:
+            return {"answer": answer, "tier": "memory"}
+        if self._db is None:
+            return None
+        answer = self._db_get(key)
+        if answer is None:
+            return None
+        with self._db_lock:
+            self.db_hits += 1
+        self._memory.set(key, answer)
+        return {"answer": answer, "tier": "sqlite"}
+
+    def set(self, key: tuple, answer: str, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self._memory.set(key, answer, ttl)
+        if self._db is not None:
+            self._db_set(key, answer, ttl)
+
+    async def aget(self, key: tuple) -> Optional[dict]:
+        """Попадание в память — сразу; SQLite читается в потоке, чтобы не блокировать event loop."""
+        answer = self._memory.get(key)
+        if answer is not None:
+            return {"answer": answer, "tier": "memory"}
+        if self._db is None:
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: tuple, answer: str, ttl: Optional[float] = None) -> None:
+        if self._db is None:
+            self.set(key, answer, ttl)
+        else:
+            await asyncio.to_thread(self.set, key, answer, ttl)
+
+    def invalidate_document(self, doc_hash: str) -> int:
+        """Удаляет все ответы по документу; возвращает число удалённых записей."""
+        removed = self._memory.pop_matching(lambda key: key[0] == doc_hash)
+        if self._db is not None:
+            with self._db_lock:
+                cursor = self._db.execute("DELETE FROM answers WHERE doc_hash = ?", (doc_hash,))
+                self._db.commit()
+            removed = max(removed, cursor.rowcount)
+        return removed
+
+    def purge_expired(self) -> int:
+        """
+        Удаляет из SQLite записи с истёкшим TTL, затем самые давно использованные сверх db_max_rows.
+        Возвращает число удалённых записей.
+        """
+        if self._db is None:
+            return 0
+        with self._db_lock:
+            self._writes_since_purge = 0
+            expired = self._db.execute("DELETE FROM answers WHERE expires_at <= ?", (time.time(),)).rowcount
+            evicted = self._db.execute(
+                "DELETE FROM answers WHERE rowid IN (SELECT rowid FROM answers ORDER BY used_at "
+                "LIMIT max(0, (SELECT COUNT(*) FROM answers) - ?))", (self.db_max_rows,)
+            ).rowcount
+            self._db.commit()
+            self.db_expirations += expired
+            self.db_evictions += evicted
+        return expired + evicted
+
+    def clear(self) -> None:
+        self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM answers")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        stats = {"memory": self._memory.stats(), "sqlite": self._db is not None}
+        if self._db is not None:
+            with self._db_lock:
+                stats["sqlite_entries"] = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+                stats["sqlite_hits"] = self.db_hits
+                stats["sqlite_max_entries"] = self.db_max_rows
+                stats["sqlite_evictions"] = self.db_evictions
+                stats["sqlite_expirations"] = self.db_expirations
+        return stats
+
+
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
+
+
+def set_answer_cache(cache: AnswerCache) -> None:
+    """Подменяет кэш ответов (для тестов и бенчмарков)."""
+    global _answer_cache
+    _answer_cache = cache
@@ -0,0 +1,374 @@
+# utils/document_store.py
+"""
+Хранилище загруженных документов по сессиям.
+
+Каждая сессия (cookie или заголовок X-Session-Id) хранит свой извлечённый
+текст и производные данные (поисковый индекс и т.п.). Суммарный объём
+ограничен бюджетом в байтах: при переполнении вытесняются давно не
+использованные сессии (LRU), простаивающие дольше idle_ttl — удаляются.
+
+Две реализации с одинаковым интерфейсом (put, get, update_artifacts, delete, stats):
+DocumentStore — в памяти процесса; SharedDocumentStore — на общем диске с
+индексом сессий в SQLite, его видят все рабочие процессы uvicorn.
+Выбирается переменной DOCUMENT_STORE ("memory" или "shared"), см. create_document_store.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+DOCUMENT_STORE_MAX_BYTES = int(os.getenv("DOCUMENT_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+DOCUMENT_IDLE_TTL = float(os.getenv("DOCUMENT_IDLE_TTL", "3600"))
+DOCUMENT_STORE_BACKEND = os.getenv("DOCUMENT_STORE", "memory")
+DOCUMENT_STORE_DIR = Path(os.getenv("DOCUMENT_STORE_DIR", "cache/documents"))
+# Сколько памяти процесса отводится под уже прочитанные с диска документы
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Время последнего обращения сессии пишется в базу не чаще раза в столько секунд
+ACCESS_UPDATE_INTERVAL = 30.0
+
+
+class DocumentTooLarge(ValueError):
+    """Документ сам по себе не помещается в бюджет хранилища."""
+
+
+def approx_size(value) -> int:
+    """Оценка занимаемой памяти: объекты могут сообщить её сами через approx_bytes()."""
+    if hasattr(value, "approx_bytes"):
+        return value.approx_bytes()
+    if isinstance(value, dict):
+        return sum(approx_size(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class DocumentStore:
+    def __init__(self, max_bytes: int = DOCUMENT_STORE_MAX_BYTES, idle_ttl: float = DOCUMENT_IDLE_TTL):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id)
+        self.resident_bytes -= entry["size"]
+
+    def _expire_idle(self, now: float) -> None:
+        # Записи упорядочены по последнему обращению — простаивающие в начале
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if now - entry["last_access"] <= self.idle_ttl:
+                break
+            self._drop(session_id)
+            self.expirations += 1
+
+    def _evict_for(self, size: int) -> None:
+        while self._entries and self.resident_bytes + size > self.max_bytes:
+            session_id = next(iter(self._entries))
+            self._drop(session_id)
+            self.evictions += 1
+
+    def put(self, session_id: str, text: str, artifacts: Optional[dict] = None) -> None:
+        artifacts = artifacts or {}
+        size = approx_size(text) + approx_size(artifacts)
+        if size > self.max_bytes:
+            raise DocumentTooLarge(f"Документ занимает {size} байт при бюджете {self.max_bytes}")
+        now = time.monotonic()
+        with self._lock:
+            if session_id in self._entries:
+                self._drop(session_id)
+            self._expire_idle(now)
+            self._evict_for(size)
+            self._entries[session_id] = {"text": text, "artifacts": artifacts, "size": size, "last_access": now}
+            self.resident_bytes += size
+
+    def get(self, session_id: Optional[str]) -> Optional[dict]:
+        """Возвращает {"text", "artifacts"} сессии или None."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire_idle(now)
+            entry = self._entries.get(session_id) if session_id else None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["last_access"] = now
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return {"text": entry["text"], "artifacts": entry["artifacts"]}
+
+    def update_artifacts(self, session_id: str, **artifacts) -> bool:
+        """Добавляет производные данные к документу сессии (с учётом бюджета)."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return False
+            entry["artifacts"] = {**entry["artifacts"], **artifacts}
+            size = approx_size(entry["text"]) + approx_size(entry["artifacts"])
+            self.resident_bytes += size - entry["size"]
+            entry["size"] = size
+            # Текущую сессию не вытесняем: переносим её в конец очереди
+            self._entries.move_to_end(session_id)
+            while self.resident_bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._entries:
+                self._drop(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "documents": len(self._entries),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    doc_hash TEXT NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_access ON sessions (last_access);
+"""
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    # Временный файл и переименование: читатели в других процессах не увидят половину записи
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class SharedDocumentStore:
+    """
+    Документы на общем диске: текст — <root>/blobs/<hash>.txt, производные
+    данные — <hash>.pkl, сессии и размеры — в <root>/index.sqlite. Одинаковые
+    документы разных сессий хранятся один раз. Прочитанные документы каждый
+    процесс держит в памяти (DocumentStore с бюджетом cache_bytes) и перечитывает,
+    только если производные данные обновились.
+
+    Файлы пишутся и удаляются только внутри транзакции BEGIN IMMEDIATE: SQLite
+    держит блокировку записи на все процессы, поэтому процесс, удаляющий
+    документ без сессий, не может удалить файл, который другой процесс в этот
+    момент переиспользует для новой сессии.
+    """
+
+    def __init__(self, root: Path = DOCUMENT_STORE_DIR, max_bytes: int = DOCUMENT_STORE_MAX_BYTES,
+                 idle_ttl: float = DOCUMENT_IDLE_TTL, cache_bytes: int = DOCUMENT_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.root / "index.sqlite", check_same_thread=False,
+                                   isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SHARED_SCHEMA)
+        self._lock = threading.Lock()
+        self._local = DocumentStore(max_bytes=cache_bytes, idle_ttl=idle_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.disk_reads = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _text_path(self, doc_hash: str) -> Path:
+        return self.root / "blobs" / f"{doc_hash}.txt"
+
+    def _artifacts_path(self, doc_hash: str) -> Path:
+        return self.root / "blobs" / f"{doc_hash}.pkl"
+
+    def _remove_files(self, doc_hashes) -> None:
+        for doc_hash in doc_hashes:
+            for path in (self._text_path(doc_hash), self._artifacts_path(doc_hash)):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def _drop_unreferenced(self) -> list:
+        """Удаляет из индекса документы без сессий; вызывается внутри транзакции."""
+        orphans = [row[0] for row in self._db.execute(
+            "SELECT doc_hash FROM documents WHERE doc_hash NOT IN (SELECT doc_hash FROM sessions)")]
+        self._db.executemany("DELETE FROM documents WHERE doc_hash = ?", [(h,) for h in orphans])
+        return orphans
+
+    def _evict_over_budget(self, keep_session: str) -> None:
+        """Вытесняет давно не использованные сессии (кроме keep_session), пока документы не уложатся в бюджет."""
+        while self._db.execute("SELECT COALESCE(SUM(size), 0) FROM documents WHERE doc_hash IN "
+                               "(SELECT doc_hash FROM sessions)").fetchone()[0] > self.max_bytes:
+            oldest = self._db.execute("SELECT session_id FROM sessions WHERE session_id != ? "
+                                      "ORDER BY last_access LIMIT 1", (keep_session,)).fetchone()
+            if oldest is None:
+                break
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", oldest)
+            self.evictions += 1
+
+    def _transaction(self, work):
+        """
+        Выполняет work() в BEGIN IMMEDIATE и там же удаляет файлы документов без сессий.
+        Возвращает результат work().
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self._remove_files(self._drop_unreferenced())
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return result
+
+    def put(self, session_id: str, text: str, artifacts: Optional[dict] = None) -> None:
+        artifacts = artifacts or {}
+        data = text.encode("utf-8")
+        blob = pickle.dumps(artifacts, protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(data) + len(blob)
+        if size > self.max_bytes:
+            raise DocumentTooLarge(f"Документ занимает {size} байт при бюджете {self.max_bytes}")
+        doc_hash = artifacts.get("document_hash") or hashlib.sha256(data).hexdigest()
+
+        def work():
+            # Проверка и запись — под блокировкой записи: файл не удалят между ними
+            if not self._text_path(doc_hash).exists():
+                _write_atomic(self._text_path(doc_hash), data)
+            _write_atomic(self._artifacts_path(doc_hash), blob)
+            now = time.time()
+            self._db.execute("INSERT OR REPLACE INTO documents VALUES (?, ?)", (doc_hash, size))
+            self._db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (session_id, doc_hash, now))
+            expired = self._db.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.idle_ttl,))
+            self.expirations += expired.rowcount
+            self._evict_over_budget(session_id)
+
+        self._transaction(work)
+
+    def _session_hash(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT doc_hash, last_access FROM sessions WHERE session_id = ?",
+                                   (session_id,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > self.idle_ttl:
+                return None
+            if now - row[1] > ACCESS_UPDATE_INTERVAL:
+                self._db.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+            return row[0]
+
+    def get(self, session_id: Optional[str]) -> Optional[dict]:
+        """Возвращает {"text", "artifacts"} сессии или None — в любом процессе, где бы документ ни загрузили."""
+        doc_hash = self._session_hash(session_id) if session_id else None
+        try:
+            # Версия производных данных — время изменения файла: update_artifacts в другом процессе его меняет
+            version = self._artifacts_path(doc_hash).stat().st_mtime_ns if doc_hash else None
+        except FileNotFoundError:
+            version = None
+        if version is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        key = f"{doc_hash}:{version}"
+        document = self._local.get(key)
+        if document is None:
+            try:
+                text = self._text_path(doc_hash).read_text(encoding="utf-8")
+                with open(self._artifacts_path(doc_hash), "rb") as f:
+                    artifacts = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                with self._lock:
+                    self.misses += 1
+                return None
+            try:
+                self._local.put(key, text, artifacts)
+            except DocumentTooLarge:
+                pass  # больше кэша процесса — просто не кэшируем
+            document = {"text": text, "artifacts": artifacts}
+            with self._lock:
+                self.disk_reads += 1
+        with self._lock:
+            self.hits += 1
+        return document
+
+    def update_artifacts(self, session_id: str, **artifacts) -> bool:
+        """
+        Добавляет производные данные к документу сессии (с учётом бюджета: вытесняются
+        другие сессии); другие процессы увидят их при следующем get.
+        """
+        document = self.get(session_id)
+        if document is None:
+            return False
+        merged = {**document["artifacts"], **artifacts}
+        data_size = len(document["text"].encode("utf-8"))
+        doc_hash = merged.get("document_hash") or hashlib.sha256(document["text"].encode("utf-8")).hexdigest()
+        blob = pickle.dumps(merged, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def work() -> bool:
+            # Пока готовили данные, сессию могли удалить или загрузить в неё другой документ
+            row = self._db.execute("SELECT doc_hash FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None or row[0] != doc_hash:
+                return False
+            _write_atomic(self._artifacts_path(doc_hash), blob)
+            self._db.execute("UPDATE documents SET size = ? WHERE doc_hash = ?", (data_size + len(blob), doc_hash))
+            self._evict_over_budget(session_id)
+            return True
+
+        return self._transaction(work)
+
+    def delete(self, session_id: str) -> None:
+        self._transaction(lambda: self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions, documents, total = self._db.execute(
+                "SELECT (SELECT COUNT(*) FROM sessions), COUNT(*), COALESCE(SUM(size), 0) FROM documents"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "backend": "shared",
+                "sessions": sessions,
+                "documents": documents,
+                "disk_bytes": total,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_reads": self.disk_reads,
+                "process_cache": self._local.stats(),
+            }
+
+
+def create_document_store(backend: str = DOCUMENT_STORE_BACKEND):
+    """Хранилище документов по имени: "memory" (один процесс) или "shared" (несколько рабочих uvicorn)."""
+    if backend == "memory":
+        return DocumentStore()
+    if backend == "shared":
+        return SharedDocumentStore()
+    raise ValueError(f"Неизвестное хранилище документов DOCUMENT_STORE={backend!r}")
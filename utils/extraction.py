@@ -0,0 +1,146 @@
+# utils/extraction.py
+"""
+Извлечение текста из загруженных файлов в пуле процессов.
+
+Разбор PDF и санитайзер нагружают CPU и держат GIL, поэтому выполняются в
+отдельных процессах. Большой PDF делится на диапазоны страниц, диапазоны
+извлекаются параллельно и собираются обратно в исходном порядке. Страницы
+проходят через потоковый санитайзер прямо в рабочем процессе; обратно
+возвращается очищенный текст (он и хранится, и уходит в промпты) и вердикт
+безопасности.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from utils.sanitizer import iter_sanitized
+
+# Число процессов извлечения (по умолчанию — по числу ядер)
+EXTRACTION_PROCESSES = int(os.getenv("EXTRACTION_PROCESSES", str(os.cpu_count() or 1)))
+# Сколько страниц PDF обрабатывает одна задача
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+# Разделитель страниц — как у PyPDFLoader при склейке "\n\n".join(...)
+PAGE_SEPARATOR = "\n\n"
+# Размер части TXT/DOCX, подаваемой в потоковый санитайзер (символов)
+SANITIZE_CHUNK_CHARS = 1024 * 1024
+# Версия конвейера извлечения и санитайзера. Входит в ключ кэша загрузок (utils/upload_cache.py):
+# увеличивайте при изменении загрузчиков, санитайзера или индексации, чтобы старые записи не отдавались
+EXTRACTION_VERSION = "2"
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: форк процесса с потоками и event loop небезопасен
+        _pool = ProcessPoolExecutor(max_workers=EXTRACTION_PROCESSES,
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def warmup_extraction_pool() -> None:
+    """Запускает рабочие процессы заранее, чтобы первая загрузка не ждала их старта."""
+    pool = get_extraction_pool()
+    for _ in range(EXTRACTION_PROCESSES):
+        pool.submit(os.getpid)
+
+
+def shutdown_extraction_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def count_pdf_pages(file_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+def _sanitize_stream(chunks) -> Tuple[str, bool, float]:
+    """Пропускает части текста через потоковый санитайзер: (очищенный текст, безопасен ли, время)."""
+    t0 = time.process_time()
+    output = []
+    safe = True
+    for text, safe in iter_sanitized(chunks):
+        output.append(text)
+    return "".join(output), safe, time.process_time() - t0
+
+
+def extract_pdf_pages(file_path: str, start: int, stop: int) -> dict:
+    """Рабочая функция: страницы [start, stop) — очищенный текст и вердикт безопасности."""
+    from pypdf import PdfReader
+    t0 = time.process_time()
+    reader = PdfReader(file_path)
+    # Тот же режим и обрезка пробелов, что у PyPDFLoader
+    pages = [page.extract_text(extraction_mode="plain").strip() for page in reader.pages[start:stop]]
+    extract_s = time.process_time() - t0
+    sanitized, safe, sanitize_s = _sanitize_stream(
+        chunk for i, page in enumerate(pages) for chunk in ((PAGE_SEPARATOR, page) if i else (page,))
+    )
+    return {"pages": len(pages), "sanitized": sanitized, "safe": safe,
+            "extract_s": extract_s, "sanitize_s": sanitize_s}
+
+
+def extract_whole_file(file_path: str, ext: str) -> dict:
+    """Рабочая функция для TXT/DOCX: файл целиком одной задачей."""
+    t0 = time.process_time()
+    if ext == "txt":
+        from langchain_community.document_loaders import TextLoader
+        docs = TextLoader(file_path, encoding="utf-8").load()
+    elif ext == "docx":
+        from langchain_community.document_loaders import Docx2txtLoader
+        docs = Docx2txtLoader(file_path).load()
+    else:
+        raise ValueError("Неподдерживаемый формат")
+    text = PAGE_SEPARATOR.join(doc.page_content for doc in docs)
+    extract_s = time.process_time() - t0
+    sanitized, safe, sanitize_s = _sanitize_stream(
+        text[i:i + SANITIZE_CHUNK_CHARS] for i in range(0, len(text), SANITIZE_CHUNK_CHARS)
+    )
+    return {"pages": 1, "sanitized": sanitized, "safe": safe,
+            "extract_s": extract_s, "sanitize_s": sanitize_s}
+
+
+def page_ranges(total_pages: int, pages_per_task: int = PDF_PAGES_PER_TASK) -> List[Tuple[int, int]]:
+    return [(start, min(start + pages_per_task, total_pages))
+            for start in range(0, total_pages, pages_per_task)]
+
+
+async def aextract_document(file_path: str, ext: str, pool: Optional[ProcessPoolExecutor] = None,
+                            pages_per_task: int = PDF_PAGES_PER_TASK) -> dict:
+    """
+    Извлекает и очищает текст файла в пуле процессов.
+    Возвращает {"text", "sanitized_chars", "safe", "pages", "timings"}: text — очищенный
+    текст (совпадает с sanitize_extracted_text исходного), timings — суммарное по
+    процессам время разбора и санитайзинга (мс).
+    """
+    loop = asyncio.get_running_loop()
+    pool = pool or get_extraction_pool()
+    file_path = str(file_path)
+    if ext == "pdf":
+        total_pages = await loop.run_in_executor(pool, count_pdf_pages, file_path)
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(pool, extract_pdf_pages, file_path, start, stop)
+            for start, stop in page_ranges(total_pages, pages_per_task)
+        ))
+    else:
+        parts = [await loop.run_in_executor(pool, extract_whole_file, file_path, ext)]
+
+    # gather сохраняет порядок задач — диапазоны собираются в исходной последовательности.
+    # Очищенные диапазоны склеиваются через перевод строки, как строки sanitize_extracted_text
+    text = "\n".join(part["sanitized"] for part in parts if part["sanitized"])
+    return {
+        "text": text,
+        "sanitized_chars": len(text),
+        "safe": all(part["safe"] for part in parts),
+        "pages": sum(part["pages"] for part in parts),
+        "timings": {
+            "extract_cpu_ms": round(sum(part["extract_s"] for part in parts) * 1000, 1),
+            "sanitize_cpu_ms": round(sum(part["sanitize_s"] for part in parts) * 1000, 1),
+        },
+    }
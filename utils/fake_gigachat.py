@@ -0,0 +1,159 @@
+# utils/fake_gigachat.py
+"""
+Локальная заглушка GigaChat для тестов и бенчмарков без сети.
+
+Отвечает детерминированно, с искусственной задержкой, и понимает служебные
+промпты системы (диспетчер агентов, выбор роли вместе с ответом, классификатор
+отраслей), чтобы оркестратор проходил тот же путь, что и с настоящей моделью.
+Умеет изображать перегруженный сервер: ответ 429 при превышении rate_limit
+запросов в секунду и случайные ошибки с долей error_rate — так же, как их
+бросает клиент GigaChat (ResponseError).
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from gigachat.exceptions import ResponseError
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+
+def _pick_agent(query: str) -> str:
+    query = query.lower()
+    if "a/b" in query or "реклам" in query or "маркет" in query:
+        return "marketing_expert"
+    if "кратк" in query or "резюме" in query:
+        return "summarizer"
+    if "анализ" in query or "структур" in query:
+        return "document_analyst"
+    return "technical_reviewer"
+
+
+class FakeGigaChat(BaseChatModel):
+    """
+    Чат-модель с фиксированной задержкой ответа (latency, секунды).
+    В потоковом режиме первый фрагмент приходит через latency, следующие —
+    каждые token_delay секунд; обычный вызов ждёт столько же, сколько весь поток.
+    rate_limit — сколько запросов в секунду «сервер» принимает (0 — без ограничения),
+    остальные получают 429 с заголовком Retry-After; error_rate — доля запросов,
+    завершающихся ошибкой error_status (при заданном seed — воспроизводимо).
+    """
+
+    model: str = "GigaChat"
+    latency: float = 0.2
+    token_delay: float = 0.0
+    rate_limit: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    seed: Optional[int] = None
+
+    _accepted: deque = PrivateAttr(default_factory=deque)
+    _guard: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _rng: Optional[random.Random] = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gigachat"
+
+    def _check_limits(self) -> None:
+        """Решение «сервера» о запросе принимается до задержки ответа."""
+        if self.rate_limit > 0:
+            now = time.monotonic()
+            with self._guard:
+                while self._accepted and now - self._accepted[0] >= 1.0:
+                    self._accepted.popleft()
+                if len(self._accepted) >= self.rate_limit:
+                    retry_after = 1.0 - (now - self._accepted[0])
+                    raise ResponseError("fake://chat/completions", 429, b"Too Many Requests",
+                                        {"Retry-After": f"{retry_after:.3f}"})
+                self._accepted.append(now)
+        if self.error_rate:
+            with self._guard:
+                if self._rng is None:
+                    self._rng = random.Random(self.seed)
+                failed = self._rng.random() < self.error_rate
+            if failed:
+                raise ResponseError("fake://chat/completions", self.error_status, b"Fake server error", {})
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        system = messages[0].content if len(messages) > 1 else ""
+        human = messages[-1].content
+        if "сразу ответь" in system:
+            agent = _pick_agent(human)
+            return json.dumps({"agent": agent, "reasoning": "Выбор заглушки.",
+                               "answer": f"Ответ заглушки: {human[:200]}"}, ensure_ascii=False)
+        if "диспетчер" in system:
+            agent = _pick_agent(human)
+            return json.dumps({"agent": agent, "reasoning": "Выбор заглушки."}, ensure_ascii=False)
+        if "классификатор отраслей" in system:
+            return "general"
+        return f"Ответ заглушки: {human[:200]}"
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        message = AIMessage(content=self._respond(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generation_time(self, messages: List[BaseMessage]) -> float:
+        """Время полного ответа: задержка первого фрагмента и генерация остальных."""
+        if not self.token_delay:
+            return self.latency
+        tokens = len(re.findall(r"\S+\s*", self._respond(messages)))
+        return self.latency + self.token_delay * max(tokens - 1, 0)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._check_limits()
+        time.sleep(self._generation_time(messages))
+        return self._result(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._check_limits()
+        await asyncio.sleep(self._generation_time(messages))
+        return self._result(messages)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        self._check_limits()
+        time.sleep(self.latency)
+        for i, token in enumerate(re.findall(r"\S+\s*", self._respond(messages))):
+            if i and self.token_delay:
+                time.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        self._check_limits()
+        await asyncio.sleep(self.latency)
+        for i, token in enumerate(re.findall(r"\S+\s*", self._respond(messages))):
+            if i and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
@@ -0,0 +1,370 @@
+# utils/jobs.py
+"""
+Фоновые задачи агентов: POST /jobs сразу возвращает id, а ответ готовят
+рабочие корутины (не больше JOB_WORKERS одновременно, в полосе LLM "background").
+
+Очередь, документы и результаты хранятся в SQLite (JOBS_DB), поэтому задачи
+переживают перезапуск. Взятая в работу задача держит аренду (lease) с
+токеном и продлевает её, пока выполняется; если процесс упал, аренда истекает
+и задачу берёт следующий рабочий. Результат записывается, только пока токен
+аренды свой, — опоздавший рабочий не перезапишет ответ того, кто её перехватил.
+Несколько процессов могут делить один файл базы. Завершённые задачи старше
+JOB_RETENTION удаляются.
+"""
+import asyncio
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from utils.llm_scheduler import llm_lane
+
+JOBS_DB = os.getenv("JOBS_DB", "cache/jobs.sqlite")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Срок аренды задачи рабочим (сек): продлевается, пока задача выполняется
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Как часто свободный рабочий заглядывает в базу (задачи могли добавить другие процессы)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# Сколько хранятся завершённые задачи (сек) и как часто их чистить
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+JOB_PURGE_INTERVAL = float(os.getenv("JOB_PURGE_INTERVAL", "3600"))
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"done", "failed"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_documents (
+    doc_hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    artifacts BLOB
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    doc_hash TEXT NOT NULL,
+    query TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    lease_token TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+# Выполнение задачи: (текст документа, запрос, artifacts, on_event) → результат aroute_query
+JobRunner = Callable[[str, str, dict, Callable[[dict], Awaitable[None]]], Awaitable[dict]]
+
+
+class JobQueue:
+    def __init__(self, runner: JobRunner, db_path: str = JOBS_DB, workers: int = JOB_WORKERS,
+                 lease: float = JOB_LEASE, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 poll_interval: float = JOB_POLL_INTERVAL, retention: float = JOB_RETENTION,
+                 purge_interval: float = JOB_PURGE_INTERVAL):
+        self.runner = runner
+        self.workers = max(workers, 1)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.purge_interval = purge_interval
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Транзакции открываются явно (BEGIN IMMEDIATE), чтобы задачу не взяли два процесса
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "lease_token" not in columns:
+            # База, созданная до появления токенов аренды
+            self._db.execute("ALTER TABLE jobs ADD COLUMN lease_token TEXT")
+        self._db_lock = threading.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        # События выполняющихся задач: подписавшийся позже получает их с начала
+        self._history: Dict[str, List[dict]] = {}
+        self._next_purge = 0.0
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "requeued": 0, "stale": 0,
+                       "worker_errors": 0, "purged": 0}
+
+    # --- SQLite (вызывается в потоках) ---
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        """Изменяющий запрос; возвращает число затронутых строк."""
+        with self._db_lock:
+            return self._db.execute(sql, params).rowcount
+
+    def _fetch(self, sql: str, params: tuple = ()) -> list:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _insert(self, job_id: str, doc_hash: str, document_text: str, artifacts: dict, query: str) -> None:
+        blob = pickle.dumps(artifacts, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Заготовки документа могли дополниться после прошлой задачи — берём свежие
+                self._db.execute("INSERT INTO job_documents VALUES (?, ?, ?) ON CONFLICT (doc_hash) "
+                                 "DO UPDATE SET text = excluded.text, artifacts = excluded.artifacts",
+                                 (doc_hash, document_text, blob))
+                self._db.execute("INSERT INTO jobs (id, status, doc_hash, query, created_at) "
+                                 "VALUES (?, 'queued', ?, ?, ?)", (job_id, doc_hash, query, time.time()))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _fail_claimed(self, job_id: str, now: float, error: str) -> None:
+        # Вызывается внутри транзакции _claim
+        self._db.execute("UPDATE jobs SET status = 'failed', finished_at = ?, lease_until = NULL, "
+                         "lease_token = NULL, error = ? WHERE id = ?", (now, error, job_id))
+
+    def _claim(self) -> Optional[dict]:
+        """
+        Берёт самую старую задачу из очереди или задачу с истёкшей арендой.
+        Задачи, которые нельзя выполнить (исчерпаны попытки, не читаются данные
+        документа), помечаются failed, и берётся следующая.
+        """
+        now = time.time()
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._db.execute(
+                        "SELECT id, attempts FROM jobs WHERE status = 'queued' "
+                        "OR (status = 'running' AND lease_until < ?) ORDER BY created_at LIMIT 1", (now,)
+                    ).fetchone()
+                    if row is None:
+                        job = None
+                        break
+                    if row[1] >= self.max_attempts:
+                        self._fail_claimed(row[0], now, "Задача прервана слишком много раз")
+                        continue
+                    token = uuid.uuid4().hex
+                    self._db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                                     "lease_until = ?, lease_token = ?, started_at = ? WHERE id = ?",
+                                     (now + self.lease, token, now, row[0]))
+                    found = self._db.execute(
+                        "SELECT j.id, j.query, j.doc_hash, d.text, d.artifacts FROM jobs j "
+                        "JOIN job_documents d ON d.doc_hash = j.doc_hash WHERE j.id = ?", (row[0],)
+                    ).fetchone()
+                    try:
+                        if found is None:
+                            raise LookupError("документ задачи не найден")
+                        artifacts = pickle.loads(found[4]) if found[4] else {}
+                    except Exception as e:
+                        logger.warning("Задача %s: не удалось прочитать документ: %s", row[0], e)
+                        self._fail_claimed(row[0], now, f"Не удалось прочитать документ задачи: {e}")
+                        continue
+                    job = {"id": found[0], "query": found[1], "doc_hash": found[2], "text": found[3],
+                           "artifacts": artifacts, "token": token}
+                    break
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def _finish(self, job_id: str, token: str, status: str, result: Optional[dict], error: Optional[str]) -> bool:
+        """
+        Записывает итог задачи, если аренда всё ещё наша. False — задачу уже
+        перехватил другой рабочий (аренда истекла), результат отброшен.
+        """
+        return self._execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL, lease_token = NULL, result = ?, "
+            "error = ? WHERE id = ? AND status = 'running' AND lease_token = ?",
+            (status, time.time(), json.dumps(result, ensure_ascii=False) if result is not None else None,
+             error, job_id, token)
+        ) > 0
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._fetch(
+            "SELECT id, status, query, attempts, created_at, started_at, finished_at, result, error "
+            "FROM jobs WHERE id = ?", (job_id,)
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            "job_id": row[0], "status": row[1], "query": row[2], "attempts": row[3],
+            "created_at": row[4], "started_at": row[5], "finished_at": row[6],
+            "result": json.loads(row[7]) if row[7] else None, "error": row[8],
+        }
+
+    def counts(self) -> dict:
+        return dict(self._fetch("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+    def purge_finished(self, older_than: float) -> int:
+        """Удаляет завершённые задачи старше older_than секунд и документы без задач."""
+        removed = self._execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                (time.time() - older_than,))
+        self._execute("DELETE FROM job_documents WHERE doc_hash NOT IN (SELECT doc_hash FROM jobs)")
+        return removed
+
+    # --- асинхронный интерфейс ---
+
+    async def submit(self, document_text: str, artifacts: dict, query: str, doc_hash: str) -> str:
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, job_id, doc_hash, document_text, artifacts, query)
+        self._stats["submitted"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def aget(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, job_id)
+
+    async def _publish(self, job_id: str, event: dict) -> None:
+        if job_id in self._history:
+            self._history[job_id].append(event)
+        for queue in self._subscribers.get(job_id, []):
+            queue.put_nowait(event)
+
+    async def _renew_lease(self, job_id: str, token: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            renewed = await asyncio.to_thread(
+                self._execute, "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' "
+                "AND lease_token = ?", (time.time() + self.lease, job_id, token))
+            if not renewed:
+                # Аренду перехватил другой рабочий — продлевать больше нечего
+                logger.warning("Задача %s: аренда потеряна", job_id)
+                return
+
+    async def _run(self, job: dict) -> None:
+        job_id, token = job["id"], job["token"]
+        self._history[job_id] = []
+        await self._publish(job_id, {"type": "status", "status": "running"})
+        renew = asyncio.create_task(self._renew_lease(job_id, token))
+        try:
+            with llm_lane("background"):
+                result = await self.runner(job["text"], job["query"], job["artifacts"],
+                                           lambda event: self._publish(job_id, event))
+            status, error = ("failed", result["error"]) if result.get("error") else ("done", None)
+        except asyncio.CancelledError:
+            # Остановка приложения: задача вернётся в очередь и выполнится после перезапуска
+            await asyncio.shield(asyncio.to_thread(
+                self._execute, "UPDATE jobs SET status = 'queued', lease_until = NULL, lease_token = NULL, "
+                "attempts = attempts - 1 WHERE id = ? AND status = 'running' AND lease_token = ?", (job_id, token)))
+            self._stats["requeued"] += 1
+            raise
+        except Exception as e:
+            result, status, error = None, "failed", str(e)
+        finally:
+            renew.cancel()
+            self._history.pop(job_id, None)
+        if await asyncio.to_thread(self._finish, job_id, token, status, result, error):
+            self._stats["completed" if status == "done" else "failed"] += 1
+        else:
+            logger.warning("Задача %s: аренда истекла, результат отброшен", job_id)
+            self._stats["stale"] += 1
+        await self._publish(job_id, {"type": "done", **(await self.aget(job_id))})
+
+    async def _purge_if_due(self) -> None:
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        self._stats["purged"] += await asyncio.to_thread(self.purge_finished, self.retention)
+
+    async def _wait_for_work(self) -> None:
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self) -> None:
+        while True:
+            job = None
+            try:
+                await self._purge_if_due()
+                job = await asyncio.to_thread(self._claim)
+                if job is None:
+                    await self._wait_for_work()
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Ошибка базы или публикации событий не должна останавливать рабочего
+                logger.exception("Рабочий очереди задач: ошибка")
+                self._stats["worker_errors"] += 1
+                if job is not None:
+                    try:
+                        await asyncio.to_thread(self._finish, job["id"], job["token"], "failed", None, str(e))
+                    except Exception:
+                        logger.exception("Задача %s: не удалось отметить ошибку", job["id"])
+                await asyncio.sleep(self.poll_interval)
+
+    async def start(self) -> None:
+        """
+        Запускает рабочих; задачи, оставшиеся от прошлого запуска, подхватываются из базы,
+        а завершённые задачи старше retention удаляются (и затем раз в purge_interval).
+        """
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._next_purge = 0.0
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def events(self, job_id: str) -> AsyncIterator[dict]:
+        """
+        События задачи для SSE: текущий статус, затем шаги и фрагменты ответа
+        (если задачу выполняет этот процесс) и итоговое {"type": "done", ...}.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in self._history.get(job_id, []):
+            queue.put_nowait(event)
+        self._subscribers.setdefault(job_id, []).append(queue)
+        try:
+            job = await self.aget(job_id)
+            if job is None:
+                return
+            if job["status"] in TERMINAL_STATUSES:
+                yield {"type": "done", **job}
+                return
+            yield {"type": "status", "status": job["status"]}
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    # Задачу мог выполнить другой процесс — проверяем базу
+                    job = await self.aget(job_id)
+                    if job is None:
+                        # Задачу удалили (очистка завершённых) — поток заканчивается
+                        return
+                    if job["status"] in TERMINAL_STATUSES:
+                        yield {"type": "done", **job}
+                        return
+                    continue
+                yield event
+                if event["type"] == "done":
+                    return
+        finally:
+            self._subscribers[job_id].remove(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    def stats(self) -> dict:
+        return {**self._stats, "workers": len(self._tasks), "by_status": self.counts()}
+
+    async def astats(self) -> dict:
+        """stats() для обработчиков запросов: подсчёт по базе идёт в потоке, не блокируя цикл событий."""
+        return await asyncio.to_thread(self.stats)
@@ -0,0 +1,416 @@
+# utils/llm_pool.py
+"""
+Общий реестр LLM-клиентов и заранее собранных цепочек.
+
+Раньше каждый агент на каждый запрос создавал новый GigaChat: новый OAuth-токен,
+новое TLS-соединение и новый граф объектов. Теперь клиент создаётся один раз на
+процесс (на каждую модель), держит пул keep-alive соединений и обновляет токен
+заранее, до истечения срока действия. Цепочки (prompt | llm | parser)
+регистрируются агентами при импорте и собираются один раз — при старте
+приложения (warmup) или при первом обращении.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_gigachat import GigaChat
+
+from utils.llm_scheduler import get_scheduler
+from utils.metrics import LLM_TOKENS, span
+from utils.single_flight import SingleFlight
+from utils.tokens import (ANSWER_RESERVE_TOKENS, context_tokens, estimate_messages_tokens,
+                          estimate_tokens, fit_text_to_budget)
+
+DEFAULT_MODEL = "GigaChat"
+
+T = TypeVar("T")
+
+# Обработчик очередного фрагмента потокового ответа модели
+TokenCallback = Callable[[str], Awaitable[None]]
+
+# Настройки пула соединений (можно переопределить через переменные окружения)
+POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "20"))
+POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "10"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+# За сколько секунд до истечения токена запрашивать новый
+TOKEN_REFRESH_MARGIN = float(os.getenv("LLM_TOKEN_REFRESH_MARGIN", "60"))
+
+_lock = threading.Lock()
+_clients: Dict[str, GigaChat] = {}
+# id цикла событий, к которому привязан асинхронный транспорт клиента
+_client_loops: Dict[str, int] = {}
+_prompts: Dict[str, Tuple[ChatPromptTemplate, str]] = {}
+# Какой вход цепочки ужимается под бюджет токенов (обычно "document")
+_budget_inputs: Dict[str, Optional[str]] = {}
+_chains: Dict[str, object] = {}
+_stats = {
+    "client_hits": 0,
+    "client_misses": 0,
+    "chain_hits": 0,
+    "chain_misses": 0,
+    "token_refreshes": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "trimmed_prompts": 0,
+}
+# Журнал вызовов текущего запроса: arun_chain дописывает сюда токены каждого вызова
+_usage_calls: ContextVar[Optional[List[dict]]] = ContextVar("llm_usage_calls", default=None)
+# Одновременные обновления токена одного клиента — один запрос к OAuth
+_token_flight = SingleFlight()
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def _inner_client(llm: GigaChat):
+    """
+    Внутренний клиент gigachat, если он устроен так, как мы ожидаем (проверено на
+    gigachat==0.1.42.post2 из requirements.txt): httpx-клиенты — cached_property
+    _client/_aclient/_auth_aclient. Иначе None — и мы не трогаем внутренности библиотеки.
+    """
+    inner = getattr(llm, "_client", None)
+    if inner is None or not hasattr(inner, "_settings"):
+        return None
+    if not all(hasattr(type(inner), name) for name in ("_client", "_aclient", "_auth_aclient", "aclose")):
+        return None
+    return inner
+
+
+def _configure_transport(llm: GigaChat, sync: bool = True) -> None:
+    """
+    Подменяет httpx-клиенты внутри GigaChat на клиенты с нашими лимитами пула.
+    Если внутреннее устройство библиотеки изменилось — остаёмся на её настройках.
+    """
+    inner = _inner_client(llm)
+    if inner is None:
+        return
+    try:
+        from gigachat.client import _get_kwargs
+
+        kwargs = _get_kwargs(inner._settings)
+        if sync:
+            inner.__dict__["_client"] = httpx.Client(limits=_pool_limits(), **kwargs)
+        inner.__dict__["_aclient"] = httpx.AsyncClient(limits=_pool_limits(), **kwargs)
+        inner.__dict__.pop("_auth_aclient", None)
+    except (ImportError, AttributeError):
+        pass
+
+
+def _create_gigachat(model: str) -> GigaChat:
+    llm = GigaChat(
+        credentials=os.getenv("API_KEY"),
+        model=model,
+        verify_ssl_certs=False
+    )
+    _configure_transport(llm)
+    return llm
+
+
+_llm_factory: Callable[[str], GigaChat] = _create_gigachat
+
+
+def set_llm_factory(factory: Callable[[str], GigaChat]) -> None:
+    """
+    Подменяет фабрику клиентов (например, на локальную заглушку в тестах)
+    и сбрасывает уже созданные клиенты и цепочки.
+    """
+    global _llm_factory
+    with _lock:
+        _llm_factory = factory
+        _clients.clear()
+        _client_loops.clear()
+        _chains.clear()
+
+
+def get_llm(model: str = DEFAULT_MODEL) -> GigaChat:
+    """Возвращает общий для процесса клиент указанной модели."""
+    with _lock:
+        llm = _clients.get(model)
+        if llm is not None:
+            _stats["client_hits"] += 1
+            return llm
+        _stats["client_misses"] += 1
+        llm = _llm_factory(model)
+        _clients[model] = llm
+        return llm
+
+
+async def _aclose_transport(llm: GigaChat) -> None:
+    """Закрывает асинхронные httpx-клиенты GigaChat (если они уже созданы)."""
+    inner = _inner_client(llm)
+    if inner is None:
+        return
+    for name in ("_aclient", "_auth_aclient"):
+        client = inner.__dict__.pop(name, None)
+        if client is None:
+            continue
+        try:
+            await client.aclose()
+        except Exception:
+            # Цикл, в котором открыты соединения, уже закрыт — сокеты освободит сборщик мусора
+            pass
+
+
+async def _abind_to_running_loop(model: str) -> None:
+    """
+    Соединения httpx.AsyncClient принадлежат циклу событий, в котором открыты.
+    Если клиент понадобился в другом цикле, старый транспорт закрывается и
+    создаётся новый.
+    """
+    loop_id = id(asyncio.get_running_loop())
+    with _lock:
+        previous = _client_loops.get(model)
+        _client_loops[model] = loop_id
+    if previous is not None and previous != loop_id:
+        await _aclose_transport(_clients[model])
+        _configure_transport(_clients[model], sync=False)
+
+
+async def aclose_loop_clients() -> None:
+    """
+    Закрывает соединения клиентов, открытые в текущем цикле событий, — пока он
+    ещё работает. Следующий цикл получит новый транспорт.
+    """
+    loop_id = id(asyncio.get_running_loop())
+    with _lock:
+        models = [model for model, owner in _client_loops.items() if owner == loop_id]
+        for model in models:
+            del _client_loops[model]
+        clients = [_clients[model] for model in models if model in _clients]
+    for llm in clients:
+        await _aclose_transport(llm)
+        _configure_transport(llm, sync=False)
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """asyncio.run для синхронных обёрток агентов: соединения закрываются до закрытия цикла."""
+    async def main() -> T:
+        try:
+            return await coro
+        finally:
+            await aclose_loop_clients()
+
+    return asyncio.run(main())
+
+
+def _token_expires_soon(llm: GigaChat) -> bool:
+    """Истекает ли уже полученный токен в ближайшие TOKEN_REFRESH_MARGIN секунд."""
+    try:
+        inner = llm._client
+        token = inner._access_token
+        if not inner._use_auth or token is None or not token.expires_at:
+            # Токена ещё нет — библиотека получит его сама при первом вызове
+            return False
+        expires_at = token.expires_at
+        if expires_at > 10 ** 11:  # OAuth отдаёт время в миллисекундах
+            expires_at = expires_at / 1000
+        return expires_at - time.time() < TOKEN_REFRESH_MARGIN
+    except AttributeError:
+        return False
+
+
+async def _arefresh_token(llm: GigaChat) -> None:
+    # Пока вызов ждал своей очереди, токен мог обновить предыдущий
+    if not _token_expires_soon(llm):
+        return
+    await llm._client.aget_token()
+    with _lock:
+        _stats["token_refreshes"] += 1
+
+
+async def arefresh_token_if_needed(llm: GigaChat) -> None:
+    """
+    Заранее обновляет токен, чтобы запрос не упирался в 401 и повторную авторизацию.
+    Запросы, пришедшие одновременно перед истечением токена, ждут одно обновление.
+    """
+    if not _token_expires_soon(llm):
+        return
+    await _token_flight.do(("token", id(llm)), lambda publish: _arefresh_token(llm))
+
+
+def register_chain(name: str, prompt: ChatPromptTemplate, model: str = DEFAULT_MODEL,
+                   budget_input: Optional[str] = "document") -> None:
+    """
+    Регистрирует промпт агента; цепочка будет собрана один раз.
+    budget_input — вход, который сжимается или обрезается, если промпт
+    вместе с резервом под ответ не помещается в контекст модели.
+    """
+    _prompts[name] = (prompt, model)
+    _budget_inputs[name] = budget_input
+
+
+def prompt_version(*names: str) -> str:
+    """
+    Короткий хэш промптов и моделей указанных цепочек: меняется при любой правке
+    промпта, поэтому закэшированные ответы старой версии перестают находиться.
+    """
+    digest = hashlib.sha256()
+    for name in names:
+        prompt, model = _prompts[name]
+        digest.update(f"{name}|{model}|{prompt.messages!r}".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def _lookup_chain(name: str):
+    with _lock:
+        chain = _chains.get(name)
+        if chain is not None:
+            _stats["chain_hits"] += 1
+    if chain is None:
+        chain = _build_chain(name)
+    return chain
+
+
+async def aget_chain(name: str):
+    """Возвращает собранную цепочку prompt | llm | StrOutputParser по имени (для вызовов через ainvoke)."""
+    chain = _lookup_chain(name)
+    model = _prompts[name][1]
+    await _abind_to_running_loop(model)
+    await arefresh_token_if_needed(_clients[model])
+    return chain
+
+
+def track_usage() -> List[dict]:
+    """
+    Начинает учёт токенов для текущего запроса (контекста asyncio): все
+    последующие вызовы arun_chain в нём и в его подзадачах попадут в список.
+    """
+    calls: List[dict] = []
+    _usage_calls.set(calls)
+    return calls
+
+
+def summarize_usage(calls: List[dict]) -> dict:
+    return {
+        "calls": calls,
+        "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+        "completion_tokens": sum(call["completion_tokens"] for call in calls),
+    }
+
+
+def fit_inputs(name: str, inputs: dict) -> Tuple[dict, bool]:
+    """
+    Укладывает промпт цепочки в контекст модели: системный промпт и остальные
+    входы остаются как есть, под ответ резервируется ANSWER_RESERVE_TOKENS,
+    а budget_input получает оставшееся место. Возвращает (входы, был ли обрезан текст).
+    """
+    prompt, model = _prompts[name]
+    key = _budget_inputs.get(name)
+    if not key or not isinstance(inputs.get(key), str):
+        return inputs, False
+    overhead = estimate_messages_tokens(prompt.format_messages(**{**inputs, key: ""}))
+    budget = context_tokens(model) - ANSWER_RESERVE_TOKENS - overhead
+    text, trimmed = fit_text_to_budget(inputs[key], max(budget, 0))
+    if text is inputs[key]:
+        return inputs, False
+    return {**inputs, key: text}, trimmed
+
+
+def _record_usage(name: str, inputs: dict, answer: str, handler: UsageMetadataCallbackHandler,
+                  trimmed: bool) -> dict:
+    """Токены вызова: из ответа модели (usage_metadata), иначе — оценка по тексту."""
+    prompt, model = _prompts[name]
+    usage = list(handler.usage_metadata.values())
+    if usage:
+        prompt_tokens = sum(item.get("input_tokens", 0) for item in usage)
+        completion_tokens = sum(item.get("output_tokens", 0) for item in usage)
+        source = "model"
+    else:
+        prompt_tokens = estimate_messages_tokens(prompt.format_messages(**inputs))
+        completion_tokens = estimate_tokens(answer)
+        source = "estimate"
+    with _lock:
+        _stats["prompt_tokens"] += prompt_tokens
+        _stats["completion_tokens"] += completion_tokens
+        _stats["trimmed_prompts"] += trimmed
+    LLM_TOKENS.inc(prompt_tokens, chain=name, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, chain=name, kind="completion")
+    call = {
+        "chain": name,
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "source": source,
+        "trimmed": trimmed,
+    }
+    calls = _usage_calls.get()
+    if calls is not None:
+        calls.append(call)
+    return call
+
+
+async def arun_chain(name: str, inputs: dict, on_token: Optional[TokenCallback] = None) -> str:
+    """
+    Выполняет зарегистрированную цепочку. Если передан on_token — ответ
+    запрашивается через потоковый API и каждый фрагмент сразу отдаётся в on_token.
+    Документ предварительно укладывается в бюджет токенов модели (fit_inputs),
+    число токенов вызова записывается в журнал запроса (track_usage),
+    длительность и токены — в интервал llm.<имя цепочки> (utils/metrics.py).
+    Вызов идёт через планировщик (utils/llm_scheduler.py): ограничение частоты,
+    приоритет полосы запроса и повторы при 429/5xx. Потоковый ответ повторяется,
+    только пока клиенту не ушёл ни один фрагмент.
+    """
+    chain = await aget_chain(name)
+    inputs, trimmed = fit_inputs(name, inputs)
+    handler = UsageMetadataCallbackHandler()
+    config = {"callbacks": [handler]}
+    parts = []
+
+    async def call() -> str:
+        if on_token is None:
+            return await chain.ainvoke(inputs, config=config)
+        async for chunk in chain.astream(inputs, config=config):
+            parts.append(chunk)
+            await on_token(chunk)
+        return "".join(parts)
+
+    with span(f"llm.{name}") as record:
+        answer = await get_scheduler().run(call, can_retry=lambda: not parts)
+        usage = _record_usage(name, inputs, answer, handler, trimmed)
+        record.update(prompt_tokens=usage["prompt_tokens"], completion_tokens=usage["completion_tokens"])
+    return answer
+
+
+def _build_chain(name: str):
+    if name not in _prompts:
+        raise KeyError(f"Цепочка '{name}' не зарегистрирована")
+    prompt, model = _prompts[name]
+    llm = get_llm(model)
+    with _lock:
+        chain = _chains.get(name)
+        if chain is None:
+            _stats["chain_misses"] += 1
+            chain = prompt | llm | StrOutputParser()
+            _chains[name] = chain
+        return chain
+
+
+def warmup() -> None:
+    """Собирает все зарегистрированные цепочки (вызывается при старте приложения)."""
+    for name in list(_prompts):
+        with _lock:
+            built = name in _chains
+        if not built:
+            _build_chain(name)
+
+
+def get_pool_stats() -> dict:
+    """Счётчики переиспользования клиентов и цепочек."""
+    with _lock:
+        stats = dict(_stats)
+        stats["clients"] = len(_clients)
+        stats["chains"] = len(_chains)
+    return stats
@@ -0,0 +1,236 @@
+# utils/llm_scheduler.py
+"""
+Планировщик исходящих вызовов LLM: через него проходит каждый arun_chain.
+
+- token bucket — не больше LLM_RATE_LIMIT запросов в секунду (с запасом LLM_RATE_BURST);
+- не больше LLM_MAX_IN_FLIGHT одновременных вызовов; место берётся после токена
+  bucket, поэтому ожидание частоты не занимает места выполняющихся вызовов;
+- полосы приоритета: освободившееся место сначала получает "interactive" (/chat),
+  затем "batch" (/chat/batch), затем "background". Полоса задаётся на запрос
+  через llm_lane() и наследуется его подзадачами (contextvar);
+- повтор при 429, 5xx и сетевых ошибках: экспоненциальная задержка со случайным
+  разбросом (full jitter), Retry-After ответа учитывается;
+- метрики: глубина очередей, ожидание места, повторы и отказы.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+from gigachat.exceptions import ResponseError
+
+from utils.metrics import LLM_RETRIES
+
+# Полосы в порядке приоритета
+LANES = ("interactive", "batch", "background")
+
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "20"))  # запросов/сек; 0 — без ограничения
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "20"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+_lane: ContextVar[str] = ContextVar("llm_lane", default="interactive")
+
+
+@contextmanager
+def llm_lane(name: str):
+    """Все вызовы LLM внутри блока (и в созданных в нём задачах) идут в полосу name."""
+    if name not in LANES:
+        raise ValueError(f"Неизвестная полоса '{name}', допустимы: {', '.join(LANES)}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def current_lane() -> str:
+    return _lane.get()
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP-статус ошибки GigaChat/httpx, если он есть."""
+    if isinstance(error, ResponseError) and len(error.args) > 1 and isinstance(error.args[1], int):
+        return error.args[1]
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return getattr(error, "status_code", None)
+
+
+def is_retryable(error: BaseException) -> bool:
+    return error_status(error) in RETRY_STATUSES or isinstance(error, httpx.TransportError)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Значение заголовка Retry-After (секунды), если сервер его прислал."""
+    headers = None
+    if isinstance(error, ResponseError) and len(error.args) > 3:
+        headers = error.args[3]
+    elif isinstance(error, httpx.HTTPStatusError):
+        headers = error.response.headers
+    try:
+        return float(headers.get("Retry-After")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Ограничитель частоты: reserve() забирает токен и говорит, сколько ждать до него."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class LLMScheduler:
+    def __init__(self, rate: float = LLM_RATE_LIMIT, burst: int = LLM_RATE_BURST,
+                 max_in_flight: int = LLM_MAX_IN_FLIGHT, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_in_flight = max(max_in_flight, 1)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._in_flight = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._stats = {"calls": 0, "retries": 0, "throttled": 0, "server_errors": 0, "failures": 0}
+        self._waits = {lane: {"count": 0, "total_ms": 0.0, "max_ms": 0.0} for lane in LANES}
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters:
+                future = waiters.popleft()
+                # Ожидающие из уже закрытого цикла событий (например, прошлый asyncio.run) пропускаем
+                if not future.done() and not future.get_loop().is_closed():
+                    return future
+        return None
+
+    async def _acquire(self, lane: str) -> None:
+        if self._in_flight < self.max_in_flight and not any(self._waiters.values()):
+            self._in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место уже передано нам — отдаём его следующему
+                self._release()
+            elif future in self._waiters[lane]:
+                self._waiters[lane].remove(future)
+            raise
+
+    def _release(self) -> None:
+        """Место освобождается или сразу передаётся первому ожидающему с высшим приоритетом."""
+        future = self._next_waiter()
+        if future is not None:
+            future.set_result(None)
+        else:
+            self._in_flight -= 1
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        return min(delay, self.backoff_max)
+
+    def _record_wait(self, lane: str, waited_ms: float) -> None:
+        waits = self._waits[lane]
+        waits["count"] += 1
+        waits["total_ms"] += waited_ms
+        waits["max_ms"] = max(waits["max_ms"], waited_ms)
+
+    async def run(self, call: Callable[[], Awaitable[T]],
+                  can_retry: Optional[Callable[[], bool]] = None) -> T:
+        """
+        Выполняет call() по правилам планировщика. can_retry — можно ли повторять
+        после ошибки (например, пока потоковый ответ ещё не начал отдаваться клиенту).
+        """
+        lane = current_lane()
+        attempt = 0
+        while True:
+            queued = time.perf_counter()
+            # Сначала токен частоты, потом место: ждущий токена не занимает место in-flight
+            delay = self.bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            await self._acquire(lane)
+            try:
+                self._record_wait(lane, (time.perf_counter() - queued) * 1000)
+                self._stats["calls"] += 1
+                return await call()
+            except Exception as e:
+                status = error_status(e)
+                if status == 429:
+                    self._stats["throttled"] += 1
+                elif status is not None and status >= 500:
+                    self._stats["server_errors"] += 1
+                if (not is_retryable(e) or attempt >= self.max_retries
+                        or (can_retry is not None and not can_retry())):
+                    self._stats["failures"] += 1
+                    raise
+                delay = self.backoff(attempt, e)
+            finally:
+                self._release()
+            attempt += 1
+            self._stats["retries"] += 1
+            LLM_RETRIES.inc()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rate_limit": self.bucket.rate,
+            "queue_depth": {lane: len(self._waiters[lane]) for lane in LANES},
+            "wait_ms": {
+                lane: {
+                    "count": waits["count"],
+                    "avg": waits["total_ms"] / waits["count"] if waits["count"] else 0.0,
+                    "max": waits["max_ms"],
+                }
+                for lane, waits in self._waits.items()
+            },
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
+
+
+def set_scheduler(scheduler: LLMScheduler) -> None:
+    """Подменяет планировщик (для тестов и бенчмарков)."""
+    global _scheduler
+    _scheduler = scheduler
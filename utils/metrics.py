@@ -0,0 +1,186 @@
+# utils/metrics.py
+"""
+Метрики и интервалы времени (spans) этапов обработки.
+
+span("route") замеряет этап: длительность попадает в гистограмму
+docuai_stage_duration_seconds{stage="route"}, ошибка — в docuai_stage_errors_total,
+а сам интервал (stage, duration_ms, токены и прочие поля) — в журнал текущего
+запроса, если он начат через track_spans(). render() отдаёт все метрики в
+текстовом формате Prometheus (эндпоинт /metrics).
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Границы корзин гистограмм длительности (секунды): от кэша до долгого ответа LLM
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: List["_Metric"] = []
+_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with _lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with _lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # ключ меток → [счётчики корзин..., сумма, количество]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        with _lock:
+            state = self._values.get(self._key(labels))
+            return int(state[-1]) if state else 0
+
+    def _samples(self) -> List[str]:
+        with _lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(count)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(state[-1])}")
+        return lines
+
+
+def render() -> str:
+    """Все зарегистрированные метрики в текстовом формате Prometheus 0.0.4."""
+    with _lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+STAGE_SECONDS = Histogram("docuai_stage_duration_seconds", "Длительность этапов обработки", ("stage",))
+STAGE_ERRORS = Counter("docuai_stage_errors_total", "Этапы, завершившиеся ошибкой", ("stage",))
+AGENT_REQUESTS = Counter("docuai_agent_requests_total", "Запросы к агентам по результату "
+                         "(ok, error, cache, coalesced, combined, precomputed)", ("agent", "outcome"))
+LLM_TOKENS = Counter("docuai_llm_tokens_total", "Токены вызовов LLM", ("chain", "kind"))
+LLM_RETRIES = Counter("docuai_llm_retries_total", "Повторы вызовов LLM (429, 5xx, сеть)")
+
+# Журнал интервалов текущего запроса
+_spans: ContextVar[Optional[List[dict]]] = ContextVar("metric_spans", default=None)
+
+
+def track_spans() -> List[dict]:
+    """Начинает журнал интервалов для текущего запроса (контекста asyncio) и его подзадач."""
+    spans: List[dict] = []
+    _spans.set(spans)
+    return spans
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """
+    Замеряет этап. Внутри блока в полученный словарь можно дописать поля
+    (например, prompt_tokens) — они попадут в журнал вместе с duration_ms.
+    """
+    record = {"stage": stage, **fields}
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = type(e).__name__
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        record["duration_ms"] = elapsed * 1000
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append(record)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Этап, замеренный снаружи (например, CPU-время в пуле процессов)."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
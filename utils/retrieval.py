@@ -0,0 +1,130 @@
+# utils/retrieval.py
+"""
+Поиск фрагментов документа для technical_reviewer.
+
+Документ один раз (при загрузке) режется на фрагменты по абзацам и
+предложениям с перекрытием, по фрагментам строится инвертированный индекс
+BM25. На каждый вопрос в промпт уходят только top-k фрагментов, а не весь текст.
+"""
+import math
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+CHUNK_SIZE = int(os.getenv("RETRIEVAL_CHUNK_SIZE", "1000"))  # символов
+CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "200"))  # символов
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…;])\s+")
+_TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+
+STOPWORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "к", "ко", "о", "об", "от", "до", "из", "за", "для", "не", "ни",
+    "а", "но", "или", "что", "как", "это", "то", "же", "ли", "бы", "при", "у", "так", "его", "ее", "их",
+    "какой", "какая", "какое", "какие", "каких", "нужно", "можно", "документе", "указан", "указано",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Термы для BM25: нижний регистр, без стоп-слов, грубая основа (первые 6 букв)."""
+    text = text.lower().replace("ё", "е")
+    return [token[:6] for token in _TOKEN_RE.findall(text) if token not in STOPWORDS]
+
+
+def _split_units(text: str, chunk_size: int) -> List[str]:
+    """Абзацы; слишком длинные абзацы — по предложениям, слишком длинные предложения — по длине."""
+    units = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_size:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_RE.split(paragraph):
+            while len(sentence) > chunk_size:
+                units.append(sentence[:chunk_size])
+                sentence = sentence[chunk_size:]
+            if sentence.strip():
+                units.append(sentence.strip())
+    return units
+
+
+def split_into_chunks(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    Собирает абзацы/предложения во фрагменты до chunk_size символов.
+    Хвост предыдущего фрагмента (до overlap символов) повторяется в начале
+    следующего, чтобы ответ на стыке не терялся.
+    """
+    chunks = []
+    current: List[str] = []
+    length = 0
+    for unit in _split_units(text, chunk_size):
+        if current and length + len(unit) > chunk_size:
+            chunks.append("\n".join(current))
+            # Перекрытие: последние единицы текущего фрагмента
+            tail: List[str] = []
+            tail_length = 0
+            for previous in reversed(current):
+                if tail_length + len(previous) > overlap:
+                    break
+                tail.insert(0, previous)
+                tail_length += len(previous)
+            current, length = tail, tail_length
+        current.append(unit)
+        length += len(unit)
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class BM25Index:
+    """Инвертированный индекс BM25 по фрагментам документа (в памяти)."""
+
+    def __init__(self, chunks: List[str], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._lengths: List[int] = []
+        for chunk_id, chunk in enumerate(chunks):
+            terms = Counter(tokenize(chunk))
+            self._lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self._postings[term].append((chunk_id, tf))
+        n = len(chunks)
+        self._avg_length = sum(self._lengths) / n if n else 0.0
+        self._idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def approx_bytes(self) -> int:
+        """Оценка занимаемой памяти (для бюджета хранилища документов)."""
+        postings = sum(len(p) for p in self._postings.values())
+        return (sum(sys.getsizeof(chunk) for chunk in self.chunks)
+                + postings * 72 + len(self._postings) * 120 + len(self._lengths) * 36)
+
+    def search(self, query: str, k: int = TOP_K) -> List[Tuple[int, float]]:
+        """Возвращает [(номер фрагмента, score)] по убыванию релевантности."""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, tf in self._postings[term]:
+                norm = 1 - self.b + self.b * self._lengths[chunk_id] / (self._avg_length or 1)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def top_chunks(self, query: str, k: int = TOP_K) -> List[str]:
+        """Тексты top-k фрагментов в порядке следования в документе."""
+        ids = sorted(chunk_id for chunk_id, _ in self.search(query, k))
+        return [self.chunks[chunk_id] for chunk_id in ids]
+
+
+def build_retrieval_index(document_text: str) -> BM25Index:
+    return BM25Index(split_into_chunks(document_text))
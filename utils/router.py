@@ -0,0 +1,168 @@
+# utils/router.py
+"""
+Локальный роутер запросов: классификатор по ключевым словам и символьным
+n-граммам (наивный Байес), обученный на небольшом размеченном файле.
+
+Если уверенность выше порога — агент выбирается мгновенно, без обращения к
+GigaChat. Неоднозначные запросы по-прежнему уходят LLM-диспетчеру, как и
+запросы класса "general" (приветствия, разговор не о документе): примеры
+этого класса не дают вопросительным словам тянуть любую фразу к агенту.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ROUTING_EXAMPLES_PATH = Path(__file__).resolve().parent.parent / "data" / "routing_examples.jsonl"
+# Минимальная уверенность, при которой LLM-диспетчер не вызывается
+LOCAL_ROUTER_THRESHOLD = float(os.getenv("LOCAL_ROUTER_THRESHOLD", "0.8"))
+
+_WORD_RE = re.compile(r"[a-zа-я0-9/±+]+")
+
+# Класс запросов не по документу: локально агент не выбирается, решает LLM-диспетчер
+GENERAL_LABEL = "general"
+
+# Основы слов, характерные для каждого агента
+AGENT_KEYWORDS = {
+    "summarizer": ["кратк", "коротк", "резюм", "пересказ", "перескаж", "суть", "выжимк", "саммари",
+                   "суммариз", "аннотац", "главное", "в двух словах", "сократ", "tl;dr"],
+    "marketing_expert": ["a/b", "реклам", "маркет", "слоган", "продающ", "продать", "продаж", "оффер", "утп",
+                         "гипотез", "баннер"],
+    "technical_reviewer": ["как подключ", "что делать", "питани", "напряжен", "мощност", "порт", "гаранти",
+                           "температур", "не включа", "bios", "установ"],
+    "document_analyst": ["анализ", "проанализ", "структур", "компонент", "раздел", "разбор", "разбер"],
+}
+
+
+def normalize_query(text: str) -> str:
+    """Нижний регистр, ё → е, схлопнутые пробелы."""
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+def extract_features(text: str, keywords: Iterable[str] = ()) -> List[str]:
+    """Признаки запроса: основы слов, символьные 3- и 4-граммы, ключевые слова."""
+    text = normalize_query(text)
+    features = []
+    for word in _WORD_RE.findall(text):
+        features.append("w:" + word[:6])  # грубая основа — достаточно для русских окончаний
+        padded = f" {word} "
+        for n in (3, 4):
+            for i in range(len(padded) - n + 1):
+                features.append("c:" + padded[i:i + n])
+    for keyword in keywords:
+        if keyword in text:
+            features.append("k:" + keyword)
+    return features
+
+
+class NgramClassifier:
+    """
+    Мультиномиальный наивный Байес по признакам extract_features.
+    Ключевые слова классов добавляются как псевдонаблюдения с весом keyword_weight
+    и при классификации учитываются с тем же весом, что и в обучении.
+    """
+
+    def __init__(self, keywords: Optional[Dict[str, List[str]]] = None,
+                 keyword_weight: float = 4.0, alpha: float = 0.5):
+        self.keywords = keywords or {}
+        self.keyword_weight = keyword_weight
+        self.alpha = alpha
+        self._all_keywords = sorted({k for kws in self.keywords.values() for k in kws})
+        self.labels: List[str] = []
+        self._priors: Dict[str, float] = {}
+        self._counts: Dict[str, Counter] = {}
+        self._totals: Dict[str, float] = {}
+        self._vocab: set = set()
+
+    def fit(self, examples: Iterable[Tuple[str, str]]) -> "NgramClassifier":
+        counts: Dict[str, Counter] = defaultdict(Counter)
+        docs = Counter()
+        for text, label in examples:
+            counts[label].update(extract_features(text, self._all_keywords))
+            docs[label] += 1
+        for label, kws in self.keywords.items():
+            for keyword in kws:
+                counts[label]["k:" + keyword] += self.keyword_weight
+
+        self.labels = sorted(counts)
+        n_docs = sum(docs.values()) or 1
+        self._priors = {label: math.log((docs[label] + 1) / (n_docs + len(self.labels))) for label in self.labels}
+        self._counts = dict(counts)
+        self._totals = {label: sum(c.values()) for label, c in counts.items()}
+        self._vocab = set().union(*(c.keys() for c in counts.values())) if counts else set()
+        return self
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        if not self.labels:
+            return {}
+        features = [f for f in extract_features(text, self._all_keywords) if f in self._vocab]
+        if not features:
+            return {label: 1 / len(self.labels) for label in self.labels}
+
+        vocab_size = len(self._vocab)
+        weights = [self.keyword_weight if f.startswith("k:") else 1.0 for f in features]
+        # Нормируем на корень из суммарного веса признаков: иначе длинные запросы
+        # дают заведомо «уверенные» апостериорные вероятности
+        scale = 1 / math.sqrt(sum(weights))
+        scores = {}
+        for label in self.labels:
+            counts = self._counts[label]
+            denominator = self._totals[label] + self.alpha * vocab_size
+            log_likelihood = sum(
+                w * math.log((counts[f] + self.alpha) / denominator) for f, w in zip(features, weights)
+            )
+            scores[label] = self._priors[label] + log_likelihood * scale
+
+        top = max(scores.values())
+        exp_scores = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exp_scores.values())
+        return {label: value / total for label, value in exp_scores.items()}
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        proba = self.predict_proba(text)
+        label = max(proba, key=proba.get)
+        return label, proba[label]
+
+
+def load_examples(path: Path = ROUTING_EXAMPLES_PATH) -> List[Tuple[str, str]]:
+    """Читает размеченные примеры {"query": ..., "agent": ...} из JSONL."""
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                examples.append((item["query"], item["agent"]))
+    return examples
+
+
+class LocalRouter:
+    """Быстрый выбор агента без LLM; None — если запрос неоднозначный."""
+
+    def __init__(self, classifier: NgramClassifier, threshold: float = LOCAL_ROUTER_THRESHOLD):
+        self.classifier = classifier
+        self.threshold = threshold
+
+    def route(self, user_query: str) -> Optional[dict]:
+        agent_name, confidence = self.classifier.predict(user_query)
+        if confidence < self.threshold or agent_name == GENERAL_LABEL:
+            return None
+        return {
+            "agent_name": agent_name,
+            "reasoning": f"Локальный классификатор (уверенность {confidence:.2f}).",
+            "confidence": confidence,
+        }
+
+
+_local_router: Optional[LocalRouter] = None
+
+
+def get_local_router() -> LocalRouter:
+    """Обучает роутер на data/routing_examples.jsonl при первом обращении."""
+    global _local_router
+    if _local_router is None:
+        classifier = NgramClassifier(keywords=AGENT_KEYWORDS).fit(load_examples())
+        _local_router = LocalRouter(classifier)
+    return _local_router
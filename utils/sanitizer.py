@@ -1,141 +1,176 @@
 # utils/sanitizer.py
+import os
 import re
 import html
-from typing import Optional
+from typing import Iterable, Iterator, Tuple
+
+# Шаблоны JavaScript-инъекций для sanitize_text (вырезаются по очереди, в этом порядке)
+JS_PATTERNS = [
+    r'javascript\s*:',
+    r'vbscript\s*:',
+    r'expression\s*\(',
+    r'eval\s*\(',
+    r'Function\s*\(',
+    r'setTimeout\s*\(',
+    r'setInterval\s*\(',
+    r'location\s*=',
+    r'window\s*\.',
+    r'document\s*\.',
+    r'cookie\s*=',
+    r'[^A-Za-z0-9]on\w+\s*=',
+    r'alert\s*\(',
+    r'confirm\s*\(',
+    r'prompt\s*\(',
+    r'console\s*\.\s*\w+',
+    r'innerHTML\s*=',
+    r'outerHTML\s*=',
+    r'execScript\s*\(',
+    r'base64\s*,',
+    r'rm\s+-rf',
+    r'rm\s+[-/]\w*',
+]
+
+# Шаблоны для sanitize_extracted_text: строка, где есть хотя бы один, удаляется целиком
+DANGEROUS_LINE_PATTERNS = [
+    r'javascript\s*:',
+    r'vbscript\s*:',
+    r'expression\s*\(',
+    r'eval\s*\(',
+    r'Function\s*\(',
+    r'setTimeout\s*\(',
+    r'setInterval\s*\(',
+    r'location\s*=',
+    r'window\s*\.',
+    r'document\s*\.',
+    r'cookie\s*=',
+    r'on\w+\s*=',
+    r'<script',
+    r'<iframe',
+    r'alert\s*\(',
+    r'confirm\s*\(',
+    r'prompt\s*\(',
+    r'console\s*\.\s*\w+',
+    r'innerHTML\s*=',
+    r'outerHTML\s*=',
+    r'execScript\s*\(',
+    r'base64\s*,',
+    r'rm\s+-rf',
+    r'document\.cookie',
+    r'\.cookie\s*=',
+    r'localStorage\s*=',
+    r'sessionStorage\s*=',
+    r'stealCookies',      # ← явно удаляем опасные имена
+    r'sendData',          # ← даже если они остались после обрезки
+    r'session\s*=',
+]
+
+# Шаблоны компилируются один раз при импорте модуля
+_JS_RES = [re.compile(pattern, re.IGNORECASE | re.DOTALL) for pattern in JS_PATTERNS]
+
+
+def _fold_case(text: str) -> str:
+    """
+    Нижний регистр с сохранением позиций символов. Поиск без re.IGNORECASE по такой
+    копии находит те же совпадения, что и поиск с флагом по исходному тексту,
+    но в разы быстрее: движок re ищет альтернативу по первым символам веток.
+    Особые случаи: 'İ'.lower() даёт два символа, а 'ı' и 'ſ' при IGNORECASE равны 'i' и 's'.
+    """
+    return text.replace('\u0130', 'i').lower().replace('\u0131', 'i').replace('\u017f', 's')
+
+
+def _compile_folded(patterns, newline_safe: bool = False) -> "re.Pattern":
+    """Объединяет шаблоны в одну альтернативу для поиска по тексту после _fold_case."""
+    combined = "|".join(f"(?:{pattern.lower()})" for pattern in patterns)
+    if newline_safe:
+        # Текст сканируется целиком, а не построчно: \s не должен захватывать перевод строки
+        combined = combined.replace(r"\s", r"[^\S\n]")
+    return re.compile(combined, re.DOTALL)
+
+
+# Все JS-шаблоны одной альтернативой: если она не нашлась, ни одна замена ничего не изменит
+_ANY_JS_RE = _compile_folded(JS_PATTERNS)
+# Быстрая проверка каждого JS-шаблона: дорогая замена с IGNORECASE — только если есть что вырезать
+_JS_PROBES = [_compile_folded([pattern]) for pattern in JS_PATTERNS]
+# Все шаблоны строк одной альтернативой: строка опасна, если в ней есть совпадение
+_DANGEROUS_LINE_RE = _compile_folded(DANGEROUS_LINE_PATTERNS, newline_safe=True)
+# HTML-теги и недопустимые символы за один проход. Фильтр символов можно выполнять
+# до html.escape: экранирование добавляет только ASCII, а фильтр не трогает & < >
+_TAG_OR_JUNK_RE = re.compile(r'<[^>]*>|[^\u0009\u000A\u0020-\u007E\u00A0-\u00FF\u0400-\u04FF\u2000-\u206F\u2116]+')
+
+
+def _strip_tags_escape_and_normalize(text: str) -> str:
+    """Удаляет теги и «мусор», экранирует HTML, убирает пустые строки и крайние пробелы."""
+    text = html.escape(_TAG_OR_JUNK_RE.sub('', text), quote=False)
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    return '\n'.join(lines).strip()
+
 
 def sanitize_text(text: str) -> str:
     """
-    Очищает текст от потенциально опасного содержимого:
+    Очищает текст от XSS, JavaScript-инъекций и потенциально опасного содержимого:
     - HTML-теги и скрипты (XSS-защита)
     - Непечатаемые/управляющие символы
-    - Чрезмерное количество спецсимволов
     - Опасные последовательности
-    
-    Возвращает безопасный текст, пригодный для передачи в LLM.
-    """
-    # utils/sanitizer.py
 
-    """
-    Очищает текст от XSS, JavaScript-инъекций и потенциально опасного содержимого.
     Возвращает безопасный текст, пригодный для передачи в LLM и отображения в интерфейсе.
     """
     if not text or not isinstance(text, str):
         return ""
 
-    
-    # 1. Удаляем JavaScript-инъекции ДО экранирования
-    js_patterns = [
-        r'javascript\s*:',
-        r'vbscript\s*:',
-        r'expression\s*\(',
-        r'eval\s*\(',
-        r'Function\s*\(',
-        r'setTimeout\s*\(',
-        r'setInterval\s*\(',
-        r'location\s*=',
-        r'window\s*\.',
-        r'document\s*\.',
-        r'cookie\s*=',
-        r'[^A-Za-z0-9]on\w+\s*=',
-        r'alert\s*\(',
-        r'confirm\s*\(',
-        r'prompt\s*\(',
-        r'console\s*\.\s*\w+',
-        r'innerHTML\s*=',
-        r'outerHTML\s*=',
-        r'execScript\s*\(',
-        r'base64\s*,',
-        r'rm\s+-rf',
-        r'rm\s+[-/]\w*',
-    ]
-    
-    for pattern in js_patterns:
-        text = re.sub(pattern, '', text, flags=re.IGNORECASE | re.DOTALL)
-    
-    # 2. Удаляем HTML-теги (на случай, если остались)
-    text = re.sub(r'<[^>]*>', '', text)
-    
-    # 3. Экранируем остатки (защита на случай вывода в HTML)
-    text = html.escape(text, quote=False)
-    
-    # 4. Удаляем невидимые символы и "мусор"
-    text = re.sub(r'[^\u0009\u000A\u0020-\u007E\u00A0-\u00FF\u2000-\u206F]', '', text, flags=re.UNICODE)
-    
-    # 5. Очищаем пустые строки и лишние пробелы
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    text = '\n'.join(lines)
-    
-    return text.strip()
+    # 1. Удаляем JavaScript-инъекции ДО экранирования. Замены выполняются по очереди
+    # (вырезание одного шаблона может собрать другой), но только если есть что вырезать
+    folded = _fold_case(text)
+    if _ANY_JS_RE.search(folded):
+        for pattern, probe in zip(_JS_RES, _JS_PROBES):
+            if probe.search(folded):
+                text = pattern.sub('', text)
+                folded = _fold_case(text)
+
+    # 2-5. Теги, экранирование, невидимые символы, пустые строки
+    return _strip_tags_escape_and_normalize(text)
 
 
+def _drop_dangerous_lines(text: str) -> str:
+    """
+    Удаляет строки, содержащие ЛЮБОЙ опасный паттерн: один поиск по всему тексту,
+    найденная строка вырезается целиком, поиск продолжается со следующей строки.
+    """
+    folded = _fold_case(text)
+    kept = []
+    position = 0
+    while True:
+        match = _DANGEROUS_LINE_RE.search(folded, position)
+        if match is None:
+            break
+        line_start = text.rfind('\n', 0, match.start()) + 1
+        line_end = text.find('\n', match.end())
+        kept.append(text[position:line_start])
+        position = len(text) if line_end == -1 else line_end + 1
+    kept.append(text[position:])
+    return ''.join(kept)
+
 
 def sanitize_extracted_text(text: str) -> str:
     if not text or not isinstance(text, str):
         return ""
-    
-    # 1. Разбиваем текст на строки
-    lines = text.split('\n')
-    cleaned_lines = []
-    
-    # 2. Фильтруем строки: удаляем те, что содержат JS/XSS-паттерны
-    dangerous_patterns = [
-        r'javascript\s*:',
-        r'vbscript\s*:',
-        r'expression\s*\(',
-        r'eval\s*\(',
-        r'Function\s*\(',
-        r'setTimeout\s*\(',
-        r'setInterval\s*\(',
-        r'location\s*=',
-        r'window\s*\.',
-        r'document\s*\.',
-        r'cookie\s*=',
-        r'on\w+\s*=',
-        r'<script',
-        r'<iframe',
-        r'alert\s*\(',
-        r'confirm\s*\(',
-        r'prompt\s*\(',
-        r'console\s*\.\s*\w+',
-        r'innerHTML\s*=',
-        r'outerHTML\s*=',
-        r'execScript\s*\(',
-        r'base64\s*,',
-        r'rm\s+-rf',
-        r'document\.cookie',
-        r'\.cookie\s*=',
-        r'localStorage\s*=',
-        r'sessionStorage\s*=',
-        r'stealCookies',      # ← явно удаляем опасные имена
-        r'sendData',          # ← даже если они остались после обрезки
-        r'session\s*=',
-    ]
-    
-    for line in lines:
-        # Проверяем строку на наличие ЛЮБОГО опасного паттерна
-        is_safe = True
-        for pattern in dangerous_patterns:
-            if re.search(pattern, line, re.IGNORECASE):
-                is_safe = False
-                break
-        if is_safe:
-            cleaned_lines.append(line)
-    
-    # 3. Объединяем обратно
-    text = '\n'.join(cleaned_lines)
-    
-    # 4. Удаляем оставшиеся HTML-теги (на случай, если остались)
-    text = re.sub(r'<[^>]*>', '', text)
-    
-    # 5. Экранируем остатки (защита при выводе в HTML)
-    text = html.escape(text, quote=False)
-    
-    # 6. Очищаем мусор
-    text = re.sub(r'[^\u0009\u000A\u0020-\u007E\u00A0-\u00FF\u2000-\u206F]', '', text, flags=re.UNICODE)
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    text = '\n'.join(lines)
-    
-    return text.strip()
+
+    # 1-3. Удаляем строки с опасными паттернами
+    text = _drop_dangerous_lines(text)
+
+    # 4-6. Теги, экранирование, мусор, пустые строки
+    return _strip_tags_escape_and_normalize(text)
+
+
+# Опасные фрагменты для проверки is_text_safe (ищутся в тексте в нижнем регистре)
+UNSAFE_FRAGMENTS = [
+    '<script', 'vbscript:', 'expression(',
+    'eval(', 'Function(', 'setTimeout(', 'setInterval(',
+    'location=', 'window.', 'document.', 'cookie=',
+    'onload=', 'onerror=', 'onmouseover=',
+    'innerHTML=', 'outerHTML=', 'execScript(',
+    'document.cookie', '.cookie=', 'rm -rf'
+]
+_UNSAFE_OVERLAP = max(len(fragment) for fragment in UNSAFE_FRAGMENTS) - 1
 
 
 def is_text_safe(text: str, max_length: int = 100000) -> bool:
@@ -144,16 +179,94 @@ def is_text_safe(text: str, max_length: int = 100000) -> bool:
     """
     if not text or len(text) > max_length:
         return False
-    
+
     # Проверяем на наличие опасных фрагментов (даже после очистки)
-    unsafe_fragments = [
-        '<script', 'vbscript:', 'expression(',
-        'eval(', 'Function(', 'setTimeout(', 'setInterval(',
-        'location=', 'window.', 'document.', 'cookie=',
-        'onload=', 'onerror=', 'onmouseover=',
-        'innerHTML=', 'outerHTML=', 'execScript(',
-        'document.cookie', '.cookie=', 'rm -rf'
-    ]
-    
     text_lower = text.lower()
-    return not any(frag in text_lower for frag in unsafe_fragments)
\ No newline at end of file
+    return not any(frag in text_lower for frag in UNSAFE_FRAGMENTS)
+
+
+# Максимальная длина незакрытого тега, который переносится в следующий фрагмент.
+# Более длинный '<...' без '>' считается обычным текстом — иначе память не ограничена
+MAX_TAG_CHARS = int(os.getenv("SANITIZER_MAX_TAG_CHARS", "65536"))
+
+
+class StreamingSanitizer:
+    """
+    Потоковый вариант sanitize_extracted_text + is_text_safe без ограничения длины.
+
+    Текст подаётся частями (страницы, блоки строк) через feed(), очищенный текст
+    возвращается частями, в конце — close(). Склейка всех частей совпадает с
+    sanitize_extracted_text(весь текст), пока незакрытые теги короче MAX_TAG_CHARS.
+    В памяти держится только текущая часть, незаконченная строка и незакрытый тег.
+    is_safe — вердикт по всему поданному тексту на текущий момент.
+    """
+
+    def __init__(self, max_tag_chars: int = MAX_TAG_CHARS):
+        self.max_tag_chars = max_tag_chars
+        self.is_safe = True
+        self.output_chars = 0
+        self._line_tail = ""    # незаконченная последняя строка входа
+        self._tag_tail = ""     # '<...' без закрывающей '>' (уже после фильтра строк)
+        self._safety_tail = ""  # конец входа: опасный фрагмент может быть на стыке частей
+        self._emitted_any = False
+        self._in_line = False
+        self._pending_ws = ""   # пробелы в конце строки: выводятся, только если строка продолжится
+
+    def feed(self, text: str) -> str:
+        if self.is_safe:
+            text_lower = self._safety_tail + text.lower()
+            self.is_safe = not any(frag in text_lower for frag in UNSAFE_FRAGMENTS)
+            self._safety_tail = text_lower[-_UNSAFE_OVERLAP:]
+        text = self._line_tail + text
+        # Строки фильтруются только целиком: неполную последнюю оставляем до следующей части
+        cut = text.rfind('\n') + 1
+        self._line_tail = text[cut:]
+        return self._process(text[:cut], final=False)
+
+    def close(self) -> str:
+        text, self._line_tail = self._line_tail, ""
+        return self._process(text, final=True)
+
+    def _process(self, text: str, final: bool) -> str:
+        text = self._tag_tail + _drop_dangerous_lines(text)
+        self._tag_tail = ""
+        if not final:
+            # '<' после последней '>' может закрыться в следующей части — переносим
+            open_pos = text.find('<', text.rfind('>') + 1)
+            if open_pos != -1 and len(text) - open_pos <= self.max_tag_chars:
+                text, self._tag_tail = text[:open_pos], text[open_pos:]
+        text = html.escape(_TAG_OR_JUNK_RE.sub('', text), quote=False)
+        output = self._normalize_lines(text)
+        self.output_chars += len(output)
+        return output
+
+    def _normalize_lines(self, text: str) -> str:
+        """Как [line.strip() for line in ... if line.strip()], но строки могут приходить по частям."""
+        out = []
+        for i, segment in enumerate(text.split('\n')):
+            if i:
+                self._in_line = False
+                self._pending_ws = ""
+            if not self._in_line:
+                segment = segment.lstrip()
+                if not segment:
+                    continue
+                if self._emitted_any:
+                    out.append('\n')
+                self._in_line = self._emitted_any = True
+                self._pending_ws = ""
+            core = segment.rstrip()
+            if core:
+                out.append(self._pending_ws + core)
+                self._pending_ws = segment[len(core):]
+            else:
+                self._pending_ws += segment
+        return ''.join(out)
+
+
+def iter_sanitized(chunks: Iterable[str], max_tag_chars: int = MAX_TAG_CHARS) -> Iterator[Tuple[str, bool]]:
+    """Генератор: для каждой входной части — (очищенный текст, вердикт безопасности на данный момент)."""
+    sanitizer = StreamingSanitizer(max_tag_chars)
+    for chunk in chunks:
+        yield sanitizer.feed(chunk), sanitizer.is_safe
+    yield sanitizer.close(), sanitizer.is_safe
@@ -0,0 +1,60 @@
+# utils/sanitizer_reference.py
+"""
+Эталон для проверки и замеров санитайзера: прежняя (некомпилированная)
+реализация sanitize_text / sanitize_extracted_text и генератор случайных
+документов с опасными конструкциями и пограничными случаями.
+Используется sanitizer_test.py и sanitizer_benchmark.py; в приложении не нужен.
+"""
+import html
+import random
+import re
+
+from utils.sanitizer import DANGEROUS_LINE_PATTERNS, JS_PATTERNS
+
+
+def legacy_sanitize_text(text: str) -> str:
+    """Прежняя реализация sanitize_text: 22 прохода re.sub по некомпилированным шаблонам."""
+    if not text or not isinstance(text, str):
+        return ""
+    for pattern in JS_PATTERNS:
+        text = re.sub(pattern, '', text, flags=re.IGNORECASE | re.DOTALL)
+    text = re.sub(r'<[^>]*>', '', text)
+    text = html.escape(text, quote=False)
+    text = re.sub(r'[^\u0009\u000A\u0020-\u007E\u00A0-\u00FF\u0400-\u04FF\u2000-\u206F\u2116]', '', text, flags=re.UNICODE)
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    text = '\n'.join(lines)
+    return text.strip()
+
+def legacy_sanitize_extracted_text(text: str) -> str:
+    """Прежняя реализация sanitize_extracted_text: re.search каждого шаблона по каждой строке."""
+    if not text or not isinstance(text, str):
+        return ""
+    cleaned_lines = []
+    for line in text.split('\n'):
+        is_safe = True
+        for pattern in DANGEROUS_LINE_PATTERNS:
+            if re.search(pattern, line, re.IGNORECASE):
+                is_safe = False
+                break
+        if is_safe:
+            cleaned_lines.append(line)
+    text = '\n'.join(cleaned_lines)
+    text = re.sub(r'<[^>]*>', '', text)
+    text = html.escape(text, quote=False)
+    text = re.sub(r'[^\u0009\u000A\u0020-\u007E\u00A0-\u00FF\u0400-\u04FF\u2000-\u206F\u2116]', '', text, flags=re.UNICODE)
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    text = '\n'.join(lines)
+    return text.strip()
+
+# Фрагменты для случайных документов: обычный текст, опасные конструкции, пограничные случаи
+FRAGMENTS = [
+    "Power supply 220 V. ", "Производитель: ООО \"Фактор\". ", "Section 4.2 & notes ", "\n", "\n\n", "\r\n",
+    "  \t ", "<b>bold</b>", "<a href=\"javascript:steal()\">link</a>", "eval(", "eval\n(", "eval \t(",
+    "javajavascript:script:", "on", "onload =", "button", "reason=", "document.\ncookie", "document.cookie",
+    "<script>", "<iframe", "rm -rf /", "rm\n-rf", "rm /tmp", "base64,", "Session = 1", "sendData()",
+    "<", ">", "<unclosed", "\u0000", "\u200b", "\u00a0", "\u2028", "\u3000", "é", "日本", "\U0001f600",
+    "console . log", "console.\nlog", "setTimeout (", "LOCATION=", "\u017fession=", "x-oné=", "\u0130nnerHTML=", "\u0131nnerhtml =", "coo\u212aie=",
+]
+
+def random_document(rng: random.Random, fragments: int) -> str:
+    return "".join(rng.choice(FRAGMENTS) for _ in range(fragments))
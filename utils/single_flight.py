@@ -0,0 +1,96 @@
+# utils/single_flight.py
+"""
+Объединение одинаковых одновременных вызовов (single flight).
+
+Пока вызов с ключом key выполняется, повторные do(key, ...) не запускают его
+заново, а ждут тот же результат; ошибка тоже достаётся всем ждущим. Вызов идёт
+в отдельной задаче: отмена одного ждущего не мешает остальным, а когда
+отменились все — отменяется и сам вызов. Фрагменты потокового ответа
+рассылаются всем подписчикам; подключившийся позже сначала получает уже
+отправленные фрагменты.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Обработчик очередного фрагмента ответа (как TokenCallback в utils/llm_pool.py)
+TokenCallback = Callable[[str], Awaitable[None]]
+
+
+class _Flight:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.parts: List[str] = []
+        self.listeners: List[TokenCallback] = []
+
+    async def publish(self, text: str) -> None:
+        self.parts.append(text)
+        for listener in list(self.listeners):
+            await listener(text)
+
+
+def _consume_result(task: asyncio.Task) -> None:
+    # Ошибку уже получили ждущие (или их не осталось) — не пишем «exception was never retrieved»
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.leaders = 0
+        self.collapsed = 0
+
+    def _start(self, key: Hashable, fn: Callable[[TokenCallback], Awaitable[T]]) -> _Flight:
+        flight = _Flight()
+        flight.task = asyncio.get_running_loop().create_task(fn(flight.publish))
+
+        def forget(task: asyncio.Task) -> None:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            _consume_result(task)
+
+        flight.task.add_done_callback(forget)
+        self._flights[key] = flight
+        return flight
+
+    async def do(self, key: Hashable, fn: Callable[[TokenCallback], Awaitable[T]],
+                 on_token: Optional[TokenCallback] = None) -> Tuple[T, bool]:
+        """
+        Выполняет fn(publish) или присоединяется к уже идущему вызову с тем же ключом.
+        fn отдаёт фрагменты ответа через publish, они приходят в on_token.
+        Возвращает (результат, был ли он получен чужим вызовом).
+        """
+        flight = self._flights.get(key)
+        # Вызов из другого (уже завершённого) цикла событий не переиспользуем
+        shared = flight is not None and flight.task.get_loop() is asyncio.get_running_loop()
+        if shared:
+            self.collapsed += 1
+        else:
+            flight = self._start(key, fn)
+            self.leaders += 1
+        flight.waiters += 1
+        try:
+            if on_token is not None:
+                sent = 0
+                while sent < len(flight.parts):
+                    await on_token(flight.parts[sent])
+                    sent += 1
+                flight.listeners.append(on_token)
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if on_token in flight.listeners:
+                flight.listeners.remove(on_token)
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Выполняется ли сейчас вызов с ключом key в текущем цикле событий."""
+        flight = self._flights.get(key)
+        return flight is not None and flight.task.get_loop() is asyncio.get_running_loop()
+
+    def stats(self) -> dict:
+        return {"leaders": self.leaders, "collapsed": self.collapsed, "in_flight": len(self._flights)}
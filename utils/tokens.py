@@ -0,0 +1,75 @@
+# utils/tokens.py
+"""
+Оценка размера текста в токенах без обращения к токенизатору GigaChat
+и бюджет токенов промпта: место под системный промпт и ответ резервируется,
+документ сжимается или обрезается, чтобы запрос поместился в контекст модели.
+"""
+import math
+import os
+import re
+from typing import Dict, Tuple
+
+# Среднее число символов на токен для русского технического текста
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.2"))
+
+# Размер контекста моделей (токенов): промпт + ответ
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "8192"))
+MODEL_CONTEXT_TOKENS: Dict[str, int] = {
+    "GigaChat": DEFAULT_CONTEXT_TOKENS,
+}
+# Резерв под ответ модели
+ANSWER_RESERVE_TOKENS = int(os.getenv("ANSWER_RESERVE_TOKENS", "1024"))
+# Служебные токены на каждое сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+TRIM_MARKER = "\n\n… (документ обрезан, чтобы уложиться в контекст модели)"
+
+_SPACES_RE = re.compile(r"[ \t\u00a0]+")
+_BLANK_LINES_RE = re.compile(r"\n(?:[ \t]*\n){2,}")
+_BOUNDARY_RE = re.compile(r"\n\s*\n|(?<=[.!?…;])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (с запасом в большую сторону)."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def tokens_to_chars(tokens: int) -> int:
+    """Сколько символов примерно помещается в заданное число токенов."""
+    return int(tokens * CHARS_PER_TOKEN)
+
+
+def estimate_messages_tokens(messages) -> int:
+    """Оценка промпта из сообщений чата (BaseMessage с полем content)."""
+    return sum(estimate_tokens(str(message.content)) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def context_tokens(model: str) -> int:
+    return MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+
+
+def compact_text(text: str) -> str:
+    """Без потери содержания: схлопывает пробелы и серии пустых строк."""
+    text = _SPACES_RE.sub(" ", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def fit_text_to_budget(text: str, max_tokens: int) -> Tuple[str, bool]:
+    """
+    Возвращает (текст, обрезан ли). Сначала текст сжимается, и только если этого
+    мало — обрезается по границе абзаца или предложения с пометкой в конце.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    text = compact_text(text)
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    limit = max(tokens_to_chars(max_tokens - estimate_tokens(TRIM_MARKER)), 0)
+    head = text[:limit]
+    # Не режем посреди предложения, если граница есть в последней пятой части
+    boundaries = [match.start() for match in _BOUNDARY_RE.finditer(head, int(limit * 0.8))]
+    if boundaries:
+        head = head[:boundaries[-1]]
+    return head.rstrip() + TRIM_MARKER, True
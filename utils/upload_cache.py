@@ -0,0 +1,139 @@
+# utils/upload_cache.py
+"""
+Дисковый кэш обработанных загрузок с адресацией по содержимому (SHA-256).
+
+Пользователи часто загружают один и тот же файл повторно. Извлечённый текст
+и производные данные (поисковый индекс) сохраняются под хэшем исходных байт,
+расширения файла и версии конвейера извлечения (make_key), и повторная загрузка
+обходится без загрузчиков, санитайзера и индексации.
+Размер кэша ограничен; при переполнении удаляются записи, к которым дольше
+всего не обращались. Размер считается нарастающим итогом по своим записям.
+Каталог могут делить несколько рабочих процессов: время обращения хранится
+в mtime файла, и раз в UPLOAD_CACHE_RESCAN_INTERVAL секунд кэш пересчитывает
+записи по диску — бюджет соблюдается для каталога в целом с точностью
+до записей других процессов за этот интервал.
+"""
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from utils.extraction import EXTRACTION_VERSION
+
+UPLOAD_CACHE_DIR = Path(os.getenv("UPLOAD_CACHE_DIR", "cache/uploads"))
+UPLOAD_CACHE_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Как часто пересчитывать записи по диску (записи других процессов), сек
+UPLOAD_CACHE_RESCAN_INTERVAL = float(os.getenv("UPLOAD_CACHE_RESCAN_INTERVAL", "30"))
+
+
+class UploadCache:
+    def __init__(self, root: Path = UPLOAD_CACHE_DIR, max_bytes: int = UPLOAD_CACHE_MAX_BYTES,
+                 rescan_interval: float = UPLOAD_CACHE_RESCAN_INTERVAL):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # ключ → размер файла, от давно не использованных к недавним
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self._scanned_at = 0.0
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._rescan()
+
+    @staticmethod
+    def make_key(sha256: str, ext: str, version: str = EXTRACTION_VERSION) -> str:
+        """
+        Ключ записи: хэш содержимого, расширение (определяет загрузчик) и версия конвейера извлечения.
+        Записи, сделанные прежним загрузчиком или санитайзером, после смены версии не находятся.
+        """
+        return hashlib.sha256(f"{version}:{ext}:{sha256}".encode("ascii")).hexdigest()
+
+    def _rescan(self) -> None:
+        """Перечитывает записи с диска — с учётом файлов, записанных другими процессами."""
+        found = []
+        for path in self.root.glob("*/*.pkl"):
+            try:
+                stat = path.stat()
+            except OSError:
+                # Файл успел вытеснить другой процесс
+                continue
+            found.append((stat.st_mtime, path.stem, stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in found)
+        self.total_bytes = sum(self._entries.values())
+        self._scanned_at = time.monotonic()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.pkl"
+
+    def get(self, key: str) -> Optional[dict]:
+        """Возвращает {"text", "artifacts"} для ранее обработанного файла (ключ — make_key) или None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key not in self._entries:
+                # Запись другого процесса, появившаяся после пересчёта
+                self.total_bytes += size
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, text: str, artifacts: dict) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Пишем во временный файл и переименовываем — читатели не увидят половину записи
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"text": text, "artifacts": artifacts}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            if time.monotonic() - self._scanned_at >= self.rescan_interval:
+                # Записи и обращения других процессов
+                self._rescan()
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }